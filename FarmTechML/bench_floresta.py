@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""
+bench_floresta.py
+
+Compara o `predict_proba` da floresta compilada (tabelas de células e percurso nível a nível)
+com o `model.predict_proba` do scikit-learn, por tamanho de lote, e confere que as
+probabilidades são idênticas em todos os lotes medidos.
+
+Uso:
+    python bench_floresta.py [modelo_irrigacao.pkl] [repeticoes]
+"""
+
+import copy
+import sys
+import time
+import warnings
+
+import joblib
+import numpy as np
+
+from floresta_compilada import compilar_floresta
+
+TAMANHOS = (256, 1000, 5000)
+
+
+def gerar_leituras(quantidade):
+    rng = np.random.default_rng(7)
+    return np.column_stack([rng.uniform(15, 95, quantidade), rng.uniform(10, 40, quantidade),
+                            rng.uniform(40, 250, quantidade)])
+
+
+def cronometrar(funcao, repeticoes):
+    """Mediana e melhor tempo, em milissegundos."""
+    tempos = []
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        funcao()
+        tempos.append((time.perf_counter() - inicio) * 1000)
+    return float(np.median(tempos)), min(tempos)
+
+
+if __name__ == "__main__":
+    arquivo_modelo = sys.argv[1] if len(sys.argv) > 1 else "modelo_irrigacao.pkl"
+    repeticoes = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+
+    warnings.filterwarnings("ignore", message="X does not have valid feature names")
+    model = joblib.load(arquivo_modelo)
+    tabelas = compilar_floresta(model)
+    # Mesma floresta sem as tabelas de células: o caminho usado quando passam de LIMITE_CELULAS
+    percurso = copy.copy(tabelas)
+    percurso.indice = None
+    print(f"--- predict_proba: {len(tabelas.raizes)} árvores, {len(tabelas.feature)} nós, "
+          f"{len(tabelas.indice['celulas'])} células, mediana (melhor) de {repeticoes} execuções ---")
+
+    identico = True
+    for tamanho in TAMANHOS:
+        X = gerar_leituras(tamanho)
+        esperado = model.predict_proba(X)
+        identico &= np.array_equal(esperado, tabelas.predict_proba(X)) and np.array_equal(esperado,
+                                                                                         percurso.predict_proba(X))
+        linha = f"  lote {tamanho:>5}:"
+        for nome, funcao in (("scikit-learn", model.predict_proba), ("tabelas", tabelas.predict_proba),
+                             ("percurso", percurso.predict_proba)):
+            mediana, melhor = cronometrar(lambda: funcao(X), repeticoes)
+            linha += f" {nome} {mediana:7.2f} ms ({melhor:6.2f}) |"
+        print(linha.rstrip(" |"))
+    print(f"Probabilidades idênticas às do scikit-learn: {'sim' if identico else 'NÃO'}")
+    sys.exit(0 if identico else 1)
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""
+bench_persistencia.py
+
+Compara a vazão (linhas/s) de gravação na tabela 'previsoes_irrigacao':
+
+1. Padrão original: connect / INSERT / commit / close por leitura (journal padrão).
+2. Conexão de longa duração em WAL, com um commit por leitura.
+3. GravadorPrevisoes: WAL + executemany em lotes.
+
+O esquema é copiado do 'farmtech.db' para um banco temporário; o banco original não é alterado.
+
+Uso:
+    python bench_persistencia.py [linhas]
+"""
+
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from persistencia_previsoes import SQL_INSERIR, GravadorPrevisoes, abrir_conexao, garantir_esquema, linha_previsao
+
+
+def copiar_esquema(origem, destino):
+    with sqlite3.connect(f"file:{origem}?mode=ro", uri=True) as fonte:
+        comandos = [sql for (sql,) in fonte.execute(
+            "SELECT sql FROM sqlite_master WHERE type IN ('table', 'index') AND sql IS NOT NULL "
+            "AND name NOT LIKE 'sqlite_%'")]
+    conn = sqlite3.connect(destino)
+    for sql in comandos:
+        conn.execute(sql)
+    garantir_esquema(conn) # Mesmo índice em timestamp para as três medições
+    conn.close()
+
+
+def gerar_linhas(quantidade):
+    rng = np.random.default_rng(42)
+    dados = np.column_stack([rng.uniform(15, 95, quantidade), rng.uniform(10, 40, quantidade),
+                             rng.uniform(40, 250, quantidade)]).round(2)
+    return [linha_previsao({'umidade_solo': u, 'temperatura': t, 'nutrientes_N': n}, int(u < 40))
+            for u, t, n in dados.tolist()]
+
+
+def por_leitura_original(db_name, linhas):
+    for linha in linhas:
+        conn = sqlite3.connect(db_name)
+        conn.execute(SQL_INSERIR, linha)
+        conn.commit()
+        conn.close()
+
+
+def por_leitura_wal(db_name, linhas):
+    conn = abrir_conexao(db_name)
+    for linha in linhas:
+        conn.execute(SQL_INSERIR, linha)
+        conn.commit()
+    conn.close()
+
+
+def em_lotes(db_name, linhas):
+    gravador = GravadorPrevisoes(db_name)
+    for inicio in range(0, len(linhas), 50): # Chegam em grupos, como os micro-lotes do serviço de inferência
+        gravador.registrar_lote(linhas[inicio:inicio + 50])
+    gravador.fechar()
+
+
+def medir(nome, funcao, linhas, origem):
+    with tempfile.TemporaryDirectory() as diretorio:
+        db_name = os.path.join(diretorio, "bench.db")
+        copiar_esquema(origem, db_name)
+        inicio = time.perf_counter()
+        funcao(db_name, linhas)
+        decorrido = time.perf_counter() - inicio
+        with sqlite3.connect(db_name) as conn:
+            gravadas = conn.execute("SELECT COUNT(*) FROM previsoes_irrigacao").fetchone()[0]
+    print(f"  {nome:<42} {gravadas:>7} linhas em {decorrido:7.3f}s  {gravadas / decorrido:>12,.0f} linhas/s")
+
+
+if __name__ == "__main__":
+    quantidade = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    linhas = gerar_linhas(quantidade)
+    print("--- Gravação de previsões no esquema de 'farmtech.db' ---")
+    # O padrão original é ordens de grandeza mais lento: usa uma amostra menor
+    medir("connect/INSERT/commit/close por leitura", por_leitura_original, linhas[:max(1, quantidade // 20)],
+          "farmtech.db")
+    medir("conexão longa + WAL, commit por leitura", por_leitura_wal, linhas, "farmtech.db")
+    medir("WAL + executemany em lotes", em_lotes, linhas, "farmtech.db")
@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+"""
+busca_hiperparametros.py
+
+Busca de hiperparâmetros do RandomForest de irrigação com validação cruzada k-fold.
+
+- Busca em grade ou aleatória (`--aleatoria N` sorteia N combinações da grade).
+- Cada par (combinação, dobra) é uma tarefa independente, executada em um pool de
+  processos (`--n-jobs`); os dados são enviados uma vez para cada processo.
+- O resultado de cada tarefa é gravado em disco assim que termina ('busca/'), então uma
+  busca interrompida continua de onde parou e só as tarefas que faltam são executadas.
+- O ranking inclui, além da acurácia média, o tempo de treino, o tamanho da floresta e a
+  latência de previsão (scikit-learn e floresta compilada), para escolher a menor floresta
+  que acerta tanto quanto a melhor.
+
+Uso:
+    python busca_hiperparametros.py [--dados sensores_data.csv | --db farmtech.db] [--dobras 5]
+                                    [--n-jobs N] [--aleatoria N] [--registrar]
+"""
+
+import argparse
+import hashlib
+import itertools
+import json
+import os
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.metrics import accuracy_score, f1_score
+from sklearn.model_selection import ParameterGrid, ParameterSampler, StratifiedKFold
+
+from floresta_compilada import compilar_floresta
+
+FEATURES = ['umidade_solo', 'temperatura', 'nutrientes_N']
+ALVO = 'acao_irrigacao'
+
+GRADE_PADRAO = {
+    "n_estimators": [10, 25, 50, 100, 200],
+    "max_depth": [None, 6, 10, 16],
+    "min_samples_leaf": [1, 2, 5],
+    "max_features": ["sqrt", None],
+}
+
+# Estado de cada processo do pool, preenchido uma vez por `_inicializar`
+_X = None
+_y = None
+_dobras = None
+
+
+def carregar_dados(data_csv=None, db_name=None):
+    """(X, y) do CSV ou da tabela 'dados_treinamento' do SQLite."""
+    if db_name is not None:
+        with sqlite3.connect(db_name) as conn:
+            df = pd.read_sql_query(f"SELECT {', '.join(FEATURES + [ALVO])} FROM dados_treinamento", conn)
+    else:
+        df = pd.read_csv(data_csv)
+    return df[FEATURES].to_numpy(dtype=np.float64), df[ALVO].to_numpy(dtype=np.int64)
+
+
+def gerar_candidatos(grade=GRADE_PADRAO, aleatoria=None, random_state=42):
+    """Todas as combinações da grade ou, com `aleatoria`, uma amostra delas."""
+    if aleatoria:
+        total = len(ParameterGrid(grade))
+        return list(ParameterSampler(grade, n_iter=min(aleatoria, total), random_state=random_state))
+    return list(ParameterGrid(grade))
+
+
+def _chave(parametros, dobra, assinatura):
+    conteudo = json.dumps({"parametros": parametros, "dobra": dobra, "dados": assinatura}, sort_keys=True)
+    return hashlib.sha256(conteudo.encode("utf-8")).hexdigest()[:20]
+
+
+def _assinatura_dados(X, y, n_dobras, random_state):
+    # Muda se os dados ou a divisão mudarem: resultados antigos no cache deixam de valer
+    sha = hashlib.sha256(np.ascontiguousarray(X).tobytes())
+    sha.update(np.ascontiguousarray(y).tobytes())
+    sha.update(f"{n_dobras}:{random_state}".encode())
+    return sha.hexdigest()[:16]
+
+
+def _gravar_resultado(caminho, resultado):
+    temporario = f"{caminho}.tmp-{os.getpid()}"
+    with open(temporario, "w", encoding="utf-8") as f:
+        json.dump(resultado, f, ensure_ascii=False)
+    os.replace(temporario, caminho)
+
+
+def _inicializar(X, y, dobras):
+    global _X, _y, _dobras
+    _X, _y, _dobras = X, y, dobras
+
+
+def _latencia_ms(funcao, repeticoes=20):
+    melhor = float("inf")
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        funcao()
+        melhor = min(melhor, time.perf_counter() - inicio)
+    return melhor * 1000
+
+
+def _avaliar_dobra(parametros, dobra, random_state):
+    """Treina em uma dobra e mede acerto, tempo de treino e latência de previsão."""
+    treino, teste = _dobras[dobra]
+    model = RandomForestClassifier(random_state=random_state, n_jobs=1, **parametros)
+    inicio = time.perf_counter()
+    model.fit(_X[treino], _y[treino])
+    tempo_treino = time.perf_counter() - inicio
+
+    y_pred = model.predict(_X[teste])
+    floresta = compilar_floresta(model)
+    uma, lote = _X[teste][:1], _X[teste][:64]
+    return {
+        "parametros": parametros,
+        "dobra": dobra,
+        "acuracia": float(accuracy_score(_y[teste], y_pred)),
+        "f1": float(f1_score(_y[teste], y_pred)),
+        "tempo_treino_s": tempo_treino,
+        "nos": int(sum(e.tree_.node_count for e in model.estimators_)),
+        "latencia_sklearn_ms": _latencia_ms(lambda: model.predict(uma)),
+        "latencia_compilada_ms": _latencia_ms(lambda: floresta.predict(uma)),
+        "latencia_compilada_lote64_ms": _latencia_ms(lambda: floresta.predict(lote)),
+    }
+
+
+def buscar(X, y, candidatos, n_dobras=5, n_jobs=None, diretorio_cache="busca", random_state=42):
+    """
+    Executa a validação cruzada de todos os candidatos e devolve a lista de resultados por dobra.
+    Resultados já presentes em `diretorio_cache` (mesmos dados, parâmetros e dobra) são reaproveitados.
+    """
+    os.makedirs(diretorio_cache, exist_ok=True)
+    divisor = StratifiedKFold(n_splits=n_dobras, shuffle=True, random_state=random_state)
+    dobras = list(divisor.split(X, y))
+    assinatura = _assinatura_dados(X, y, n_dobras, random_state)
+
+    resultados, pendentes = [], []
+    for parametros, dobra in itertools.product(candidatos, range(n_dobras)):
+        caminho = os.path.join(diretorio_cache, f"{_chave(parametros, dobra, assinatura)}.json")
+        if os.path.exists(caminho):
+            with open(caminho, encoding="utf-8") as f:
+                resultados.append(json.load(f))
+        else:
+            pendentes.append((parametros, dobra, caminho))
+    total = len(resultados) + len(pendentes)
+    print(f"{len(candidatos)} combinação(ões) x {n_dobras} dobras: {len(resultados)} tarefa(s) no cache, "
+          f"{len(pendentes)} a executar.")
+    if not pendentes:
+        return resultados
+
+    n_jobs = os.cpu_count() if n_jobs in (None, -1) else n_jobs
+    with ProcessPoolExecutor(max_workers=n_jobs, initializer=_inicializar, initargs=(X, y, dobras)) as pool:
+        futuros = {pool.submit(_avaliar_dobra, parametros, dobra, random_state): caminho
+                   for parametros, dobra, caminho in pendentes}
+        try:
+            for futuro in as_completed(futuros):
+                resultado = futuro.result()
+                _gravar_resultado(futuros[futuro], resultado)
+                resultados.append(resultado)
+                print(f"  [{len(resultados)}/{total}] dobra {resultado['dobra']} {resultado['parametros']}: "
+                      f"acurácia {resultado['acuracia']:.4f}")
+        except KeyboardInterrupt:
+            print("⚠️ Busca interrompida; as tarefas concluídas ficam no cache e não serão refeitas.")
+            pool.shutdown(wait=False, cancel_futures=True)
+            raise
+    return resultados
+
+
+def montar_ranking(resultados):
+    """Médias por combinação, da maior para a menor acurácia (empates: menor latência compilada)."""
+    df = pd.DataFrame(resultados)
+    df["parametros"] = df["parametros"].map(lambda p: json.dumps(p, sort_keys=True))
+    ranking = df.groupby("parametros").agg(
+        acuracia=("acuracia", "mean"),
+        acuracia_desvio=("acuracia", "std"),
+        f1=("f1", "mean"),
+        tempo_treino_s=("tempo_treino_s", "mean"),
+        nos=("nos", "mean"),
+        latencia_sklearn_ms=("latencia_sklearn_ms", "median"),
+        latencia_compilada_ms=("latencia_compilada_ms", "median"),
+        latencia_compilada_lote64_ms=("latencia_compilada_lote64_ms", "median"),
+        dobras=("dobra", "count"),
+    ).reset_index()
+    return ranking.sort_values(["acuracia", "latencia_compilada_ms"], ascending=[False, True], ignore_index=True)
+
+
+def recomendar(ranking, tolerancia=None):
+    """
+    A combinação mais rápida (latência compilada) entre as que empatam com a melhor: acurácia média
+    a no máximo `tolerancia` da melhor (padrão: um desvio padrão da melhor entre as dobras).
+    """
+    melhor = ranking.iloc[0]
+    if tolerancia is None:
+        tolerancia = 0.0 if pd.isna(melhor["acuracia_desvio"]) else float(melhor["acuracia_desvio"])
+    empatadas = ranking[ranking["acuracia"] >= melhor["acuracia"] - tolerancia]
+    escolhida = empatadas.sort_values(["latencia_compilada_ms", "nos"]).iloc[0]
+    return json.loads(escolhida["parametros"]), escolhida
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Busca de hiperparâmetros com validação cruzada em paralelo.")
+    origem = parser.add_mutually_exclusive_group()
+    origem.add_argument("--dados", default="sensores_data.csv", help="CSV de treino")
+    origem.add_argument("--db", help="lê a tabela 'dados_treinamento' deste banco SQLite em vez do CSV")
+    parser.add_argument("--dobras", type=int, default=5)
+    parser.add_argument("--n-jobs", type=int, default=-1, help="processos do pool (-1: todos os núcleos)")
+    parser.add_argument("--aleatoria", type=int, help="sorteia N combinações da grade em vez de testar todas")
+    parser.add_argument("--grade", help="JSON com a grade, ex.: '{\"n_estimators\": [25, 50], \"max_depth\": [8]}'")
+    parser.add_argument("--cache", default="busca", help="diretório dos resultados por dobra e do ranking")
+    parser.add_argument("--tolerancia", type=float, help="diferença de acurácia considerada empate com a melhor")
+    parser.add_argument("--registrar", action="store_true",
+                        help="treina com a combinação recomendada e registra o modelo (só com --dados)")
+    args = parser.parse_args()
+    if args.registrar and args.db:
+        parser.error("--registrar treina a partir do CSV; use --dados.")
+
+    X, y = carregar_dados(data_csv=args.dados, db_name=args.db)
+    grade = json.loads(args.grade) if args.grade else GRADE_PADRAO
+    candidatos = gerar_candidatos(grade, args.aleatoria)
+    print(f"--- Busca de hiperparâmetros em {len(y)} linhas ---")
+    inicio = time.perf_counter()
+    resultados = buscar(X, y, candidatos, args.dobras, args.n_jobs, args.cache)
+    print(f"✅ Busca concluída em {time.perf_counter() - inicio:.1f}s.\n")
+
+    ranking = montar_ranking(resultados)
+    arquivo_ranking = os.path.join(args.cache, "ranking.csv")
+    ranking.to_csv(arquivo_ranking, index=False)
+    with pd.option_context("display.max_colwidth", 80, "display.width", 200):
+        print(ranking.head(15).to_string(float_format=lambda v: f"{v:.4f}"))
+    print(f"\n✅ Ranking completo salvo em '{arquivo_ranking}'.")
+
+    parametros, escolhida = recomendar(ranking, args.tolerancia)
+    print(f"Recomendada: {parametros} (acurácia {escolhida['acuracia']:.4f}, "
+          f"{escolhida['latencia_compilada_ms']:.3f} ms por leitura na floresta compilada, "
+          f"{escolhida['nos']:.0f} nós)")
+
+    if args.registrar:
+        from modelagem_ml import treinar_e_salvar_modelo
+        treinar_e_salvar_modelo(data_csv=args.dados, parametros=parametros)
@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+"""
+floresta_compilada.py
+
+Exporta o RandomForestClassifier treinado para tabelas de nós em arrays NumPy e o avalia
+sem scikit-learn nem pandas.
+
+Todas as árvores ficam concatenadas em arrays únicos (feature, limiar, filhos esquerdo e
+direito, probabilidades da folha). Para prever, cada árvore vira uma tabela de células: os
+limiares que ela usa em cada feature dividem o eixo em intervalos, e a combinação dos
+intervalos de uma leitura determina a folha. A previsão de um lote é uma busca binária por
+feature nos limiares de toda a floresta e alguns acessos indexados, sem percorrer nós.
+Florestas grandes demais para as tabelas (`LIMITE_CELULAS`) são percorridas nível a nível.
+
+O resultado reproduz `model.predict` bit a bit: as leituras são convertidas para float32
+antes da comparação com os limiares (como o scikit-learn faz), as probabilidades das folhas
+são normalizadas do mesmo jeito e somadas árvore a árvore na mesma ordem.
+
+Uso:
+    python floresta_compilada.py [modelo_irrigacao.pkl] [modelo_irrigacao.npz]
+    exporta o modelo, confere a equivalência com o scikit-learn e compara os tempos.
+"""
+
+import os
+import sys
+import time
+
+import numpy as np
+
+FOLHA = -1 # Valor de children_left/children_right nas folhas (TREE_LEAF do scikit-learn)
+LIMITE_CELULAS = 1 << 23 # Entradas das tabelas de células (~32 MB); acima disso a previsão percorre os nós
+BLOCO_PERCURSO = 2048    # Leituras por bloco no percurso nível a nível: os arrays de trabalho cabem no cache
+
+
+class FlorestaCompilada:
+    """Floresta de decisão em arrays: só depende do NumPy para carregar e prever."""
+
+    def __init__(self, feature, limiar, esquerda, direita, valor, raizes, classes, profundidade, n_features,
+                 features=(), indice=None):
+        self.feature = feature
+        self.limiar = limiar
+        self.esquerda = esquerda
+        self.direita = direita
+        self.valor = valor
+        self.raizes = raizes
+        self.classes_ = classes
+        self.profundidade = int(profundidade)
+        self.n_features_in_ = int(n_features)
+        self.features = tuple(str(f) for f in features)
+        self.indice = indice if indice is not None else self._indexar()
+
+    def _indexar(self):
+        """Monta as tabelas de células; devolve None se passarem de LIMITE_CELULAS entradas.
+
+        Cada limiar é trocado pela sua posição entre os limiares distintos da feature em toda a floresta:
+        x <= limiar equivale a (quantidade de limiares < x) <= posição. Numa árvore, a célula de uma leitura é
+        a combinação do intervalo de cada feature entre os limiares dessa árvore; `deslocamentos` leva a posição
+        global da leitura direto ao deslocamento da célula, e `celulas` guarda a folha de cada célula.
+        """
+        n_arvores = len(self.raizes)
+        interno = self.esquerda != FOLHA
+        fins = np.append(self.raizes[1:], len(self.feature))
+        cortes = [np.unique(self.limiar[interno & (self.feature == j)]) for j in range(self.n_features_in_)]
+        limites = np.cumsum([0] + [len(c) + 1 for c in cortes])
+        posicao = np.zeros(len(self.feature), dtype=np.intp)
+        for j, cortes_j in enumerate(cortes):
+            selecao = interno & (self.feature == j)
+            posicao[selecao] = np.searchsorted(cortes_j, self.limiar[selecao])
+
+        por_arvore, total = [], n_arvores * limites[-1]
+        for raiz, fim in zip(self.raizes, fins):
+            usados = [np.unique(posicao[raiz:fim][interno[raiz:fim] & (self.feature[raiz:fim] == j)])
+                      for j in range(self.n_features_in_)]
+            por_arvore.append(usados)
+            total += int(np.prod([len(u) + 1 for u in usados]))
+            if total > LIMITE_CELULAS:
+                return None
+
+        deslocamentos = np.zeros((n_arvores, limites[-1]), dtype=np.int32)
+        celulas, inicio = [], 0
+        for arvore, usados in enumerate(por_arvore):
+            passo, posicoes = 1, []
+            for j in reversed(range(self.n_features_in_)):
+                faixa = np.arange(limites[j + 1] - limites[j])
+                deslocamentos[arvore, limites[j]:limites[j + 1]] = np.searchsorted(usados[j], faixa) * passo
+                posicoes.append((j, passo))
+                passo *= len(usados[j]) + 1
+            deslocamentos[arvore, :limites[1]] += inicio
+            # Percorre a árvore uma vez por célula, com uma leitura representativa de cada intervalo
+            celula = np.arange(passo)
+            representante = np.zeros((self.n_features_in_, passo), dtype=np.intp)
+            for j, passo_j in posicoes:
+                intervalo = (celula // passo_j) % (len(usados[j]) + 1)
+                representante[j] = np.concatenate(([0], usados[j] + 1))[intervalo]
+            nos = np.full(passo, self.raizes[arvore])
+            for _ in range(self.profundidade):
+                esquerda = self.esquerda[nos]
+                if (esquerda == FOLHA).all():
+                    break
+                vai_esquerda = representante[self.feature[nos], celula] <= posicao[nos]
+                nos = np.where(esquerda == FOLHA, nos, np.where(vai_esquerda, esquerda, self.direita[nos]))
+            celulas.append(nos)
+            inicio += passo
+        return {"cortes": np.concatenate(cortes), "limites": limites, "deslocamentos": deslocamentos,
+                "celulas": np.concatenate(celulas).astype(np.int32)}
+
+    def _folhas(self, X):
+        # Mesma conversão do scikit-learn: float32, comparado depois com o limiar em float64
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim != 2 or X.shape[1] != self.n_features_in_:
+            raise ValueError(f"X deve ter formato (n, {self.n_features_in_}); recebido {X.shape}")
+        if self.indice is None:
+            blocos = range(0, max(1, len(X)), BLOCO_PERCURSO)
+            return np.hstack([self._percorrer(X[inicio:inicio + BLOCO_PERCURSO]) for inicio in blocos])
+        cortes, limites = self.indice["cortes"], self.indice["limites"]
+        deslocamentos = self.indice["deslocamentos"]
+        celula = None
+        for j in range(self.n_features_in_):
+            # A feature j tem len(cortes_j) + 1 intervalos: seus cortes começam em limites[j] - j
+            cortes_j = cortes[limites[j] - j:limites[j + 1] - j - 1]
+            posicoes = np.searchsorted(cortes_j, X[:, j]) + limites[j]
+            parcela = deslocamentos[:, posicoes]
+            celula = parcela if celula is None else np.add(celula, parcela, out=celula)
+        return self.indice["celulas"][celula] # (árvores, amostras)
+
+    def _percorrer(self, X):
+        """Percurso nível a nível de todas as árvores para um bloco de leituras."""
+        n_amostras = X.shape[0]
+        X = np.ascontiguousarray(X).ravel()
+        # Um caminho por par (árvore, amostra); só os que ainda não chegaram a uma folha são avaliados
+        nos = np.repeat(self.raizes, n_amostras)
+        base = np.tile(np.arange(n_amostras) * self.n_features_in_, len(self.raizes))
+        ativos = np.arange(nos.size)
+        for _ in range(self.profundidade):
+            atuais = nos[ativos]
+            esquerda = self.esquerda[atuais]
+            interno = esquerda != FOLHA
+            if not interno.all():
+                ativos, atuais, esquerda = ativos[interno], atuais[interno], esquerda[interno]
+                if not ativos.size:
+                    break
+            vai_esquerda = X[base[ativos] + self.feature[atuais]] <= self.limiar[atuais]
+            nos[ativos] = np.where(vai_esquerda, esquerda, self.direita[atuais])
+        return nos.reshape(len(self.raizes), n_amostras)
+
+    def predict_proba(self, X):
+        folhas = self._folhas(X)
+        proba = np.zeros((folhas.shape[1], self.valor.shape[1]), dtype=np.float64)
+        for folhas_arvore in folhas: # Soma na ordem das árvores, como o scikit-learn
+            proba += self.valor.take(folhas_arvore, axis=0)
+        proba /= len(self.raizes)
+        return proba
+
+    def predict(self, X):
+        return self.classes_.take(np.argmax(self.predict_proba(X), axis=1), axis=0)
+
+    def salvar(self, caminho):
+        """Grava as tabelas em um .npz sem compressão, substituindo o arquivo anterior atomicamente."""
+        temporario = f"{caminho}.tmp-{os.getpid()}"
+        with open(temporario, "wb") as f:
+            np.savez(f, feature=self.feature, limiar=self.limiar, esquerda=self.esquerda, direita=self.direita,
+                     valor=self.valor, raizes=self.raizes, classes=self.classes_,
+                     profundidade=np.int64(self.profundidade), n_features=np.int64(self.n_features_in_),
+                     features=np.array(self.features, dtype=str),
+                     **({f"indice_{nome}": tabela for nome, tabela in self.indice.items()} if self.indice else {}))
+        os.replace(temporario, caminho)
+
+    @classmethod
+    def carregar(cls, caminho):
+        with np.load(caminho, allow_pickle=False) as dados:
+            # Arquivos gravados antes das tabelas de células (ou sem elas) as montam na carga
+            indice = {nome[len("indice_"):]: dados[nome] for nome in dados.files if nome.startswith("indice_")}
+            return cls(dados["feature"], dados["limiar"], dados["esquerda"], dados["direita"], dados["valor"],
+                       dados["raizes"], dados["classes"], dados["profundidade"], dados["n_features"],
+                       dados["features"].tolist(), indice or None)
+
+
+def compilar_floresta(model):
+    """Achata as árvores de um RandomForestClassifier (uma saída) em uma FlorestaCompilada."""
+    if getattr(model, "n_outputs_", 1) != 1:
+        raise ValueError("Só florestas com uma única saída podem ser compiladas.")
+    feature, limiar, esquerda, direita, valor, raizes = [], [], [], [], [], []
+    deslocamento = 0
+    profundidade = 0
+    n_classes = len(model.classes_)
+    for estimador in model.estimators_:
+        arvore = estimador.tree_
+        # Probabilidades da folha normalizadas como em DecisionTreeClassifier.predict_proba
+        v = np.array(arvore.value[:, 0, :n_classes], dtype=np.float64)
+        normalizador = v.sum(axis=1)
+        normalizador[normalizador == 0.0] = 1.0
+        v /= normalizador[:, None]
+
+        folha = arvore.children_left == FOLHA
+        raizes.append(deslocamento)
+        feature.append(np.where(folha, 0, arvore.feature)) # Folhas: índice válido qualquer, nunca usado
+        limiar.append(arvore.threshold)
+        esquerda.append(np.where(folha, FOLHA, arvore.children_left + deslocamento))
+        direita.append(np.where(folha, FOLHA, arvore.children_right + deslocamento))
+        valor.append(v)
+        deslocamento += arvore.node_count
+        profundidade = max(profundidade, arvore.max_depth)
+
+    return FlorestaCompilada(
+        feature=np.concatenate(feature).astype(np.intp),
+        limiar=np.concatenate(limiar).astype(np.float64),
+        esquerda=np.concatenate(esquerda).astype(np.intp),
+        direita=np.concatenate(direita).astype(np.intp),
+        valor=np.concatenate(valor),
+        raizes=np.array(raizes, dtype=np.intp),
+        classes=np.asarray(model.classes_),
+        profundidade=profundidade,
+        n_features=model.n_features_in_,
+        features=getattr(model, "feature_names_in_", ()),
+    )
+
+
+def _cronometrar(funcao, repeticoes=5):
+    melhor = float("inf")
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        funcao()
+        melhor = min(melhor, time.perf_counter() - inicio)
+    return melhor
+
+
+if __name__ == "__main__":
+    arquivo_modelo = sys.argv[1] if len(sys.argv) > 1 else "modelo_irrigacao.pkl"
+    arquivo_compilado = sys.argv[2] if len(sys.argv) > 2 else "modelo_irrigacao.npz"
+
+    import warnings
+    import joblib
+
+    print(f"--- Compilando '{arquivo_modelo}' para '{arquivo_compilado}'... ---")
+    model = joblib.load(arquivo_modelo)
+    compilar_floresta(model).salvar(arquivo_compilado)
+
+    inicio = time.perf_counter()
+    floresta = FlorestaCompilada.carregar(arquivo_compilado)
+    print(f"Carregada em {(time.perf_counter() - inicio) * 1000:.2f} ms: {len(floresta.raizes)} árvores, "
+          f"{len(floresta.feature)} nós, profundidade máxima {floresta.profundidade}.")
+
+    # Conferência: leituras na faixa dos sensores, nos limiares exatos e fora da faixa de treino
+    rng = np.random.default_rng(0)
+    X = np.column_stack([rng.uniform(15, 95, 20000), rng.uniform(10, 40, 20000), rng.uniform(40, 250, 20000)])
+    X = np.vstack([X, rng.uniform(-50, 300, (5000, 3)), np.repeat(floresta.limiar[:, None], 3, axis=1)[:5000]])
+    with warnings.catch_warnings():
+        warnings.filterwarnings("ignore", message="X does not have valid feature names")
+        esperado = model.predict(X)
+        proba_esperada = model.predict_proba(X)
+        identico = np.array_equal(esperado, floresta.predict(X)) and np.array_equal(proba_esperada,
+                                                                                   floresta.predict_proba(X))
+        print(f"Equivalência com o scikit-learn em {len(X)} leituras: {'idêntica' if identico else 'DIVERGENTE'}")
+        for tamanho in (1, 64, 1024):
+            lote = X[:tamanho]
+            t_sklearn = _cronometrar(lambda: model.predict(lote))
+            t_compilado = _cronometrar(lambda: floresta.predict(lote))
+            print(f"  lote {tamanho:>5}: scikit-learn {t_sklearn * 1000:8.2f} ms | compilada {t_compilado * 1000:8.2f} ms")
+    sys.exit(0 if identico else 1)
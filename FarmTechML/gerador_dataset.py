@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+"""
+gerador_dataset.py
+
+Gera datasets sintéticos de sensores em grande escala (10^7 a 10^8 linhas) com memória
+constante, para benchmarks de carga, rollups e treinamento.
+
+- Os dispositivos são divididos em `partes`; cada parte tem um gerador de números aleatórios
+  independente (`SeedSequence(semente).spawn`), então o resultado depende só da semente e
+  do número de partes, não de quantos processos são usados.
+- Cada parte é gerada em blocos de tempo: só um bloco (cerca de `tamanho_bloco` linhas) fica
+  em memória, e é gravado antes do próximo ser gerado.
+- As leituras de cada dispositivo têm correlação temporal: um processo AR(1) em torno de um
+  nível próprio do dispositivo, mais o ciclo diário (temperatura mais alta e solo mais seco à
+  tarde). O alvo segue a mesma regra de `gerar_dataset`: irrigar se umidade + ruído < 40.
+- Parquet: um arquivo por parte ('parte-00000.parquet'), um row group por bloco, gravados em
+  paralelo por um pool de processos. SQLite: um `executemany` por bloco em um único banco
+  (o SQLite aceita um escritor por vez, então as partes são gravadas em sequência).
+
+Uso:
+    python gerador_dataset.py --linhas 10000000 --dispositivos 10000 --formato parquet --saida dataset
+    python gerador_dataset.py --linhas 1000000 --formato sqlite --saida sinteticos.db --tabela dados_treinamento
+"""
+
+import argparse
+import math
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from scipy.signal import lfilter
+
+from persistencia_previsoes import abrir_conexao
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+COLUNAS = ['dispositivo', 'timestamp', 'umidade_solo', 'temperatura', 'nutrientes_N', 'acao_irrigacao']
+
+# Coeficiente e desvio do ruído de cada processo AR(1), por passo de tempo
+AR_UMIDADE = (0.98, 1.2)
+AR_TEMPERATURA = (0.95, 0.6)
+AR_NUTRIENTES = (0.995, 1.5)
+
+SQL_TABELA = """
+CREATE TABLE IF NOT EXISTS {tabela} (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    dispositivo TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    umidade_solo REAL NOT NULL,
+    temperatura REAL NOT NULL,
+    nutrientes_N REAL NOT NULL,
+    acao_irrigacao INTEGER NOT NULL
+);
+"""
+
+
+def dividir_partes(n_dispositivos, partes):
+    """Faixas [inicio, fim) de dispositivos de cada parte."""
+    limites = np.linspace(0, n_dispositivos, partes + 1).astype(int)
+    return [(int(a), int(b)) for a, b in zip(limites[:-1], limites[1:]) if b > a]
+
+
+def _estacionario(rng, ar, n):
+    phi, desvio = ar
+    return rng.normal(0, desvio / math.sqrt(1 - phi ** 2), n)
+
+
+def _fluxos(semente, quantidade):
+    # Filhos determinísticos da semente (ao contrário de `spawn`, não dependem de chamadas anteriores)
+    return [np.random.default_rng(np.random.SeedSequence(semente.entropy, spawn_key=semente.spawn_key + (i,)))
+            for i in range(quantidade)]
+
+
+def _ar1(rng, ar, estado, passos):
+    """Continua o AR(1) de cada dispositivo (linhas) por `passos` passos; atualiza `estado`."""
+    phi, desvio = ar
+    # Sorteado na ordem do tempo: o resultado não depende de como os passos são divididos em blocos
+    ruido = rng.normal(0, desvio, (passos, len(estado))).T
+    serie, _ = lfilter([1.0], [1.0, -phi], ruido, axis=1, zi=(phi * estado)[:, None])
+    estado[:] = serie[:, -1]
+    return serie
+
+
+def gerar_blocos(semente, dispositivos, passos_totais, tamanho_bloco=1_000_000, inicio="2024-01-01",
+                 intervalo_s=300):
+    """
+    Gera os blocos de uma parte: dicionários coluna -> array, em ordem de tempo (todos os
+    dispositivos no instante t, depois t + 1). `semente` é uma SeedSequence e `dispositivos`
+    a faixa (inicio, fim) de ids.
+    """
+    # Um fluxo por variável, para que o mesmo passo receba os mesmos sorteios com qualquer tamanho de bloco
+    rng_niveis, rng_umidade, rng_temperatura, rng_nutrientes, rng_alvo = _fluxos(semente, 5)
+    ids = np.arange(*dispositivos)
+    n = len(ids)
+    # Nível próprio de cada dispositivo (tipo de solo, microclima, adubação)
+    nivel_umidade = rng_niveis.uniform(30, 80, n)
+    nivel_temperatura = rng_niveis.uniform(18, 30, n)
+    nivel_nutrientes = rng_niveis.uniform(60, 220, n)
+    processos = list(zip((rng_umidade, rng_temperatura, rng_nutrientes), (AR_UMIDADE, AR_TEMPERATURA, AR_NUTRIENTES)))
+    estados = [_estacionario(rng_niveis, ar, n) for _, ar in processos]
+
+    inicio_s = np.datetime64(inicio, "s")
+    passos_por_bloco = max(1, tamanho_bloco // n)
+    for t0 in range(0, passos_totais, passos_por_bloco):
+        passos = min(passos_por_bloco, passos_totais - t0)
+        segundos = (t0 + np.arange(passos)) * intervalo_s
+        hora = (segundos % 86400) / 3600
+        diurno = np.sin(2 * np.pi * (hora - 9) / 24) # Máximo às 15h, mínimo às 3h
+
+        ruido_u, ruido_t, ruido_n = (_ar1(rng, ar, estado, passos) for (rng, ar), estado in zip(processos, estados))
+        # Arrays (dispositivos, passos) transpostos para a ordem de tempo
+        umidade = np.clip(nivel_umidade[:, None] + ruido_u - 4 * diurno, 5, 100).T.round(2)
+        temperatura = (nivel_temperatura[:, None] + ruido_t + 6 * diurno).T.round(2)
+        nutrientes = np.clip(nivel_nutrientes[:, None] + ruido_n, 20, 300).T.round(2)
+        ruido_alvo = rng_alvo.normal(0, 5, umidade.shape)
+
+        yield {
+            'dispositivo': np.tile(ids, passos),
+            'timestamp': np.repeat(inicio_s + segundos.astype("timedelta64[s]"), n),
+            'umidade_solo': umidade.ravel(),
+            'temperatura': temperatura.ravel(),
+            'nutrientes_N': nutrientes.ravel(),
+            'acao_irrigacao': ((umidade + ruido_alvo) < 40).astype(np.int64).ravel(),
+        }
+
+
+def _tabela_arrow(bloco, nomes, primeiro):
+    # Dispositivo como dicionário: cada nome é guardado uma vez por row group
+    indices = pa.array((bloco['dispositivo'] - primeiro).astype(np.int32))
+    return pa.table({
+        'dispositivo': pa.DictionaryArray.from_arrays(indices, nomes),
+        'timestamp': pa.array(bloco['timestamp'].astype("datetime64[ms]")),
+        **{coluna: pa.array(bloco[coluna]) for coluna in COLUNAS[2:]},
+    })
+
+
+def gravar_parte_parquet(parte, semente, dispositivos, passos_totais, diretorio, tamanho_bloco=1_000_000, **opcoes):
+    """Gera uma parte inteira em 'parte-NNNNN.parquet'; devolve o número de linhas."""
+    caminho = os.path.join(diretorio, f"parte-{parte:05d}.parquet")
+    temporario = f"{caminho}.tmp-{os.getpid()}"
+    nomes = pa.array([f"sensor-{i:06d}" for i in range(*dispositivos)])
+    linhas = 0
+    escritor = None
+    try:
+        for bloco in gerar_blocos(semente, dispositivos, passos_totais, tamanho_bloco, **opcoes):
+            tabela = _tabela_arrow(bloco, nomes, dispositivos[0])
+            if escritor is None:
+                escritor = pq.ParquetWriter(temporario, tabela.schema, compression="zstd")
+            escritor.write_table(tabela, row_group_size=len(tabela))
+            linhas += len(tabela)
+        escritor.close()
+        os.replace(temporario, caminho)
+    finally:
+        if os.path.exists(temporario):
+            os.remove(temporario)
+    return linhas
+
+
+def _colunas_tabela(conn, tabela):
+    conn.execute(SQL_TABELA.format(tabela=tabela))
+    existentes = {linha[1] for linha in conn.execute(f"PRAGMA table_info({tabela})")}
+    # Em 'dados_treinamento' só existem as features e o alvo
+    return [coluna for coluna in COLUNAS if coluna in existentes]
+
+
+def gravar_sqlite(db_name, tabela, sementes, faixas, passos_totais, tamanho_bloco=1_000_000, **opcoes):
+    """Grava todas as partes em `tabela`, um executemany e um commit por bloco; devolve o número de linhas."""
+    conn = abrir_conexao(db_name)
+    conn.execute("PRAGMA synchronous=OFF") # Carga em massa: um arquivo incompleto é simplesmente gerado de novo
+    colunas = _colunas_tabela(conn, tabela)
+    sql = f"INSERT INTO {tabela} ({', '.join(colunas)}) VALUES ({', '.join('?' * len(colunas))})"
+    linhas = 0
+    try:
+        for semente, faixa in zip(sementes, faixas):
+            for bloco in gerar_blocos(semente, faixa, passos_totais, tamanho_bloco, **opcoes):
+                valores = dict(bloco)
+                if 'dispositivo' in colunas:
+                    valores['dispositivo'] = np.char.add("sensor-", np.char.zfill(bloco['dispositivo'].astype(str), 6))
+                if 'timestamp' in colunas:
+                    valores['timestamp'] = np.char.replace(np.datetime_as_string(bloco['timestamp'], unit="s"), "T", " ")
+                with conn:
+                    conn.executemany(sql, zip(*(valores[coluna].tolist() for coluna in colunas)))
+                linhas += len(bloco['umidade_solo'])
+    finally:
+        conn.close()
+    return linhas
+
+
+def gerar_dataset_grande(linhas, dispositivos=1000, formato="parquet", saida="dataset", tabela="dados_sinteticos",
+                         semente=42, partes=8, n_jobs=None, tamanho_bloco=1_000_000, **opcoes):
+    """
+    Gera cerca de `linhas` leituras (arredondado para um número inteiro de passos por dispositivo).
+    Mesma semente e mesmo número de partes produzem o mesmo dataset, com qualquer `n_jobs`.
+    """
+    passos_totais = math.ceil(linhas / dispositivos)
+    faixas = dividir_partes(dispositivos, min(partes, dispositivos))
+    sementes = np.random.SeedSequence(semente).spawn(len(faixas))
+    print(f"--- Gerando {passos_totais * dispositivos} linhas: {dispositivos} dispositivos x {passos_totais} "
+          f"leituras, {len(faixas)} parte(s), formato {formato} ---")
+    inicio = time.perf_counter()
+    if formato == "sqlite":
+        total = gravar_sqlite(saida, tabela, sementes, faixas, passos_totais, tamanho_bloco, **opcoes)
+    else:
+        if pq is None:
+            raise RuntimeError("pyarrow não está instalado (pip install pyarrow); use --formato sqlite.")
+        os.makedirs(saida, exist_ok=True)
+        with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+            futuros = [pool.submit(gravar_parte_parquet, parte, semente_parte, faixa, passos_totais, saida,
+                                   tamanho_bloco, **opcoes)
+                       for parte, (semente_parte, faixa) in enumerate(zip(sementes, faixas))]
+            total = sum(futuro.result() for futuro in futuros)
+    decorrido = time.perf_counter() - inicio
+    print(f"✅ {total} linhas gravadas em '{saida}' em {decorrido:.1f}s ({total / decorrido:,.0f} linhas/s).")
+    return total
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Gerador de dataset sintético de sensores em blocos.")
+    parser.add_argument("--linhas", type=int, default=10_000_000)
+    parser.add_argument("--dispositivos", type=int, default=1000)
+    parser.add_argument("--formato", choices=["parquet", "sqlite"], default="parquet")
+    parser.add_argument("--saida", default="dataset", help="diretório (parquet) ou arquivo .db (sqlite)")
+    parser.add_argument("--tabela", default="dados_sinteticos", help="tabela de destino no SQLite")
+    parser.add_argument("--semente", type=int, default=42)
+    parser.add_argument("--partes", type=int, default=8, help="fluxos aleatórios independentes (e arquivos parquet)")
+    parser.add_argument("--n-jobs", type=int, help="processos para gerar as partes em parquet (padrão: núcleos)")
+    parser.add_argument("--tamanho-bloco", type=int, default=1_000_000, help="linhas aproximadas por bloco")
+    parser.add_argument("--inicio", default="2024-01-01", help="data da primeira leitura")
+    parser.add_argument("--intervalo", type=int, default=300, help="segundos entre leituras de um dispositivo")
+    args = parser.parse_args()
+
+    gerar_dataset_grande(args.linhas, args.dispositivos, args.formato, args.saida, args.tabela, args.semente,
+                         args.partes, args.n_jobs, args.tamanho_bloco, inicio=args.inicio, intervalo_s=args.intervalo)
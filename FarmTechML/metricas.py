@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""
+metricas.py
+
+Histogramas de latência e contadores do caminho de inferência (carga do modelo -> previsão ->
+gravação), expostos no formato de texto do Prometheus pelo GET /metrics do 'servico_inferencia.py'.
+
+Os histogramas têm baldes fixos, então registrar uma observação custa uma busca binária e um
+incremento; os contadores que já existem nos objetos (linhas, lotes, trocas de modelo, previsões
+gravadas) são lidos só quando as métricas são consultadas.
+
+Uso:
+    from metricas import registro
+    with registro.histograma("predicao_segundos", "Duração de cada predict").medir():
+        ...
+    print(registro.formatar())
+"""
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+PREFIXO = "farmtech_inferencia_"
+LIMITES_S = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0) # Limites superiores dos baldes
+
+
+class Histograma:
+    def __init__(self, nome, ajuda, limites=LIMITES_S):
+        self.nome = nome
+        self.ajuda = ajuda
+        self.limites = limites
+        self.contagens = [0] * (len(limites) + 1) # O último balde é o +Inf
+        self.soma = 0.0
+        self._lock = threading.Lock()
+
+    def observar(self, segundos):
+        indice = bisect.bisect_left(self.limites, segundos)
+        with self._lock:
+            self.contagens[indice] += 1
+            self.soma += segundos
+
+    @contextmanager
+    def medir(self):
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observar(time.perf_counter() - inicio)
+
+    def linhas(self):
+        with self._lock:
+            contagens, soma = list(self.contagens), self.soma
+        nome = PREFIXO + self.nome
+        saida = [f"# HELP {nome} {self.ajuda}", f"# TYPE {nome} histogram"]
+        acumulado = 0
+        for limite, contagem in zip([f"{limite:g}" for limite in self.limites] + ["+Inf"], contagens):
+            acumulado += contagem
+            saida.append(f'{nome}_bucket{{le="{limite}"}} {acumulado}')
+        saida.append(f"{nome}_sum {soma}")
+        saida.append(f"{nome}_count {acumulado}")
+        return saida
+
+
+class RegistroMetricas:
+    def __init__(self):
+        self._histogramas = {}
+        self._valores = {} # nome -> (tipo, ajuda, função de leitura)
+        self._lock = threading.Lock()
+
+    def histograma(self, nome, ajuda):
+        """Histograma com esse nome (criado na primeira chamada)."""
+        with self._lock:
+            histograma = self._histogramas.get(nome)
+            if histograma is None:
+                histograma = self._histogramas[nome] = Histograma(nome, ajuda)
+            return histograma
+
+    def valor(self, nome, ajuda, ler, tipo="counter"):
+        """Registra um valor lido por `ler()` na hora da consulta (substitui um registro anterior do mesmo nome)."""
+        with self._lock:
+            self._valores[nome] = (tipo, ajuda, ler)
+
+    def formatar(self):
+        with self._lock:
+            histogramas = list(self._histogramas.values())
+            valores = list(self._valores.items())
+        linhas = []
+        for histograma in histogramas:
+            linhas.extend(histograma.linhas())
+        for nome, (tipo, ajuda, ler) in valores:
+            linhas += [f"# HELP {PREFIXO}{nome} {ajuda}", f"# TYPE {PREFIXO}{nome} {tipo}", f"{PREFIXO}{nome} {ler()}"]
+        return "\n".join(linhas) + "\n"
+
+
+registro = RegistroMetricas()
+
+carga_modelo = registro.histograma("carga_modelo_segundos", "Duração da carga de uma versão do modelo")
+predicao = registro.histograma("predicao_segundos", "Duração de cada predict (um lote inteiro)")
+gravacao = registro.histograma("gravacao_segundos", "Duração da gravação de um lote de previsões no SQLite")
+requisicao = registro.histograma("requisicao_segundos", "Latência de POST /prever, da leitura do corpo à resposta")
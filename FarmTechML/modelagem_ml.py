@@ -7,11 +7,13 @@ Este script executa as seguintes tarefas em sequência:
 1.  Gera um dataset artificial ('sensores_data.csv') para treinamento.
 
 2.  Cria um banco de dados SQLite ('farmtech.db') com duas tabelas:
-    - 'dados_treinamento': Armazena o dataset inicial.
+    - 'dados_treinamento': Armazena o dataset de treino (novas linhas do CSV são anexadas a cada execução).
     - 'previsoes_irrigacao': Registra novas leituras e as previsões do modelo.
 
 3.  Treina um modelo de classificação (RandomForestClassifier) para prever a necessidade de irrigação.
 
+    Com `--treino blocos`, o treino lê o banco (SQLite ou MongoDB) em blocos, sem carregar tudo em memória.
+
 4.  Avalia o modelo e o salva como 'modelo_irrigacao.pkl'.
 
 5.  Simula uma nova leitura de sensor, faz uma previsão e a registra no banco de dados,
@@ -19,6 +21,7 @@ Este script executa as seguintes tarefas em sequência:
 
 """
 
+import os
 import pandas as pd
 import numpy as np
 import sqlite3
@@ -26,26 +29,35 @@ import joblib
 from sklearn.model_selection import train_test_split
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.metrics import accuracy_score, classification_report, confusion_matrix
-from datetime import datetime
+
+from floresta_compilada import compilar_floresta
+from metricas import carga_modelo, gravacao, predicao
+from persistencia_previsoes import SQL_INSERIR, garantir_esquema, linha_previsao, obter_conexao
+from registro_modelos import NOME_MODELO, registrar_modelo, salvar_atomico
+from repositorio_features import ALVO, FEATURES, blocos_features, contar_linhas_features, exportar_csv, ler_features
+from treinamento_em_blocos import (anexar_csv, blocos_mongo, blocos_sqlite, contar_linhas_mongo,
+                                   contar_linhas_sqlite, planejar_blocos, treinar_em_blocos)
 
 # --- PARTE 1: GERAÇÃO DO DATASET ARTIFICIAL ---
 
-def gerar_dataset(filename="sensores_data.csv", num_samples=1000):
+def gerar_dataset(filename="sensores_data.csv", num_samples=1000, seed=None):
     """
     Gera um dataset artificial com dados de sensores e salva em um arquivo CSV.
     A regra de negócio para irrigação é simples: irrigar se a umidade do solo for < 40.
+    Com `seed`, o dataset é reprodutível. Para milhões de linhas, use gerador_dataset.py.
     """
     print(f"--- [1/5] Gerando dataset artificial com {num_samples} amostras... ---")
+    rng = np.random.default_rng(seed)
     data = {
-        'umidade_solo': np.random.uniform(15, 95, num_samples).round(2),
-        'temperatura': np.random.uniform(10, 40, num_samples).round(2),
-        'nutrientes_N': np.random.uniform(40, 250, num_samples).round(2), # Nível de Nitrogênio (ppm)
+        'umidade_solo': rng.uniform(15, 95, num_samples).round(2),
+        'temperatura': rng.uniform(10, 40, num_samples).round(2),
+        'nutrientes_N': rng.uniform(40, 250, num_samples).round(2), # Nível de Nitrogênio (ppm)
     }
     df = pd.DataFrame(data)
 
     # Lógica para a variável alvo: 1 = Irrigar, 0 = Não Irrigar
     # Adicionamos um pouco de ruído para não ser uma regra perfeita e simular a realidade.
-    noise = np.random.normal(0, 5, num_samples)
+    noise = rng.normal(0, 5, num_samples)
     df['acao_irrigacao'] = np.where((df['umidade_solo'] + noise) < 40, 1, 0)
     
     df.to_csv(filename, index=False)
@@ -59,7 +71,7 @@ def configurar_banco_de_dados(db_name="farmtech.db", training_data_csv="sensores
     Cria e configura o banco de dados SQLite.
     1. Cria a tabela 'dados_treinamento' para o dataset inicial.
     2. Cria a tabela 'previsoes_irrigacao' para registrar novas previsões.
-    3. Popula 'dados_treinamento' com os dados do CSV.
+    3. Anexa a 'dados_treinamento' as linhas do CSV ainda não carregadas.
     """
     print(f"--- [2/5] Configurando o banco de dados '{db_name}'... ---")
     conn = sqlite3.connect(db_name)
@@ -91,35 +103,45 @@ def configurar_banco_de_dados(db_name="farmtech.db", training_data_csv="sensores
     );
     """)
 
-    # Popula a tabela de treinamento com os dados do CSV
-    df_training = pd.read_csv(training_data_csv)
-    # 'replace' apaga dados antigos, útil para re-execuções do script
-    df_training.to_sql('dados_treinamento', conn, if_exists='replace', index=False)
-    
+    # Índice em timestamp para as consultas por período do dashboard
+    garantir_esquema(conn)
+
     conn.commit()
     conn.close()
     print("✅ Banco de dados configurado com as tabelas 'dados_treinamento' e 'previsoes_irrigacao'.")
-    print("✅ Tabela 'dados_treinamento' populada.\n")
+
+    # Popula a tabela de treinamento com os dados do CSV
+    # A carga é incremental: só as linhas que ainda não estão na tabela são anexadas, em blocos
+    anexar_csv(db_name, training_data_csv)
+    print("✅ Tabela 'dados_treinamento' atualizada.\n")
 
 # --- PARTE 3: TREINAMENTO E EXPORTAÇÃO DO MODELO ---
 
-def treinar_e_salvar_modelo(data_csv="sensores_data.csv", model_filename="modelo_irrigacao.pkl"):
+def treinar_e_salvar_modelo(data_csv="sensores_data.csv", model_filename="modelo_irrigacao.pkl", parametros=None,
+                            features_dir=None, inicio=None, fim=None):
     """
     Carrega os dados, treina um modelo RandomForestClassifier, avalia e salva em .pkl.
+    `parametros` substitui os hiperparâmetros padrão (ex.: os recomendados por busca_hiperparametros.py).
+    Com `features_dir`, lê do repositório de features em Parquet só as colunas usadas e as
+    leituras rotuladas entre `inicio` e `fim`, em vez do CSV.
     """
     print("--- [3/5] Iniciando treinamento do modelo... ---")
-    df = pd.read_csv(data_csv)
+    if features_dir is not None:
+        df = ler_features(features_dir, FEATURES + [ALVO], inicio, fim, apenas_rotulados=True).to_pandas()
+        data_csv = features_dir
+    else:
+        df = pd.read_csv(data_csv)
 
     # Definindo features (X) e alvo (y)
-    X = df[['umidade_solo', 'temperatura', 'nutrientes_N']]
-    y = df['acao_irrigacao']
+    X = df[FEATURES]
+    y = df[ALVO]
 
     # Divisão em treino e teste (70% treino, 30% teste)
     X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.3, random_state=42, stratify=y)
 
     # Treinamento do modelo RandomForest
     # random_state=42 garante que o resultado seja sempre o mesmo
-    model = RandomForestClassifier(n_estimators=100, random_state=42, oob_score=True)
+    model = RandomForestClassifier(**{"n_estimators": 100, "random_state": 42, "oob_score": True, **(parametros or {})})
     model.fit(X_train, y_train)
 
     # Avaliação do modelo
@@ -133,52 +155,133 @@ def treinar_e_salvar_modelo(data_csv="sensores_data.csv", model_filename="modelo
     print("\nMatriz de Confusão:")
     print(confusion_matrix(y_test, y_pred))
 
-    # Salvando o modelo treinado
-    joblib.dump(model, model_filename)
-    print(f"\n✅ Modelo treinado e salvo com sucesso como '{model_filename}'.\n")
+    metadados = {
+        "acuracia_teste": round(float(accuracy), 4),
+        "oob_score": round(float(model.oob_score_), 4),
+        "amostras_treino": int(len(X_train)),
+        "dados": data_csv,
+        "parametros": model.get_params(),
+    }
+    if features_dir is not None:
+        metadados["periodo"] = [inicio, fim]
+    salvar_modelo_treinado(model, metadados, model_filename)
+    return model
+
+def treinar_e_salvar_modelo_em_blocos(db_name="farmtech.db", model_filename="modelo_irrigacao.pkl", origem="sqlite",
+                                      tamanho_bloco=100_000, n_estimators=100, mongo_uri="mongodb://localhost:27017/",
+                                      mongo_db="farmtechdb", mongo_colecao="dados_treinamento",
+                                      features_dir="features", inicio=None, fim=None):
+    """
+    Treina lendo 'dados_treinamento' (SQLite), uma coleção do MongoDB ou o repositório de features
+    (Parquet) em blocos, sem carregar tudo em memória: cada bloco treina parte das árvores da floresta final.
+    """
+    print(f"--- [3/5] Iniciando treinamento em blocos a partir de {origem}... ---")
+    if origem == "mongo":
+        total, fonte = contar_linhas_mongo(mongo_uri, mongo_db, mongo_colecao), f"{mongo_db}.{mongo_colecao}"
+    elif origem == "features":
+        total, fonte = contar_linhas_features(features_dir, inicio, fim), features_dir
+    else:
+        total, fonte = contar_linhas_sqlite(db_name), db_name
+    tamanho_bloco, arvores_por_bloco = planejar_blocos(total, tamanho_bloco, n_estimators)
+    print(f"  {total} linha(s), blocos de {tamanho_bloco} linhas, {arvores_por_bloco} árvore(s) por bloco")
+    if origem == "mongo":
+        blocos = blocos_mongo(mongo_uri, mongo_db, mongo_colecao, tamanho_bloco)
+    elif origem == "features":
+        blocos = blocos_features(features_dir, tamanho_bloco, inicio, fim)
+    else:
+        blocos = blocos_sqlite(db_name, tamanho_bloco)
+    model, X_test, y_test, n_treino = treinar_em_blocos(blocos, arvores_por_bloco)
+
+    print("--- [4/5] Avaliando o modelo treinado... ---")
+    y_pred = model.predict(pd.DataFrame(X_test, columns=model.feature_names_in_))
+    accuracy = accuracy_score(y_test, y_pred)
+    print(f"Acurácia do modelo no conjunto de validação ({len(y_test)} linhas): {accuracy:.4f}")
+    print("\nRelatório de Classificação:")
+    print(classification_report(y_test, y_pred, target_names=['Não Irrigar (0)', 'Irrigar (1)']))
+    print("\nMatriz de Confusão:")
+    print(confusion_matrix(y_test, y_pred))
+
+    metadados = {
+        "acuracia_teste": round(float(accuracy), 4),
+        "amostras_treino": int(n_treino),
+        "dados": f"{origem}:{fonte}",
+        "treino": "blocos",
+        "tamanho_bloco": tamanho_bloco,
+        "parametros": model.get_params(),
+    }
+    salvar_modelo_treinado(model, metadados, model_filename)
     return model
 
+def salvar_modelo_treinado(model, metadados, model_filename):
+    """Registra a nova versão, atualiza o .pkl e gera a floresta compilada."""
+    # Salvando o modelo treinado: nova versão no registro e cópia em model_filename para quem lê o .pkl
+    # A escrita é atômica, então quem estiver lendo o arquivo nunca vê um modelo pela metade
+    registro = registrar_modelo(model, metadados)
+    salvar_atomico(model, model_filename)
+    print(f"\n✅ Modelo treinado e salvo com sucesso como '{model_filename}'.")
+
+    # Versão compilada (só NumPy) para os processos de inferência, com o mesmo resultado do predict
+    floresta = compilar_floresta(model)
+    registrar_modelo(floresta, dict(metadados, origem_versao=registro["versao"]), nome=f"{NOME_MODELO}_compilado")
+    arquivo_compilado = os.path.splitext(model_filename)[0] + ".npz"
+    floresta.salvar(arquivo_compilado)
+    print(f"✅ Floresta compilada salva como '{arquivo_compilado}'.\n")
+
 # --- PARTE 4: INTEGRAÇÃO COM BANCO E SIMULAÇÃO ---
 
-def executar_previsao_e_salvar(dados_novos, db_name="farmtech.db", model_filename="modelo_irrigacao.pkl"):
+def executar_previsao_e_salvar(dados_novos, db_name="farmtech.db", model_filename="modelo_irrigacao.pkl", model=None):
     """
     Carrega o modelo, faz uma previsão para novos dados e salva no banco de dados.
     Esta função simula o que o sistema fará em produção.
+    Passe `model` já carregado para não ler o .pkl a cada previsão; para fluxo contínuo
+    de leituras use o serviço residente 'servico_inferencia.py'.
     """
     print("--- [5/5] Executando simulação de integração... ---")
     
-    # Carregar o modelo que foi salvo anteriormente
-    model = joblib.load(model_filename)
+    # Carregar o modelo que foi salvo anteriormente (se não foi recebido já carregado)
+    if model is None:
+        with carga_modelo.medir():
+            model = joblib.load(model_filename)
     
     # Preparar os novos dados para previsão
     df_novo = pd.DataFrame([dados_novos])
     
     # Fazer a previsão
-    previsao = model.predict(df_novo)[0]
+    with predicao.medir():
+        previsao = model.predict(df_novo)[0]
     status_texto = "IRRIGAR" if previsao == 1 else "NÃO IRRIGAR"
     
     print(f"  > Dados do sensor: {dados_novos}")
     print(f"  > Previsão do modelo: {previsao} ({status_texto})")
 
     # Salvar a leitura e a previsão no banco de dados
-    conn = sqlite3.connect(db_name)
-    cursor = conn.cursor()
-    
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    
-    cursor.execute("""
-    INSERT INTO previsoes_irrigacao (timestamp, umidade_solo, temperatura, nutrientes_N, previsao_modelo, status_previsao)
-    VALUES (?, ?, ?, ?, ?, ?)
-    """, (timestamp, dados_novos['umidade_solo'], dados_novos['temperatura'], dados_novos['nutrientes_N'], int(previsao), status_texto))
-    
-    conn.commit()
-    conn.close()
+    # Conexão de longa duração em WAL (persistencia_previsoes.py); para muitas leituras use GravadorPrevisoes
+    conn = obter_conexao(db_name)
+    with gravacao.medir(), conn:
+        conn.execute(SQL_INSERIR, linha_previsao(dados_novos, previsao))
     
     print(f"✅ Leitura e previsão registradas com sucesso na tabela 'previsoes_irrigacao' do banco '{db_name}'.")
 
 # --- BLOCO PRINCIPAL DE EXECUÇÃO ---
 
 if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Pipeline de dados, treinamento e previsão da FarmTech.")
+    parser.add_argument("--treino", choices=["memoria", "blocos"], default="memoria",
+                        help="'blocos' treina lendo o banco em blocos, sem carregar todos os dados em memória")
+    parser.add_argument("--origem", choices=["sqlite", "mongo", "features"], default="sqlite",
+                        help="origem dos dados no treino em blocos")
+    parser.add_argument("--tamanho-bloco", type=int, default=100_000)
+    parser.add_argument("--mongo-uri", default="mongodb://localhost:27017/")
+    parser.add_argument("--mongo-db", default="farmtechdb")
+    parser.add_argument("--mongo-colecao", default="dados_treinamento")
+    parser.add_argument("--features", help="repositório de features em Parquet: o CSV gerado é exportado para ele "
+                                           "e o treino lê de lá (veja repositorio_features.py)")
+    parser.add_argument("--inicio", help="treina só com leituras a partir desta data (com --features)")
+    parser.add_argument("--fim", help="treina só com leituras anteriores a esta data (com --features)")
+    args = parser.parse_args()
+
     # Define os nomes dos arquivos para fácil manutenção
     NOME_ARQUIVO_DADOS = "sensores_data.csv"
     NOME_ARQUIVO_DB = "farmtech.db"
@@ -190,8 +293,19 @@ if __name__ == "__main__":
     # 2. Criar e popular o banco de dados
     configurar_banco_de_dados(db_name=NOME_ARQUIVO_DB, training_data_csv=NOME_ARQUIVO_DADOS)
 
+    if args.features:
+        exportar_csv(NOME_ARQUIVO_DADOS, args.features)
+
     # 3. Treinar e salvar o modelo
-    treinar_e_salvar_modelo(data_csv=NOME_ARQUIVO_DADOS, model_filename=NOME_ARQUIVO_MODELO)
+    if args.treino == "blocos":
+        treinar_e_salvar_modelo_em_blocos(db_name=NOME_ARQUIVO_DB, model_filename=NOME_ARQUIVO_MODELO,
+                                          origem=args.origem, tamanho_bloco=args.tamanho_bloco,
+                                          mongo_uri=args.mongo_uri, mongo_db=args.mongo_db,
+                                          mongo_colecao=args.mongo_colecao, features_dir=args.features or "features",
+                                          inicio=args.inicio, fim=args.fim)
+    else:
+        treinar_e_salvar_modelo(data_csv=NOME_ARQUIVO_DADOS, model_filename=NOME_ARQUIVO_MODELO,
+                                features_dir=args.features, inicio=args.inicio, fim=args.fim)
 
     # 4. Simular uma nova leitura de sensor e registrar a previsão
     # Cenário 1: Umidade baixa, deve prever "IRRIGAR"
@@ -200,7 +314,8 @@ if __name__ == "__main__":
         'temperatura': 28.1,
         'nutrientes_N': 150.7
     }
-    executar_previsao_e_salvar(novo_dado_irrigar, db_name=NOME_ARQUIVO_DB, model_filename=NOME_ARQUIVO_MODELO)
+    modelo = joblib.load(NOME_ARQUIVO_MODELO) # Carregado uma vez para as duas simulações
+    executar_previsao_e_salvar(novo_dado_irrigar, db_name=NOME_ARQUIVO_DB, model=modelo)
     
     print("-" * 20)
 
@@ -210,7 +325,7 @@ if __name__ == "__main__":
         'temperatura': 22.5,
         'nutrientes_N': 180.3
     }
-    executar_previsao_e_salvar(novo_dado_nao_irrigar, db_name=NOME_ARQUIVO_DB, model_filename=NOME_ARQUIVO_MODELO)
+    executar_previsao_e_salvar(novo_dado_nao_irrigar, db_name=NOME_ARQUIVO_DB, model=modelo)
     
     print("\n\nPipeline completo executado com sucesso!")
     print("Arquivos gerados: 'sensores_data.csv', 'farmtech.db', 'modelo_irrigacao.pkl'.")
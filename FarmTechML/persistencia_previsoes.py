@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""
+persistencia_previsoes.py
+
+Camada de gravação das previsões na tabela 'previsoes_irrigacao' do 'farmtech.db'.
+
+- Conexões de longa duração, uma por thread e por banco (sem abrir e fechar a cada leitura).
+- Journal em modo WAL com synchronous=NORMAL: um commit não faz fsync do banco a cada linha,
+  e o dashboard pode ler enquanto as previsões são gravadas.
+- GravadorPrevisoes acumula as linhas e as grava com um único `executemany` por lote,
+  confirmado quando o lote atinge um tamanho ou um tempo máximo.
+- Índice em `timestamp` para as consultas por período.
+"""
+
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+from metricas import gravacao
+
+SQL_INSERIR = """
+INSERT INTO previsoes_irrigacao (timestamp, umidade_solo, temperatura, nutrientes_N, previsao_modelo, status_previsao)
+VALUES (?, ?, ?, ?, ?, ?)
+"""
+
+SQL_TABELA = """
+CREATE TABLE IF NOT EXISTS previsoes_irrigacao (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    timestamp TEXT NOT NULL,
+    umidade_solo REAL NOT NULL,
+    temperatura REAL NOT NULL,
+    nutrientes_N REAL NOT NULL,
+    previsao_modelo INTEGER NOT NULL,
+    status_previsao TEXT NOT NULL
+);
+"""
+
+_conexoes = threading.local()
+
+
+def abrir_conexao(db_name="farmtech.db", check_same_thread=True):
+    """Nova conexão configurada para gravação frequente (WAL, synchronous=NORMAL)."""
+    conn = sqlite3.connect(db_name, timeout=30, check_same_thread=check_same_thread)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL") # No WAL, só o checkpoint faz fsync do banco
+    return conn
+
+
+def obter_conexao(db_name="farmtech.db"):
+    """Conexão reaproveitada da thread atual para o banco (criada na primeira chamada)."""
+    pool = getattr(_conexoes, "pool", None)
+    if pool is None:
+        pool = _conexoes.pool = {}
+    conn = pool.get(db_name)
+    if conn is None:
+        conn = pool[db_name] = abrir_conexao(db_name)
+        garantir_esquema(conn)
+    return conn
+
+
+def garantir_esquema(conn):
+    conn.execute(SQL_TABELA)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_previsoes_timestamp ON previsoes_irrigacao (timestamp)")
+    conn.commit()
+
+
+def linha_previsao(leitura, previsao, timestamp=None):
+    """Tupla na ordem de SQL_INSERIR."""
+    previsao = int(previsao)
+    return (
+        timestamp or datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        leitura['umidade_solo'], leitura['temperatura'], leitura['nutrientes_N'],
+        previsao, "IRRIGAR" if previsao == 1 else "NÃO IRRIGAR",
+    )
+
+
+class GravadorPrevisoes:
+    """
+    Grava previsões em lote em uma thread dedicada.
+
+    `registrar` e `registrar_lote` só acumulam as linhas; a thread de gravação faz um
+    `executemany` + commit quando há `lote` linhas pendentes ou quando a mais antiga
+    espera há `intervalo_ms`. `fechar` grava o que restou.
+    """
+
+    def __init__(self, db_name="farmtech.db", lote=500, intervalo_ms=200):
+        self.db_name = db_name
+        self.lote = lote
+        self.intervalo = intervalo_ms / 1000
+        self.gravadas = 0
+        self.commits = 0
+        self._pendentes = []
+        self._primeira = None # Instante em que a linha pendente mais antiga chegou
+        self._cond = threading.Condition()
+        self._fechando = False
+        # Criada aqui para que erros de esquema apareçam já no construtor; depois só a thread de gravação a usa
+        self._conn = abrir_conexao(db_name, check_same_thread=False)
+        garantir_esquema(self._conn)
+        self._thread = threading.Thread(target=self._executar, name="gravador-previsoes", daemon=True)
+        self._thread.start()
+
+    def registrar(self, leitura, previsao, timestamp=None):
+        self.registrar_lote([linha_previsao(leitura, previsao, timestamp)])
+
+    def registrar_lote(self, linhas):
+        """Acumula tuplas já na ordem de SQL_INSERIR (veja `linha_previsao`)."""
+        with self._cond:
+            if self._primeira is None:
+                self._primeira = time.monotonic()
+            self._pendentes.extend(linhas)
+            if len(self._pendentes) >= self.lote:
+                self._cond.notify()
+
+    def _retirar(self):
+        with self._cond:
+            while not self._fechando:
+                if len(self._pendentes) >= self.lote:
+                    break
+                if self._primeira is not None:
+                    restante = self._primeira + self.intervalo - time.monotonic()
+                    if restante <= 0:
+                        break
+                    self._cond.wait(restante)
+                else:
+                    self._cond.wait()
+            linhas, self._pendentes, self._primeira = self._pendentes, [], None
+            return linhas
+
+    def _gravar(self, linhas):
+        # Um único executemany e um commit por lote; a instrução é preparada uma vez e reaproveitada
+        with gravacao.medir(), self._conn:
+            self._conn.executemany(SQL_INSERIR, linhas)
+        self.gravadas += len(linhas)
+        self.commits += 1
+
+    def _executar(self):
+        while True:
+            linhas = self._retirar()
+            if linhas:
+                try:
+                    self._gravar(linhas)
+                except sqlite3.Error as e:
+                    if self._fechando:
+                        print(f"⚠️ Falha ao gravar {len(linhas)} previsão(ões) no encerramento ({e}); linhas descartadas.")
+                        return
+                    print(f"⚠️ Falha ao gravar {len(linhas)} previsão(ões) ({e}); o lote será tentado novamente.")
+                    with self._cond:
+                        self._pendentes[:0] = linhas
+                        self._primeira = self._primeira or time.monotonic()
+                    time.sleep(self.intervalo)
+                    continue
+            if self._fechando:
+                with self._cond:
+                    if not self._pendentes:
+                        return
+
+    def fechar(self):
+        with self._cond:
+            self._fechando = True
+            self._cond.notify()
+        self._thread.join()
+        self._conn.close()
@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+"""
+registro_modelos.py
+
+Registro de versões do modelo de irrigação e cache em memória com troca a quente.
+
+Cada treinamento vira uma versão imutável em 'modelos/':
+    modelo_irrigacao-v0003-<sha256[:12]>.joblib   artefato (joblib sem compressão, carregável com mmap)
+    modelo_irrigacao-v0003.json                   metadados (hash, data, métricas, parâmetros)
+    modelo_irrigacao.atual.json                   ponteiro para a versão em produção
+
+Os arquivos são escritos em um temporário no mesmo diretório e publicados com `os.replace`,
+então um leitor nunca encontra um artefato ou ponteiro pela metade.
+"""
+
+import hashlib
+import json
+import os
+import threading
+from datetime import datetime
+
+import joblib
+
+from metricas import carga_modelo
+
+DIRETORIO_MODELOS = "modelos"
+NOME_MODELO = "modelo_irrigacao"
+
+
+def _escrever_atomico(caminho, escrever):
+    """Escreve via arquivo temporário + fsync + os.replace; `escrever` recebe o arquivo aberto em binário."""
+    temporario = f"{caminho}.tmp-{os.getpid()}"
+    try:
+        with open(temporario, "wb") as f:
+            escrever(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporario, caminho)
+    finally:
+        if os.path.exists(temporario):
+            os.remove(temporario)
+
+
+def salvar_atomico(model, caminho):
+    """Substitui um .pkl existente sem que os leitores vejam o arquivo incompleto."""
+    _escrever_atomico(caminho, lambda f: joblib.dump(model, f))
+
+
+def _hash_arquivo(caminho):
+    sha = hashlib.sha256()
+    with open(caminho, "rb") as f:
+        for bloco in iter(lambda: f.read(1024 * 1024), b""):
+            sha.update(bloco)
+    return sha.hexdigest()
+
+
+def _caminho_ponteiro(diretorio, nome):
+    return os.path.join(diretorio, f"{nome}.atual.json")
+
+
+def listar_versoes(diretorio=DIRETORIO_MODELOS, nome=NOME_MODELO):
+    """Metadados de todas as versões registradas, da mais antiga para a mais nova."""
+    if not os.path.isdir(diretorio):
+        return []
+    versoes = []
+    for arquivo in sorted(os.listdir(diretorio)):
+        if arquivo.startswith(f"{nome}-v") and arquivo.endswith(".json"):
+            with open(os.path.join(diretorio, arquivo), encoding="utf-8") as f:
+                conteudo = f.read()
+            if conteudo: # Vazio: versão reservada por um treinamento ainda em andamento
+                versoes.append(json.loads(conteudo))
+    return versoes
+
+
+def versao_atual(diretorio=DIRETORIO_MODELOS, nome=NOME_MODELO):
+    """Metadados da versão apontada como atual, ou None se nenhuma foi registrada."""
+    try:
+        with open(_caminho_ponteiro(diretorio, nome), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def _reservar_versao(diretorio, nome):
+    # O_EXCL garante números distintos mesmo com dois treinamentos simultâneos
+    versao = max((v["versao"] for v in listar_versoes(diretorio, nome)), default=0) + 1
+    while True:
+        caminho = os.path.join(diretorio, f"{nome}-v{versao:04d}.json")
+        try:
+            os.close(os.open(caminho, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            return versao, caminho
+        except FileExistsError:
+            versao += 1
+
+
+def publicar_versao(metadados, diretorio=DIRETORIO_MODELOS, nome=NOME_MODELO):
+    """Aponta a versão como atual (também serve para rollback para uma versão anterior)."""
+    dados = json.dumps(metadados, ensure_ascii=False, indent=2, default=str).encode("utf-8")
+    _escrever_atomico(_caminho_ponteiro(diretorio, nome), lambda f: f.write(dados))
+
+
+def registrar_modelo(model, metadados=None, diretorio=DIRETORIO_MODELOS, nome=NOME_MODELO, publicar=True):
+    """
+    Grava o modelo como uma nova versão imutável e, por padrão, a publica como atual.
+    Se o artefato for idêntico (mesmo hash) ao da versão atual, nenhuma versão nova é criada.
+    """
+    os.makedirs(diretorio, exist_ok=True)
+    temporario = os.path.join(diretorio, f".{nome}.tmp-{os.getpid()}.joblib")
+    try:
+        with open(temporario, "wb") as f:
+            joblib.dump(model, f) # Sem compressão: os arrays do artefato podem ser mapeados em memória
+            f.flush()
+            os.fsync(f.fileno())
+        sha256 = _hash_arquivo(temporario)
+        atual = versao_atual(diretorio, nome)
+        if atual is not None and atual["sha256"] == sha256:
+            print(f"Modelo idêntico à versão atual v{atual['versao']}; nenhuma versão nova registrada.")
+            return atual
+        versao, caminho_metadados = _reservar_versao(diretorio, nome)
+        arquivo = f"{nome}-v{versao:04d}-{sha256[:12]}.joblib"
+        os.replace(temporario, os.path.join(diretorio, arquivo))
+    finally:
+        if os.path.exists(temporario):
+            os.remove(temporario)
+
+    registro = {
+        "versao": versao,
+        "arquivo": arquivo,
+        "sha256": sha256,
+        "criado_em": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "classe": type(model).__name__,
+        "features": [str(f) for f in getattr(model, "feature_names_in_", [])],
+    }
+    registro.update(metadados or {})
+    dados = json.dumps(registro, ensure_ascii=False, indent=2, default=str).encode("utf-8")
+    _escrever_atomico(caminho_metadados, lambda f: f.write(dados))
+    if publicar:
+        publicar_versao(registro, diretorio, nome)
+    print(f"✅ Modelo registrado como versão v{versao} ('{arquivo}', sha256 {sha256[:12]}).")
+    return registro
+
+
+def carregar_modelo(metadados=None, diretorio=DIRETORIO_MODELOS, nome=NOME_MODELO, mmap=True, verificar_hash=True):
+    """
+    Carrega a versão indicada (ou a atual) e devolve (modelo, metadados).
+    Com `mmap`, os arrays NumPy do artefato são mapeados somente leitura a partir do arquivo,
+    e processos que carregam a mesma versão compartilham essas páginas pelo cache do sistema.
+    Obs.: o RandomForest do scikit-learn copia os nós de cada árvore ao ser desserializado;
+    o compartilhamento vale integralmente para artefatos formados só por arrays.
+    """
+    metadados = metadados or versao_atual(diretorio, nome)
+    if metadados is None:
+        raise FileNotFoundError(f"Nenhuma versão de '{nome}' registrada em '{diretorio}'.")
+    caminho = os.path.join(diretorio, metadados["arquivo"])
+    if verificar_hash and _hash_arquivo(caminho) != metadados["sha256"]:
+        raise ValueError(f"Hash de '{caminho}' não confere com o registrado na versão v{metadados['versao']}.")
+    return joblib.load(caminho, mmap_mode="r" if mmap else None), metadados
+
+
+class CacheModelo:
+    """
+    Mantém o modelo atual em memória e troca para a nova versão assim que ela é publicada.
+
+    A nova versão é carregada em uma thread de fundo; só então a referência é trocada, numa
+    única atribuição. Quem chama `obter()` nunca espera uma recarga: recebe o par
+    (modelo, metadados) anterior ou o novo, sempre completo.
+    """
+
+    def __init__(self, diretorio=DIRETORIO_MODELOS, nome=NOME_MODELO, arquivo_legado=None, intervalo=2.0, mmap=True,
+                 carregar_legado=joblib.load):
+        self.diretorio = diretorio
+        self.nome = nome
+        self.arquivo_legado = arquivo_legado # Usado enquanto nenhuma versão tiver sido registrada
+        self.carregar_legado = carregar_legado
+        self.intervalo = intervalo
+        self.mmap = mmap
+        self.trocas = 0
+        self._falha = None # sha256 da última versão que não pôde ser carregada
+        self._atual = self._carregar(versao_atual(diretorio, nome))
+        self._parar = threading.Event()
+        self._thread = threading.Thread(target=self._observar, name="cache-modelo", daemon=True)
+
+    def _carregar(self, metadados):
+        if metadados is None:
+            if self.arquivo_legado is None:
+                raise FileNotFoundError(f"Nenhuma versão de '{self.nome}' registrada em '{self.diretorio}'.")
+            with carga_modelo.medir():
+                return self.carregar_legado(self.arquivo_legado), {"versao": None, "arquivo": self.arquivo_legado}
+        with carga_modelo.medir():
+            return carregar_modelo(metadados, self.diretorio, self.nome, mmap=self.mmap)
+
+    def iniciar(self):
+        self._thread.start()
+        return self
+
+    def obter(self):
+        """Par (modelo, metadados) da versão em uso."""
+        return self._atual
+
+    @property
+    def versao(self):
+        return self._atual[1]["versao"]
+
+    def recarregar(self):
+        """Carrega a versão publicada se ela mudou; devolve True se houve troca."""
+        publicada = versao_atual(self.diretorio, self.nome)
+        if publicada is None or publicada["versao"] == self.versao or publicada["sha256"] == self._falha:
+            return False
+        try:
+            novo = self._carregar(publicada)
+        except Exception:
+            self._falha = publicada["sha256"]
+            raise
+        self._atual = novo # Troca atômica da referência
+        self.trocas += 1
+        print(f"🔄 Modelo trocado para a versão v{publicada['versao']} ('{publicada['arquivo']}').")
+        return True
+
+    def _observar(self):
+        while not self._parar.wait(self.intervalo):
+            try:
+                self.recarregar()
+            except Exception as e:
+                # Artefato corrompido ou removido: continua servindo a versão anterior
+                print(f"⚠️ Falha ao carregar a nova versão do modelo ({e}); mantendo a v{self.versao}.")
+
+    def parar(self):
+        self._parar.set()
+        if self._thread.is_alive():
+            self._thread.join()
@@ -0,0 +1,313 @@
+# -*- coding: utf-8 -*-
+"""
+repositorio_features.py
+
+Repositório de features em Parquet (colunar), particionado por data no estilo Hive
+('features/data=2024-01-01/lote-....parquet'), para treinamento e análise.
+
+- `exportar_*` grava no repositório as leituras do CSV de treino, da tabela
+  'dados_treinamento' do SQLite, dos eventos do MongoDB (coleção 'events' do eventProcessor,
+  plana ou time-series) ou de Parquet gerado por gerador_dataset.py. A leitura da origem e a
+  gravação são feitas em lotes (memória constante); cada exportação acrescenta arquivos novos.
+- `ler_features` lê só as colunas pedidas (projeção) e só as partições e row groups que podem
+  conter o intervalo de datas e os dispositivos pedidos (filtros aplicados na leitura), com
+  os arquivos mapeados em memória.
+
+Uso:
+    python repositorio_features.py exportar csv sensores_data.csv
+    python repositorio_features.py exportar mongo --mongo-uri mongodb://localhost:27017/ --desde 2024-01-01
+    python repositorio_features.py resumo --inicio 2024-01-01 --fim 2024-01-31
+"""
+
+import argparse
+import os
+import sqlite3
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pc = ds = pq = None
+
+try:
+    import pymongo
+except ImportError:
+    pymongo = None
+
+DIRETORIO_FEATURES = "features"
+FEATURES = ['umidade_solo', 'temperatura', 'nutrientes_N']
+ALVO = 'acao_irrigacao'
+
+if pa is not None:
+    ESQUEMA = pa.schema([
+        ("dispositivo", pa.string()),
+        ("timestamp", pa.timestamp("ms", tz="UTC")),
+        ("umidade_solo", pa.float64()),
+        ("temperatura", pa.float64()),
+        ("nutrientes_N", pa.float64()), # Ausente nos eventos do MQTT (nulo)
+        ("acao_irrigacao", pa.int64()), # Só os dados de treino têm o alvo; nos eventos é nulo
+        ("data", pa.string()),          # Chave de partição (AAAA-MM-DD em UTC)
+    ])
+    PARTICIONAMENTO = ds.partitioning(pa.schema([("data", pa.string())]), flavor="hive")
+
+# Campos dos eventos do MQTT (payload_schema.py do eventProcessor) -> colunas do repositório
+_CAMPOS_EVENTO = {
+    "umidade_solo": ("humidity",),
+    "temperatura": ("temperature", "temperature_C"),
+    "nutrientes_N": ("nutrientes_N",),
+}
+
+
+def _exigir_pyarrow():
+    if pa is None:
+        raise RuntimeError("pyarrow não está instalado (pip install pyarrow).")
+
+
+def _lote_arrow(colunas):
+    """RecordBatch no ESQUEMA a partir de um dicionário coluna -> valores (colunas ausentes ficam nulas)."""
+    n = len(next(iter(colunas.values())))
+    arrays = []
+    for campo in ESQUEMA:
+        if campo.name == "data":
+            continue
+        valores = colunas.get(campo.name)
+        if valores is None:
+            arrays.append(pa.nulls(n, campo.type))
+        elif isinstance(valores, pa.Array):
+            arrays.append(valores.cast(campo.type))
+        elif campo.name == "timestamp":
+            arrays.append(pa.array(valores).cast(campo.type))
+        else:
+            arrays.append(pa.array(valores, type=campo.type, from_pandas=True))
+    arrays.append(pc.strftime(arrays[1], format="%Y-%m-%d"))
+    return pa.RecordBatch.from_arrays(arrays, schema=ESQUEMA)
+
+
+def gravar_lotes(lotes, diretorio=DIRETORIO_FEATURES, linhas_por_grupo=128 * 1024):
+    """
+    Grava um iterável de RecordBatch no repositório, particionado por data. Os arquivos novos
+    recebem um prefixo com o instante da exportação e não substituem os anteriores.
+    """
+    _exigir_pyarrow()
+    contagem = {"linhas": 0}
+
+    def contar(lotes):
+        for lote in lotes:
+            contagem["linhas"] += lote.num_rows
+            yield lote
+
+    prefixo = f"lote-{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}"
+    ds.write_dataset(
+        contar(lotes), diretorio, schema=ESQUEMA, format="parquet", partitioning=PARTICIONAMENTO,
+        basename_template=f"{prefixo}-{{i}}.parquet", existing_data_behavior="overwrite_or_ignore",
+        max_rows_per_group=linhas_por_grupo, min_rows_per_group=min(linhas_por_grupo, 16 * 1024),
+        file_options=ds.ParquetFileFormat().make_write_options(compression="zstd"),
+    )
+    print(f"✅ {contagem['linhas']} linha(s) exportada(s) para '{diretorio}'.")
+    return contagem["linhas"]
+
+
+# --- Origens ---
+
+def _lotes_dataframe(blocos, dispositivo, timestamp):
+    # Os dados de treino não têm dispositivo nem horário: recebem a origem e o instante da exportação
+    for df in blocos:
+        colunas = {coluna: df[coluna].to_numpy() for coluna in FEATURES + [ALVO] if coluna in df}
+        colunas["dispositivo"] = np.full(len(df), dispositivo, dtype=object)
+        colunas["timestamp"] = np.full(len(df), timestamp, dtype="datetime64[ms]")
+        yield _lote_arrow(colunas)
+
+
+def exportar_csv(csv_path, diretorio=DIRETORIO_FEATURES, tamanho_bloco=100_000):
+    agora = np.datetime64(datetime.now(timezone.utc).replace(tzinfo=None), "ms")
+    blocos = pd.read_csv(csv_path, chunksize=tamanho_bloco)
+    return gravar_lotes(_lotes_dataframe(blocos, os.path.basename(csv_path), agora), diretorio)
+
+
+def exportar_sqlite(db_name, diretorio=DIRETORIO_FEATURES, tabela="dados_treinamento", tamanho_bloco=100_000):
+    agora = np.datetime64(datetime.now(timezone.utc).replace(tzinfo=None), "ms")
+    # O write_dataset consome os lotes em outra thread
+    with sqlite3.connect(db_name, check_same_thread=False) as conn:
+        colunas = {linha[1] for linha in conn.execute(f"PRAGMA table_info({tabela})")}
+        if {"dispositivo", "timestamp"} <= colunas: # Tabela de gerador_dataset.py: já tem dispositivo e horário
+            consulta = f"SELECT dispositivo, timestamp, {', '.join(FEATURES + [ALVO])} FROM {tabela}"
+            blocos = pd.read_sql_query(consulta, conn, chunksize=tamanho_bloco, parse_dates=["timestamp"])
+            return gravar_lotes((_lote_arrow({c: df[c].to_numpy() for c in df}) for df in blocos), diretorio)
+        blocos = pd.read_sql_query(f"SELECT {', '.join(FEATURES + [ALVO])} FROM {tabela}", conn,
+                                   chunksize=tamanho_bloco)
+        return gravar_lotes(_lotes_dataframe(blocos, f"{os.path.basename(db_name)}:{tabela}", agora), diretorio)
+
+
+def exportar_parquet(origem, diretorio=DIRETORIO_FEATURES):
+    """Reparticiona por data o Parquet de gerador_dataset.py (um diretório de 'parte-*.parquet')."""
+    _exigir_pyarrow()
+    entrada = ds.dataset(origem, format="parquet")
+    colunas = [c for c in ESQUEMA.names if c in entrada.schema.names]
+
+    def lotes():
+        for lote in entrada.to_batches(columns=colunas):
+            yield _lote_arrow({nome: lote.column(nome) for nome in colunas})
+    return gravar_lotes(lotes(), diretorio)
+
+
+def _horario_evento(doc):
+    valor = doc.get("ts") or doc.get("timestamp")
+    if isinstance(valor, str):
+        try:
+            valor = datetime.fromisoformat(valor.replace("Z", "+00:00"))
+        except ValueError:
+            valor = None
+    valor = valor or doc.get("received_at")
+    if valor is None:
+        return None
+    return valor.astimezone(timezone.utc).replace(tzinfo=None) if valor.tzinfo else valor
+
+
+def _dispositivo_evento(doc):
+    meta = doc.get("meta") or {}
+    for campo, campo_meta in (("deviceId", "device"), ("city", "city"), ("topic", "topic")):
+        valor = doc.get(campo) or meta.get(campo_meta)
+        if valor is not None:
+            return str(valor)
+    return None
+
+
+def exportar_mongo(uri, database="trainstormdb", colecao="events", diretorio=DIRETORIO_FEATURES, desde=None,
+                   tamanho_bloco=50_000):
+    """
+    Exporta os eventos do MQTT gravados pelo eventProcessor (layout plano ou time-series).
+    Com `desde` (datetime), só os eventos recebidos a partir desse instante, para exportações incrementais.
+    """
+    if pymongo is None:
+        raise RuntimeError("pymongo não está instalado (pip install pymongo).")
+    campos = ["ts", "timestamp", "received_at", "deviceId", "city", "topic", "meta"]
+    campos += [campo for origens in _CAMPOS_EVENTO.values() for campo in origens]
+    filtro = {}
+    if desde is not None:
+        filtro = {"$or": [{"received_at": {"$gte": desde}}, {"ts": {"$gte": desde}}]}
+
+    def lotes(cursor):
+        buffer = []
+        for doc in cursor:
+            buffer.append(doc)
+            if len(buffer) >= tamanho_bloco:
+                yield _lote_eventos(buffer)
+                buffer = []
+        if buffer:
+            yield _lote_eventos(buffer)
+
+    client = pymongo.MongoClient(uri, serverSelectionTimeoutMS=5000)
+    try:
+        projecao = {campo: 1 for campo in campos}
+        projecao["_id"] = 0
+        cursor = client[database][colecao].find(filtro, projecao, batch_size=min(tamanho_bloco, 10_000))
+        return gravar_lotes(lotes(cursor), diretorio)
+    finally:
+        client.close()
+
+
+def _lote_eventos(docs):
+    colunas = {
+        "dispositivo": [_dispositivo_evento(doc) for doc in docs],
+        "timestamp": np.array([_horario_evento(doc) for doc in docs], dtype="datetime64[ms]"),
+    }
+    for coluna, origens in _CAMPOS_EVENTO.items():
+        colunas[coluna] = [next((doc[c] for c in origens if isinstance(doc.get(c), (int, float))), None) for doc in docs]
+    return _lote_arrow(colunas)
+
+
+# --- Leitura ---
+
+def _filtros(inicio=None, fim=None, dispositivos=None, apenas_rotulados=False):
+    """Filtros no formato do pyarrow: a partição `data` descarta diretórios, `timestamp` descarta row groups."""
+    filtros = []
+    if inicio is not None:
+        inicio = pd.Timestamp(inicio, tz="UTC")
+        filtros += [("data", ">=", inicio.strftime("%Y-%m-%d")), ("timestamp", ">=", inicio)]
+    if fim is not None:
+        fim = pd.Timestamp(fim, tz="UTC")
+        filtros += [("data", "<=", fim.strftime("%Y-%m-%d")), ("timestamp", "<", fim)]
+    if dispositivos:
+        filtros.append(("dispositivo", "in", list(dispositivos)))
+    if apenas_rotulados:
+        filtros.append(("acao_irrigacao", "in", [0, 1]))
+    return filtros or None
+
+
+def ler_features(diretorio=DIRETORIO_FEATURES, colunas=None, inicio=None, fim=None, dispositivos=None,
+                 apenas_rotulados=False):
+    """
+    Tabela Arrow com as `colunas` pedidas das leituras em [inicio, fim). Os arquivos são mapeados
+    em memória e só as partições, row groups e colunas necessários são lidos.
+    """
+    _exigir_pyarrow()
+    return pq.read_table(diretorio, columns=colunas, filters=_filtros(inicio, fim, dispositivos, apenas_rotulados),
+                         partitioning=PARTICIONAMENTO, memory_map=True)
+
+
+def blocos_features(diretorio=DIRETORIO_FEATURES, tamanho_bloco=100_000, inicio=None, fim=None):
+    """Gera (X, y) em blocos só com as linhas rotuladas, para o treinamento em blocos."""
+    _exigir_pyarrow()
+    conjunto = ds.dataset(diretorio, format="parquet", partitioning=PARTICIONAMENTO)
+    filtro = pq.filters_to_expression(_filtros(inicio, fim, apenas_rotulados=True))
+    for lote in conjunto.to_batches(columns=FEATURES + [ALVO], filter=filtro, batch_size=tamanho_bloco):
+        if lote.num_rows:
+            X = np.column_stack([lote.column(c).to_numpy(zero_copy_only=False) for c in FEATURES]).astype(np.float64)
+            yield X, lote.column(ALVO).to_numpy(zero_copy_only=False).astype(np.int64)
+
+
+def contar_linhas_features(diretorio=DIRETORIO_FEATURES, inicio=None, fim=None):
+    _exigir_pyarrow()
+    conjunto = ds.dataset(diretorio, format="parquet", partitioning=PARTICIONAMENTO)
+    return conjunto.count_rows(filter=pq.filters_to_expression(_filtros(inicio, fim, apenas_rotulados=True)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Repositório de features em Parquet particionado por data.")
+    parser.add_argument("--diretorio", default=DIRETORIO_FEATURES)
+    comandos = parser.add_subparsers(dest="comando", required=True)
+
+    exportar = comandos.add_parser("exportar", help="acrescenta dados de uma origem ao repositório")
+    exportar.add_argument("origem", choices=["csv", "sqlite", "mongo", "parquet"])
+    exportar.add_argument("caminho", nargs="?", help="CSV, banco SQLite ou diretório Parquet")
+    exportar.add_argument("--tabela", default="dados_treinamento")
+    exportar.add_argument("--mongo-uri", default=os.getenv("MONGO_URI", "mongodb://localhost:27017/"))
+    exportar.add_argument("--mongo-db", default=os.getenv("MONGO_DATABASE", "trainstormdb"))
+    exportar.add_argument("--mongo-colecao", default=os.getenv("MONGO_COLLECTION", "events"))
+    exportar.add_argument("--desde", help="só eventos recebidos a partir desta data (MongoDB)")
+
+    resumo = comandos.add_parser("resumo", help="estatísticas por dia de um intervalo")
+    resumo.add_argument("--inicio")
+    resumo.add_argument("--fim")
+    resumo.add_argument("--dispositivo", action="append")
+    args = parser.parse_args()
+
+    if args.comando == "exportar":
+        if args.origem == "mongo":
+            desde = pd.Timestamp(args.desde, tz="UTC").to_pydatetime() if args.desde else None
+            exportar_mongo(args.mongo_uri, args.mongo_db, args.mongo_colecao, args.diretorio, desde)
+        elif args.caminho is None:
+            parser.error(f"informe o caminho da origem '{args.origem}'.")
+        elif args.origem == "csv":
+            exportar_csv(args.caminho, args.diretorio)
+        elif args.origem == "sqlite":
+            exportar_sqlite(args.caminho, args.diretorio, args.tabela)
+        else:
+            exportar_parquet(args.caminho, args.diretorio)
+    else:
+        inicio = time.perf_counter()
+        tabela = ler_features(args.diretorio, ["data", "umidade_solo", "temperatura"], args.inicio, args.fim,
+                              args.dispositivo)
+        decorrido = time.perf_counter() - inicio
+        print(f"{tabela.num_rows} linha(s) lidas em {decorrido * 1000:.1f} ms")
+        if tabela.num_rows:
+            por_dia = tabela.group_by("data").aggregate([("umidade_solo", "mean"), ("temperatura", "mean"),
+                                                          ("umidade_solo", "count")])
+            print(por_dia.sort_by("data").to_pandas().to_string(index=False))
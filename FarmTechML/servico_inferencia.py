@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+"""
+servico_inferencia.py
+
+Serviço de inferência residente para o modelo de irrigação.
+
+O modelo é carregado uma única vez, a partir da versão atual do registro ('registro_modelos.py')
+ou, se nenhuma versão tiver sido registrada, de 'modelo_irrigacao.pkl'; quando uma nova versão
+é publicada, ela é carregada em segundo plano e trocada sem interromper as previsões. As leituras chegam por HTTP
+(POST /prever) e as requisições concorrentes são agrupadas em micro-lotes: uma thread
+dedicada junta as leituras que chegam dentro de uma pequena janela de espera e faz um
+único `predict` vetorizado sobre um array NumPy para o lote inteiro.
+
+Endpoints:
+    POST /prever    corpo JSON com uma leitura ou uma lista de leituras
+                    {"umidade_solo": 25.5, "temperatura": 28.1, "nutrientes_N": 150.7}
+    GET  /metricas  latência p50/p99, linhas/s e tamanho médio dos lotes
+    GET  /metrics   histogramas e contadores no formato de texto do Prometheus ('metricas.py')
+"""
+
+import json
+import os
+import queue
+import threading
+import time
+import warnings
+from collections import deque
+from concurrent.futures import Future
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from floresta_compilada import FlorestaCompilada
+from metricas import predicao, registro, requisicao
+from persistencia_previsoes import GravadorPrevisoes, linha_previsao
+from registro_modelos import NOME_MODELO, CacheModelo, versao_atual
+
+FEATURES = ['umidade_solo', 'temperatura', 'nutrientes_N'] # Mesma ordem usada no treinamento
+
+INFERENCIA_HOST = os.getenv("INFERENCIA_HOST", "127.0.0.1")
+INFERENCIA_PORTA = int(os.getenv("INFERENCIA_PORTA", 8085))
+INFERENCIA_MODELO = os.getenv("INFERENCIA_MODELO", "modelo_irrigacao.pkl") # Usado se o registro estiver vazio
+INFERENCIA_COMPILADO = os.getenv("INFERENCIA_COMPILADO", "1") == "1" # Usa a floresta compilada (só NumPy)
+INFERENCIA_MODELO_COMPILADO = os.getenv("INFERENCIA_MODELO_COMPILADO", "modelo_irrigacao.npz")
+INFERENCIA_REGISTRO = os.getenv("INFERENCIA_REGISTRO", "modelos")         # Diretório do registro de versões
+INFERENCIA_RECARGA_S = float(os.getenv("INFERENCIA_RECARGA_S", 2))        # Intervalo de verificação de nova versão
+INFERENCIA_REGISTRAR = os.getenv("INFERENCIA_REGISTRAR", "1") == "1" # Grava as previsões em previsoes_irrigacao
+INFERENCIA_DB = os.getenv("INFERENCIA_DB", "farmtech.db")
+INFERENCIA_LOTE_MAX = int(os.getenv("INFERENCIA_LOTE_MAX", 256))        # Leituras por predict
+INFERENCIA_ESPERA_MS = float(os.getenv("INFERENCIA_ESPERA_MS", 2))      # Espera máxima para completar um lote
+
+# O modelo foi treinado com um DataFrame; a previsão usa um array com as colunas na mesma ordem
+warnings.filterwarnings("ignore", message="X does not have valid feature names")
+
+
+class MetricasInferencia:
+    """Latências das últimas requisições e contadores de linhas e lotes."""
+
+    def __init__(self, janela=10000):
+        self.latencias_ms = deque(maxlen=janela)
+        self.linhas = 0
+        self.lotes = 0
+        self.inicio = time.monotonic()
+        self._lock = threading.Lock()
+
+    def registrar_lote(self, tamanho):
+        with self._lock:
+            self.linhas += tamanho
+            self.lotes += 1
+
+    def registrar_latencia(self, ms):
+        self.latencias_ms.append(ms) # deque.append é atômico
+
+    def resumo(self):
+        latencias = np.fromiter(list(self.latencias_ms), dtype=np.float64)
+        decorrido = time.monotonic() - self.inicio
+        with self._lock:
+            linhas, lotes = self.linhas, self.lotes
+        return {
+            "latencia_p50_ms": round(float(np.percentile(latencias, 50)), 3) if latencias.size else None,
+            "latencia_p99_ms": round(float(np.percentile(latencias, 99)), 3) if latencias.size else None,
+            "linhas": linhas,
+            "lotes": lotes,
+            "linhas_por_segundo": round(linhas / decorrido, 1) if decorrido > 0 else 0.0,
+            "tamanho_medio_lote": round(linhas / lotes, 2) if lotes else 0.0,
+        }
+
+
+class MicroLote:
+    """Agrupa leituras concorrentes e executa um único predict por lote."""
+
+    def __init__(self, cache, lote_max=INFERENCIA_LOTE_MAX, espera_ms=INFERENCIA_ESPERA_MS, gravador=None):
+        self.cache = cache
+        self.gravador = gravador # GravadorPrevisoes opcional: grava o lote inteiro de uma vez
+        self.lote_max = lote_max
+        self.espera = espera_ms / 1000
+        self.metricas = MetricasInferencia()
+        self._fila = queue.Queue()
+        self._thread = threading.Thread(target=self._executar, name="micro-lote", daemon=True)
+        self._thread.start()
+
+    def prever(self, linhas):
+        """Enfileira as linhas (lista de listas na ordem de FEATURES) e devolve um Future com as previsões."""
+        futuro = Future() # Resultado: (previsões, versão do modelo)
+        self._fila.put((linhas, futuro))
+        return futuro
+
+    def _coletar(self):
+        pedidos = [self._fila.get()]
+        total = len(pedidos[0][0])
+        limite = time.perf_counter() + self.espera
+        while total < self.lote_max:
+            restante = limite - time.perf_counter()
+            try:
+                pedido = self._fila.get(timeout=restante) if restante > 0 else self._fila.get_nowait()
+            except queue.Empty:
+                break
+            pedidos.append(pedido)
+            total += len(pedido[0])
+        return pedidos
+
+    def _executar(self):
+        while True:
+            pedidos = self._coletar()
+            X = np.array([linha for linhas, _ in pedidos for linha in linhas], dtype=np.float64)
+            model, metadados = self.cache.obter() # O lote inteiro usa a mesma versão
+            try:
+                with predicao.medir():
+                    previsoes = model.predict(X)
+            except Exception as e:
+                for _, futuro in pedidos:
+                    futuro.set_exception(e)
+                continue
+            self.metricas.registrar_lote(len(X))
+            if self.gravador is not None:
+                timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                self.gravador.registrar_lote([
+                    linha_previsao(dict(zip(FEATURES, linha)), p, timestamp) for linha, p in zip(X.tolist(), previsoes)
+                ])
+            inicio = 0
+            for linhas, futuro in pedidos:
+                futuro.set_result((previsoes[inicio:inicio + len(linhas)], metadados["versao"]))
+                inicio += len(linhas)
+
+
+class ServidorInferencia(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128 # Backlog de conexões para muitos clientes simultâneos
+
+
+def leitura_para_linha(leitura):
+    try:
+        return [float(leitura[coluna]) for coluna in FEATURES]
+    except KeyError as e:
+        raise ValueError(f"campo obrigatório ausente: {e.args[0]}") from None
+    except (TypeError, ValueError):
+        raise ValueError("as leituras devem ter valores numéricos") from None
+
+
+def criar_handler(micro_lote):
+    class InferenciaHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1" # Conexões persistentes para os clientes que fazem muitas requisições
+
+        def _responder(self, status, corpo):
+            dados = json.dumps(corpo).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(dados)))
+            self.end_headers()
+            self.wfile.write(dados)
+
+        def do_POST(self):
+            if self.path != "/prever":
+                return self._responder(404, {"erro": "rota não encontrada"})
+            inicio = time.perf_counter()
+            try:
+                corpo = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                leituras = corpo if isinstance(corpo, list) else [corpo]
+                linhas = [leitura_para_linha(leitura) for leitura in leituras]
+            except (ValueError, TypeError) as e:
+                return self._responder(400, {"erro": str(e)})
+            if not linhas:
+                return self._responder(400, {"erro": "nenhuma leitura enviada"})
+            previsoes, versao = micro_lote.prever(linhas).result()
+            decorrido = time.perf_counter() - inicio
+            micro_lote.metricas.registrar_latencia(decorrido * 1000)
+            requisicao.observar(decorrido)
+            resultado = [{"previsao_modelo": int(p), "status_previsao": "IRRIGAR" if p == 1 else "NÃO IRRIGAR",
+                          "versao_modelo": versao} for p in previsoes]
+            self._responder(200, resultado if isinstance(corpo, list) else resultado[0])
+
+        def do_GET(self):
+            if self.path == "/metrics":
+                dados = registro.formatar().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(dados)))
+                self.end_headers()
+                self.wfile.write(dados)
+                return
+            if self.path != "/metricas":
+                return self._responder(404, {"erro": "rota não encontrada"})
+            resumo = micro_lote.metricas.resumo()
+            resumo.update(versao_modelo=micro_lote.cache.versao, trocas_de_modelo=micro_lote.cache.trocas)
+            self._responder(200, resumo)
+
+        def log_message(self, format, *args):
+            pass # Um print por requisição custaria mais que a própria inferência
+
+    return InferenciaHandler
+
+
+def criar_cache(model_filename=INFERENCIA_MODELO):
+    """Prefere a floresta compilada (carrega em milissegundos, sem scikit-learn); senão usa o modelo original."""
+    nome_compilado = f"{NOME_MODELO}_compilado"
+    if INFERENCIA_COMPILADO:
+        if versao_atual(INFERENCIA_REGISTRO, nome_compilado) or os.path.exists(INFERENCIA_MODELO_COMPILADO):
+            return CacheModelo(INFERENCIA_REGISTRO, nome_compilado, arquivo_legado=INFERENCIA_MODELO_COMPILADO,
+                               intervalo=INFERENCIA_RECARGA_S, carregar_legado=FlorestaCompilada.carregar)
+        print("Floresta compilada não encontrada (execute floresta_compilada.py); usando o modelo do scikit-learn.")
+    return CacheModelo(INFERENCIA_REGISTRO, arquivo_legado=model_filename, intervalo=INFERENCIA_RECARGA_S)
+
+
+def registrar_metricas(micro_lote):
+    """Expõe em /metrics os contadores que o micro-lote, o cache e o gravador já mantêm."""
+    registro.valor("linhas_total", "Leituras previstas", lambda: micro_lote.metricas.linhas)
+    registro.valor("lotes_total", "Chamadas de predict (lotes)", lambda: micro_lote.metricas.lotes)
+    registro.valor("trocas_modelo_total", "Trocas de versão do modelo em execução", lambda: micro_lote.cache.trocas)
+    registro.valor("fila_pedidos", "Pedidos aguardando o próximo lote", micro_lote._fila.qsize, "gauge")
+    if micro_lote.gravador is not None:
+        registro.valor("previsoes_gravadas_total", "Previsões gravadas no SQLite", lambda: micro_lote.gravador.gravadas)
+
+
+def iniciar_servico(model_filename=INFERENCIA_MODELO, host=INFERENCIA_HOST, porta=INFERENCIA_PORTA):
+    """Carrega o modelo uma vez e sobe o servidor HTTP com o micro-lote."""
+    cache = criar_cache(model_filename).iniciar()
+    print(f"--- Modelo carregado: {cache.obter()[1]['arquivo']} (versão {cache.versao}) ---")
+    gravador = GravadorPrevisoes(INFERENCIA_DB) if INFERENCIA_REGISTRAR else None
+    micro_lote = MicroLote(cache, gravador=gravador)
+    registrar_metricas(micro_lote)
+    servidor = ServidorInferencia((host, porta), criar_handler(micro_lote))
+    print(f"✅ Serviço de inferência em http://{host}:{porta} "
+          f"(lote máximo {micro_lote.lote_max}, espera {micro_lote.espera * 1000:.1f} ms)")
+    return servidor, micro_lote
+
+
+if __name__ == "__main__":
+    servidor, micro_lote = iniciar_servico()
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        print("\nServiço encerrado.")
+        print(f"Métricas finais: {micro_lote.metricas.resumo()}")
+    finally:
+        servidor.server_close()
+        if micro_lote.gravador is not None:
+            micro_lote.gravador.fechar()
+            print(f"Previsões gravadas em '{INFERENCIA_DB}': {micro_lote.gravador.gravadas}.")
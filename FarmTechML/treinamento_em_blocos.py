@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+"""
+treinamento_em_blocos.py
+
+Treinamento fora da memória: os dados de treino são lidos do banco (SQLite ou MongoDB)
+em blocos por um gerador, e cada bloco treina algumas árvores; as árvores de todos os
+blocos formam uma única RandomForestClassifier. Só um bloco fica em memória por vez.
+
+Também faz a carga incremental da tabela 'dados_treinamento': cada arquivo CSV é lido a
+partir do ponto em que a carga anterior parou (controle na tabela 'controle_ingestao'),
+e só as linhas novas são anexadas.
+"""
+
+import hashlib
+import io
+import itertools
+import math
+import os
+import sqlite3
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestClassifier
+
+try:
+    import pymongo
+except ImportError:
+    pymongo = None
+
+FEATURES = ['umidade_solo', 'temperatura', 'nutrientes_N']
+ALVO = 'acao_irrigacao'
+CLASSES = np.array([0, 1])
+
+_JANELA_ASSINATURA = 64 * 1024 # Bytes antes do ponto de parada usados para reconhecer o mesmo arquivo
+
+
+# --- Carga incremental de 'dados_treinamento' ---
+
+def _assinatura(caminho, posicao):
+    """Hash dos bytes que antecedem `posicao`: muda se o arquivo foi regravado em vez de crescer."""
+    with open(caminho, "rb") as f:
+        f.seek(max(0, posicao - _JANELA_ASSINATURA))
+        return hashlib.sha256(f.read(min(posicao, _JANELA_ASSINATURA))).hexdigest()
+
+
+def _garantir_tabelas(conn):
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS dados_treinamento (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        umidade_solo REAL NOT NULL,
+        temperatura REAL NOT NULL,
+        nutrientes_N REAL NOT NULL,
+        acao_irrigacao INTEGER NOT NULL
+    );
+    """)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS controle_ingestao (
+        origem TEXT PRIMARY KEY,
+        posicao INTEGER NOT NULL,
+        assinatura TEXT NOT NULL,
+        linhas INTEGER NOT NULL,
+        atualizado_em TEXT NOT NULL
+    );
+    """)
+
+
+def _carga_legada(conn, csv_path):
+    if conn.execute("SELECT COUNT(*) FROM controle_ingestao").fetchone()[0] > 0:
+        return False
+    existentes = conn.execute("SELECT COUNT(*) FROM dados_treinamento").fetchone()[0]
+    if existentes == 0:
+        return False
+    with open(csv_path, "rb") as f:
+        return existentes == sum(1 for _ in f) - 1 # Sem o cabeçalho
+
+
+def anexar_csv(db_name, csv_path, tamanho_bloco=100_000):
+    """
+    Anexa a 'dados_treinamento' só as linhas do CSV que ainda não foram carregadas.
+
+    Se o arquivo cresceu desde a última carga, a leitura continua do byte em que parou.
+    Se ele foi regravado (conteúdo anterior diferente), é tratado como um lote novo de
+    dados e carregado inteiro. Cada bloco é inserido e registrado no controle na mesma
+    transação, então uma carga interrompida continua de onde parou.
+    """
+    origem = os.path.abspath(csv_path)
+    tamanho = os.path.getsize(csv_path)
+    conn = sqlite3.connect(db_name)
+    try:
+        _garantir_tabelas(conn)
+        conn.commit()
+        controle = conn.execute("SELECT posicao, assinatura, linhas FROM controle_ingestao WHERE origem = ?",
+                                (origem,)).fetchone()
+        posicao, linhas_anteriores = 0, 0
+        if controle is None and _carga_legada(conn, csv_path):
+            # Banco criado antes do controle de ingestão (to_sql com 'replace'): o CSV já está na tabela
+            print(f"'{csv_path}' já carregado por uma versão anterior; registrando no controle de ingestão.")
+            with conn:
+                conn.execute("INSERT INTO controle_ingestao VALUES (?, ?, ?, ?, ?)", (
+                    origem, tamanho, _assinatura(csv_path, tamanho), contar_linhas_sqlite(db_name),
+                    datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+            return 0
+        if controle is not None:
+            posicao_anterior, assinatura, linhas_anteriores = controle
+            if posicao_anterior <= tamanho and _assinatura(csv_path, posicao_anterior) == assinatura:
+                posicao = posicao_anterior
+            else:
+                print(f"'{csv_path}' foi regravado desde a última carga; carregando como dados novos.")
+                linhas_anteriores = 0
+        if posicao >= tamanho:
+            print(f"Nenhuma linha nova em '{csv_path}'.")
+            return 0
+
+        sql = f"INSERT INTO dados_treinamento ({', '.join(FEATURES + [ALVO])}) VALUES (?, ?, ?, ?)"
+        novas = 0
+        with open(csv_path, "rb") as f:
+            colunas = f.readline().decode().strip().split(",")
+            if posicao == 0:
+                posicao = f.tell()
+            f.seek(posicao)
+            while True:
+                bruto = list(itertools.islice(f, tamanho_bloco))
+                if not bruto:
+                    break
+                posicao = f.tell() # Em modo binário a posição é exata mesmo iterando por linhas
+                bloco = pd.read_csv(io.BytesIO(b"".join(bruto)), header=None, names=colunas)
+                with conn: # Inserção do bloco e avanço do controle na mesma transação
+                    conn.executemany(sql, bloco[FEATURES + [ALVO]].itertuples(index=False, name=None))
+                    novas += len(bloco)
+                    conn.execute("INSERT OR REPLACE INTO controle_ingestao VALUES (?, ?, ?, ?, ?)", (
+                        origem, posicao, _assinatura(csv_path, posicao), linhas_anteriores + novas,
+                        datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+        print(f"✅ {novas} linha(s) nova(s) de '{csv_path}' anexada(s) a 'dados_treinamento'.")
+        return novas
+    finally:
+        conn.close()
+
+
+# --- Leitura em blocos ---
+
+def contar_linhas_sqlite(db_name, tabela="dados_treinamento"):
+    with sqlite3.connect(db_name) as conn:
+        return conn.execute(f"SELECT COUNT(*) FROM {tabela}").fetchone()[0]
+
+
+def blocos_sqlite(db_name, tamanho_bloco=100_000, tabela="dados_treinamento"):
+    """Gera (X, y) em blocos, paginando pelo rowid (cada consulta usa a chave primária, sem OFFSET)."""
+    colunas = ", ".join(FEATURES + [ALVO])
+    conn = sqlite3.connect(db_name)
+    try:
+        ultimo = -1
+        while True:
+            linhas = conn.execute(f"SELECT rowid, {colunas} FROM {tabela} WHERE rowid > ? ORDER BY rowid LIMIT ?",
+                                  (ultimo, tamanho_bloco)).fetchall()
+            if not linhas:
+                return
+            dados = np.array(linhas, dtype=np.float64)
+            ultimo = int(dados[-1, 0])
+            yield dados[:, 1:-1], dados[:, -1].astype(np.int64)
+    finally:
+        conn.close()
+
+
+def _exigir_pymongo():
+    if pymongo is None:
+        raise RuntimeError("pymongo não está instalado (pip install pymongo).")
+
+
+def contar_linhas_mongo(uri, database, colecao):
+    _exigir_pymongo()
+    client = pymongo.MongoClient(uri, serverSelectionTimeoutMS=5000)
+    try:
+        return client[database][colecao].estimated_document_count()
+    finally:
+        client.close()
+
+
+def blocos_mongo(uri, database, colecao, tamanho_bloco=100_000):
+    """Gera (X, y) em blocos a partir de documentos com os campos de FEATURES e ALVO."""
+    _exigir_pymongo()
+    client = pymongo.MongoClient(uri, serverSelectionTimeoutMS=5000)
+    try:
+        campos = FEATURES + [ALVO]
+        filtro = {campo: {"$exists": True} for campo in campos}
+        projecao = {campo: 1 for campo in campos}
+        projecao["_id"] = 0
+        cursor = client[database][colecao].find(filtro, projecao, batch_size=min(tamanho_bloco, 50_000))
+        buffer = []
+        for doc in cursor:
+            buffer.append([doc[campo] for campo in campos])
+            if len(buffer) >= tamanho_bloco:
+                dados = np.array(buffer, dtype=np.float64)
+                buffer = []
+                yield dados[:, :-1], dados[:, -1].astype(np.int64)
+        if buffer:
+            dados = np.array(buffer, dtype=np.float64)
+            yield dados[:, :-1], dados[:, -1].astype(np.int64)
+    finally:
+        client.close()
+
+
+# --- Treinamento ---
+
+def planejar_blocos(total_linhas, tamanho_bloco, n_estimators):
+    """
+    Ajusta o tamanho do bloco e as árvores por bloco para que a floresta final tenha cerca de
+    `n_estimators` árvores, qualquer que seja o volume de dados.
+    """
+    if total_linhas <= 0:
+        return tamanho_bloco, n_estimators
+    tamanho_bloco = max(tamanho_bloco, math.ceil(total_linhas / n_estimators))
+    n_blocos = math.ceil(total_linhas / tamanho_bloco)
+    return tamanho_bloco, max(1, round(n_estimators / n_blocos))
+
+
+def treinar_em_blocos(blocos, arvores_por_bloco=10, fracao_validacao=0.1, limite_validacao=200_000,
+                      random_state=42, **parametros):
+    """
+    Treina `arvores_por_bloco` árvores em cada bloco e junta todas em uma RandomForestClassifier.
+
+    Uma fração de cada bloco fica fora do treino para a avaliação (até `limite_validacao` linhas).
+    Blocos sem as duas classes são somados ao bloco seguinte, para que todas as árvores tenham
+    as mesmas classes. Devolve (modelo, X_validacao, y_validacao, linhas_de_treino).
+    """
+    rng = np.random.default_rng(random_state)
+    floresta = None
+    estimadores = []
+    X_val, y_val = [], []
+    n_val = 0
+    n_treino = 0
+    pendente = None
+    for i, (X, y) in enumerate(blocos):
+        if pendente is not None:
+            X, y = np.vstack([pendente[0], X]), np.concatenate([pendente[1], y])
+            pendente = None
+        validacao = rng.random(len(y)) < fracao_validacao if n_val < limite_validacao else np.zeros(len(y), bool)
+        X_val.append(X[validacao])
+        y_val.append(y[validacao])
+        n_val += int(validacao.sum())
+        X, y = X[~validacao], y[~validacao]
+        if not np.array_equal(np.unique(y), CLASSES):
+            pendente = (X, y)
+            continue
+        parcial = RandomForestClassifier(n_estimators=arvores_por_bloco, random_state=random_state + i, **parametros)
+        parcial.fit(X, y)
+        estimadores.extend(parcial.estimators_)
+        floresta = floresta or parcial
+        n_treino += len(y)
+        print(f"  bloco {i + 1}: {len(y)} linhas, {len(estimadores)} árvore(s) acumulada(s)")
+    if floresta is None:
+        raise ValueError("Nenhum bloco com as duas classes: não há dados suficientes para treinar.")
+    if pendente is not None:
+        print(f"  {len(pendente[1])} linha(s) finais com uma única classe ficaram fora do treino.")
+
+    # A floresta final é a primeira parcial com as árvores de todos os blocos
+    floresta.estimators_ = estimadores
+    floresta.n_estimators = len(estimadores)
+    floresta.feature_names_in_ = np.array(FEATURES, dtype=object) # Aceita o DataFrame de executar_previsao_e_salvar
+    return floresta, np.vstack(X_val), np.concatenate(y_val), n_treino
@@ -0,0 +1,296 @@
+import asyncio
+import os
+import time
+from datetime import datetime, timezone
+
+import aiomqtt
+import pymongo
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from dedup import count_write_errors, inserted_documents
+from logs import get_logger
+from metrics import registry
+from payload_schema import PayloadRejected, dead_letter_document
+from spool import DiskSpool, SpoolReplayer
+from stage_timings import timer
+from storage_layout import LAYOUT_FLAT, LAYOUT_TIMESERIES, TIME_FIELD, ensure_collection
+
+try:
+    import uvloop # Opcional: laço de eventos mais rápido, se instalado
+except ImportError:
+    uvloop = None
+
+# Mesmas variáveis de ambiente do consumidor síncrono (consumer.py)
+MQTT_BROKER_HOST = os.getenv("MQTT_BROKER_HOST", "127.0.0.1")
+MQTT_BROKER_PORT = int(os.getenv("MQTT_BROKER_PORT", 1883))
+MQTT_TOPIC = os.getenv("MQTT_TOPIC", "sensor/data")
+MQTT_USERNAME = os.getenv("MQTT_USERNAME", "user")
+MQTT_PASSWORD = os.getenv("MQTT_PASSWORD", "password")
+MQTT_QOS = int(os.getenv("MQTT_QOS", 1))
+
+MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017/")
+MONGO_DATABASE = os.getenv("MONGO_DATABASE", "trainstormdb")
+MONGO_COLLECTION = os.getenv("MONGO_COLLECTION", "events")
+MONGO_BATCH_SIZE = int(os.getenv("MONGO_BATCH_SIZE", 500))
+MONGO_FLUSH_INTERVAL_MS = int(os.getenv("MONGO_FLUSH_INTERVAL_MS", 200))
+MONGO_DEADLETTER_COLLECTION = os.getenv("MONGO_DEADLETTER_COLLECTION", "events_deadletter")
+STORAGE_LAYOUT = os.getenv("STORAGE_LAYOUT", LAYOUT_FLAT)
+SPOOL_ENABLED = os.getenv("SPOOL_ENABLED", "1") == "1"
+SPOOL_DIR = os.getenv("SPOOL_DIR", "spool")
+SPOOL_SEGMENT_BYTES = int(os.getenv("SPOOL_SEGMENT_BYTES", 16 * 1024 * 1024))
+SPOOL_MAX_BYTES = int(os.getenv("SPOOL_MAX_BYTES", 1024 * 1024 * 1024))
+SPOOL_FSYNC_BATCH = int(os.getenv("SPOOL_FSYNC_BATCH", 1000))
+SPOOL_FSYNC_INTERVAL_MS = int(os.getenv("SPOOL_FSYNC_INTERVAL_MS", 500))
+SPOOL_REPLAY_BATCH = int(os.getenv("SPOOL_REPLAY_BATCH", 5000))
+SPOOL_HEALTH_INTERVAL = int(os.getenv("SPOOL_HEALTH_INTERVAL", 5))
+
+ASYNC_MAX_INFLIGHT = int(os.getenv("ASYNC_MAX_INFLIGHT", 8)) # Lotes insert_many simultâneos em voo
+ASYNC_STATS_INTERVAL = int(os.getenv("ASYNC_STATS_INTERVAL", 10)) # Segundos entre relatórios de vazão
+
+log = get_logger("async_consumer")
+
+
+class AsyncBatchWriter:
+    """Agrupa documentos e grava com insert_many não ordenado, com até `max_inflight` lotes simultâneos.
+
+    Quando o limite de lotes em voo é atingido, `add` aguarda, o que interrompe a leitura
+    do MQTT e propaga a contrapressão até o broker. O aiomqtt confirma o QoS1 no recebimento:
+    com um `spool`, os lotes vão para o disco enquanto o MongoDB estiver indisponível, em vez de
+    se perderem.
+    """
+
+    def __init__(self, collection, batch_size=500, flush_interval_ms=200, max_inflight=8, before_write=None,
+                 after_write=None, record_timings=True, after_failure=None, spool=None, after_spool=None):
+        self.collection = collection
+        self.spool = spool
+        self.record_timings = record_timings
+        self.before_write = before_write # Executado fora do laço de eventos (ex.: pontuação pelo modelo)
+        self.after_write = after_write   # Chamado com cada lote gravado; não deve bloquear (ex.: aviso de invalidação)
+        self.after_failure = after_failure # Chamado com cada lote que não foi gravado
+        self.after_spool = after_spool     # Chamado com cada lote desviado para o spool
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = max(1, flush_interval_ms) / 1000.0
+        self._docs = []
+        self._inflight = asyncio.Semaphore(max(1, max_inflight))
+        self._tasks = set()
+        self.inserted = 0
+        self.failed = 0
+        self.spooled = 0
+        self.duplicates = 0
+
+    async def add(self, doc):
+        self._docs.append(doc)
+        if len(self._docs) >= self.batch_size:
+            await self._dispatch()
+
+    async def _dispatch(self):
+        if not self._docs:
+            return
+        batch, self._docs = self._docs, []
+        await self._inflight.acquire()
+        task = asyncio.create_task(self._write(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _write(self, batch):
+        try:
+            if self.before_write is not None:
+                try:
+                    batch = await asyncio.get_running_loop().run_in_executor(None, self.before_write, batch)
+                except Exception as e:
+                    # Uma falha da pontuação (ou do despacho de comandos) não impede a gravação do lote
+                    log.error("Erro no pré-gravação de um lote de %d documento(s); gravando sem ele: %s",
+                              len(batch), e)
+            if self.spool is not None and self.spool.active:
+                await self._to_spool(batch)
+                return
+            started = time.perf_counter_ns()
+            written = batch
+            try:
+                result = await self.collection.insert_many(batch, ordered=False)
+            except pymongo.errors.BulkWriteError as e:
+                details = e.details or {}
+                duplicates, rejected = count_write_errors(details)
+                self.inserted += details.get("nInserted", 0)
+                self.duplicates += duplicates
+                self.failed += rejected
+                written = inserted_documents(batch, details) # Recusados e já gravados ficam fora dos rollups
+            except pymongo.errors.ConnectionFailure as e:
+                if self.spool is None:
+                    self._fail(batch, "no MongoDB", e)
+                    return
+                # insert_many já atribuiu _id aos documentos: a reprodução do spool não os duplica
+                log.warning("MongoDB indisponível (%s); desviando as gravações para o spool local.", e)
+                self.spool.activate()
+                await self._to_spool(batch)
+                return
+            except Exception as e:
+                self._fail(batch, "no MongoDB", e)
+                return
+            else:
+                self.inserted += len(result.inserted_ids)
+                if self.record_timings:
+                    timer.record("store", time.perf_counter_ns() - started, len(batch))
+                    timer.record_since("receive_to_store", batch[0].get("received_at"), len(batch))
+            # Fora do try da gravação: uma falha do gancho não transforma um lote gravado em lote perdido
+            if written:
+                self._call_hook(self.after_write, written)
+        finally:
+            self._inflight.release()
+
+    async def _to_spool(self, batch):
+        try:
+            # A escrita (e o fsync em lote) do spool bloqueia: roda fora do laço de eventos
+            await asyncio.get_running_loop().run_in_executor(None, self.spool.append, batch)
+            self.spooled += len(batch)
+        except Exception as e:
+            self._fail(batch, "no spool", e)
+            return
+        self._call_hook(self.after_spool, batch)
+
+    def _fail(self, batch, destination, error):
+        self.failed += len(batch)
+        log.error("Erro ao gravar lote de %d documento(s) %s: %s", len(batch), destination, error)
+        self._call_hook(self.after_failure, batch)
+
+    @staticmethod
+    def _call_hook(hook, batch):
+        if hook is None:
+            return
+        try:
+            hook(batch)
+        except Exception as e:
+            log.error("Erro no gancho %s de um lote de %d documento(s): %s", getattr(hook, "__name__", hook),
+                      len(batch), e)
+
+    async def run_timer(self):
+        """Descarrega o lote parcial a cada `flush_interval`."""
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self._dispatch()
+
+    async def close(self):
+        await self._dispatch()
+        if self._tasks:
+            await asyncio.gather(*self._tasks)
+
+
+async def connect_to_mongodb():
+    retry_delay = 5
+    while True:
+        try:
+            print(f"Conectando ao MongoDB em {MONGO_URI}...")
+            client = AsyncIOMotorClient(MONGO_URI, serverSelectionTimeoutMS=5000)
+            await client.admin.command('ping')
+            print(f"Conectado com sucesso ao MongoDB: DB='{MONGO_DATABASE}', Collection='{MONGO_COLLECTION}'.")
+            return client
+        except Exception as e:
+            print(f"Falha na conexão com MongoDB: {e}. Tentando novamente em {retry_delay} segundos...")
+            await asyncio.sleep(retry_delay)
+
+
+def prepare_storage():
+    # Criação de coleção/índices é feita uma vez na inicialização com o driver síncrono
+    client = pymongo.MongoClient(MONGO_URI, serverSelectionTimeoutMS=5000)
+    try:
+        ensure_collection(client[MONGO_DATABASE], MONGO_COLLECTION, STORAGE_LAYOUT)
+    finally:
+        client.close()
+
+
+def start_spool():
+    """Spool local e reprodução para quando o MongoDB cair; a reprodução usa o driver síncrono em sua thread."""
+    if not SPOOL_ENABLED:
+        return None, None, None
+    client = pymongo.MongoClient(MONGO_URI, serverSelectionTimeoutMS=5000)
+    disk_spool = DiskSpool(SPOOL_DIR, SPOOL_SEGMENT_BYTES, SPOOL_MAX_BYTES, SPOOL_FSYNC_BATCH, SPOOL_FSYNC_INTERVAL_MS)
+    replayer = SpoolReplayer(disk_spool, client[MONGO_DATABASE][MONGO_COLLECTION], lambda: client.admin.command('ping'),
+                             SPOOL_REPLAY_BATCH, SPOOL_HEALTH_INTERVAL,
+                             time_field=TIME_FIELD if STORAGE_LAYOUT == LAYOUT_TIMESERIES else None).start()
+    return disk_spool, replayer, client
+
+
+async def report_throughput(counter, writer):
+    last_count, last_time = 0, time.monotonic()
+    while True:
+        await asyncio.sleep(ASYNC_STATS_INTERVAL)
+        now = time.monotonic()
+        rate = (counter["received"] - last_count) / (now - last_time)
+        last_count, last_time = counter["received"], now
+        print(f"Vazão: {rate:.0f} msg/s | recebidas={counter['received']} inseridas={writer.inserted} "
+              f"spool={writer.spooled} falhas={writer.failed}")
+
+
+async def main(decode, before_write=None, after_write=None, after_failure=None, after_spool=None):
+    """Laço de ingestão assíncrono. `decode(topic, payload)` devolve o documento a gravar ou levanta PayloadRejected;
+    `before_write(batch)` transforma cada lote antes do insert_many, `after_write(batch)` recebe os documentos
+    gravados de cada lote, `after_failure(batch)` cada lote que não pôde ser gravado e `after_spool(batch)` cada
+    lote desviado para o spool."""
+    mongo_client = await connect_to_mongodb()
+    database = mongo_client[MONGO_DATABASE]
+    await asyncio.get_running_loop().run_in_executor(None, prepare_storage)
+    disk_spool, spool_replayer, spool_client = start_spool()
+    writer = AsyncBatchWriter(database[MONGO_COLLECTION], MONGO_BATCH_SIZE, MONGO_FLUSH_INTERVAL_MS, ASYNC_MAX_INFLIGHT,
+                              before_write, after_write, after_failure=after_failure, spool=disk_spool,
+                              after_spool=after_spool)
+    deadletter = AsyncBatchWriter(database[MONGO_DEADLETTER_COLLECTION], MONGO_BATCH_SIZE, MONGO_FLUSH_INTERVAL_MS, 1,
+                                  record_timings=False)
+    counter = {"received": 0}
+    registry.value("messages_received_total", "Mensagens recebidas do MQTT", lambda: counter["received"], "counter")
+    registry.counters("documents_written_total", "Documentos por resultado da gravação no MongoDB",
+                      lambda: {"inserted": writer.inserted, "failed": writer.failed, "spooled": writer.spooled,
+                               "duplicate": writer.duplicates}, label="result")
+    registry.value("deadletter_written_total", "Payloads rejeitados gravados", lambda: deadletter.inserted, "counter")
+    if disk_spool is not None:
+        registry.counters("spool", "Estado do spool local (registros, bytes, segmentos)", disk_spool.snapshot,
+                          kind="gauge")
+    background = [
+        asyncio.create_task(writer.run_timer()),
+        asyncio.create_task(deadletter.run_timer()),
+        asyncio.create_task(report_throughput(counter, writer)),
+    ]
+
+    retry_delay = 5
+    try:
+        while True:
+            try:
+                print(f"Tentando conectar ao broker MQTT em {MQTT_BROKER_HOST}:{MQTT_BROKER_PORT}...")
+                async with aiomqtt.Client(
+                    MQTT_BROKER_HOST,
+                    MQTT_BROKER_PORT,
+                    username=MQTT_USERNAME or None,
+                    password=MQTT_PASSWORD or None,
+                    protocol=aiomqtt.ProtocolVersion.V5,
+                ) as client:
+                    await client.subscribe(MQTT_TOPIC, qos=MQTT_QOS)
+                    print(f"Inscrito no tópico: {MQTT_TOPIC} (QoS {MQTT_QOS}) em modo assíncrono")
+                    async for message in client.messages:
+                        counter["received"] += 1
+                        try:
+                            data = decode(message.topic.value, message.payload)
+                        except PayloadRejected as e:
+                            received_at = datetime.now(timezone.utc)
+                            await deadletter.add(dead_letter_document(message.topic.value, message.payload, e, received_at))
+                            continue
+                        if data is not None: # None: reentrega de um evento já recebido
+                            await writer.add(data)
+            except aiomqtt.MqttError as e:
+                print(f"Falha na conexão MQTT: {e}. Tentando novamente em {retry_delay} segundos...")
+                await asyncio.sleep(retry_delay)
+    finally:
+        for task in background:
+            task.cancel()
+        await writer.close()
+        await deadletter.close()
+        if spool_replayer is not None:
+            spool_replayer.close()
+            disk_spool.close()
+            spool_client.close()
+            print(f"Spool: {disk_spool.snapshot()}")
+        mongo_client.close()
+        print(f"Limpeza concluída: {writer.inserted} inseridos, {writer.spooled} no spool, {writer.failed} com falha, "
+              f"{writer.duplicates} já gravados.")
+
+
+if uvloop is not None:
+    uvloop.install()
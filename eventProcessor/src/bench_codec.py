@@ -0,0 +1,47 @@
+import json
+import os
+import time
+
+import telemetry_codec
+from producer import generate_random_weather_data
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+BENCH_MESSAGES = int(os.getenv("BENCH_MESSAGES", 100000))
+
+
+def firmware_reading(i):
+    """Leitura no formato do firmware do ESP32."""
+    return {"timestamp": "2023-10-27T10:30:00Z", "humidity": round(40 + (i % 600) / 10, 2),
+            "temperature_C": round(18 + (i % 150) / 10, 2)}
+
+
+def measure(name, payloads, decode):
+    started = time.perf_counter()
+    for payload in payloads:
+        decode(payload)
+    elapsed = time.perf_counter() - started
+    size = sum(len(payload) for payload in payloads) / len(payloads)
+    print(f"  {name:<8} {size:>7.1f} bytes/msg {len(payloads) / elapsed:>12,.0f} msg/s decodificadas")
+
+
+def bench(title, readings):
+    print(f"{title} ({len(readings)} mensagens):")
+    json_payloads = [json.dumps(reading).encode() for reading in readings]
+    binary_payloads = [telemetry_codec.encode(reading) for reading in readings]
+    measure("json", json_payloads, json.loads)
+    if orjson is not None:
+        measure("orjson", json_payloads, orjson.loads)
+    measure("binary", binary_payloads, telemetry_codec.decode)
+
+
+def main():
+    bench("Firmware (timestamp, humidity, temperature_C)", [firmware_reading(i) for i in range(BENCH_MESSAGES)])
+    bench("Meteorológico (producer.py)", [generate_random_weather_data() for _ in range(BENCH_MESSAGES)])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+import os
+import random
+import time
+import uuid
+
+import device_sim
+from commands import start_dispatcher
+
+BENCH_COMMAND_RATE = float(os.getenv("BENCH_COMMAND_RATE", 5000))   # Decisões por segundo enviadas ao despachante
+BENCH_COMMAND_DURATION = float(os.getenv("BENCH_COMMAND_DURATION", 20))
+BENCH_COMMAND_FLIP = float(os.getenv("BENCH_COMMAND_FLIP", 0.3))     # Probabilidade de a decisão inverter o estado
+BENCH_COMMAND_DRAIN_TIMEOUT = float(os.getenv("BENCH_COMMAND_DRAIN_TIMEOUT", 30))
+
+
+def submit_decisions(dispatcher, devices, rate, duration, flip, seed=None):
+    """Envia decisões de irrigação no ritmo pedido; devolve o último estado pedido por dispositivo."""
+    rng = random.Random(seed)
+    desired = {}
+    interval = 1.0 / rate
+    started = time.perf_counter()
+    deadline = started + duration
+    count = 0
+    next_send = started
+    while next_send < deadline:
+        now = time.perf_counter()
+        if next_send > now:
+            time.sleep(next_send - now)
+        device = rng.choice(devices)
+        state = desired.get(device, "off")
+        if rng.random() < flip:
+            state = "on" if state == "off" else "off"
+        desired[device] = state
+        dispatcher.submit(device, state)
+        count += 1
+        next_send = started + count * interval
+    return desired, count, time.perf_counter() - started
+
+
+def main():
+    run_id = uuid.uuid4().hex[:12]
+    pool = device_sim.start(run_id=run_id)
+    dispatcher = start_dispatcher(f"bench-commands-{run_id}")
+    try:
+        devices = device_sim.device_names(device_sim.DEVICE_SIM_DEVICES)
+        print(f"Decisões: {BENCH_COMMAND_RATE:,.0f}/s por {BENCH_COMMAND_DURATION:.0f}s, "
+              f"{BENCH_COMMAND_FLIP:.0%} de inversões, {len(devices)} dispositivo(s)")
+        desired, submitted, elapsed = submit_decisions(dispatcher, devices, BENCH_COMMAND_RATE,
+                                                       BENCH_COMMAND_DURATION, BENCH_COMMAND_FLIP)
+        drained = dispatcher.drain(BENCH_COMMAND_DRAIN_TIMEOUT)
+        stats = dispatcher.stats()
+        states = device_sim.device_states(pool)
+        # Dispositivos sem decisão continuam "off"; os demais devem terminar no último estado pedido
+        mismatched = sum(1 for device, state in desired.items() if states.get(device) != state)
+
+        print(f"\nExecução '{run_id}':")
+        print(f"  decisões:      {submitted} ({submitted / elapsed:,.0f}/s)")
+        print(f"  publicados:    {stats['published']} ({stats['published'] / elapsed:,.0f}/s), "
+              f"coalescidos {stats['coalesced']}, adiados pelo limite de taxa {stats['rate_limited']}")
+        print(f"  confirmados:   {stats['acked']}, reenvios {stats['retried']}, falhas {stats['failed']}, "
+              f"confirmações tardias {stats['late_acks']}{'' if drained else ', pendentes ' + str(stats['pending'])}")
+        print(f"  latência (publicação -> confirmação, ms): p50 {stats['ack_p50_ms']:.1f}  "
+              f"p95 {stats['ack_p95_ms']:.1f}  p99 {stats['ack_p99_ms']:.1f}")
+        print(f"  dispositivos:  {device_sim.summarize(pool)}")
+        print(f"  estado final divergente em {mismatched} de {len(desired)} dispositivo(s)")
+    finally:
+        dispatcher.close()
+        dispatcher.client.disconnect()
+        dispatcher.client.loop_stop()
+        for connection in pool:
+            connection.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+import math
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+import pymongo
+
+import loadgen
+from storage_layout import event_source
+
+MQTT_BROKER_HOST = os.getenv("MQTT_BROKER_HOST", "localhost")
+MQTT_BROKER_PORT = int(os.getenv("MQTT_BROKER_PORT", 1883))
+MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017/")
+MONGO_DATABASE = os.getenv("MONGO_DATABASE", "trainstormdb")
+MONGO_COLLECTION = os.getenv("MONGO_COLLECTION", "events")
+
+BENCH_COMPOSE = os.getenv("BENCH_COMPOSE", "0") == "1" # Sobe RabbitMQ e MongoDB do event-resource/docker-compose.yml
+BENCH_COMPOSE_FILE = os.getenv("BENCH_COMPOSE_FILE", os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "..", "event-resource", "docker-compose.yml"))
+BENCH_COMPOSE_SERVICES = os.getenv("BENCH_COMPOSE_SERVICES", "mongodb,rabbitmq").split(",")
+BENCH_START_CONSUMER = os.getenv("BENCH_START_CONSUMER", "1") == "1" # Inicia consumer.py em um subprocesso
+BENCH_WARMUP = float(os.getenv("BENCH_WARMUP", 3))             # Segundos para o consumidor assinar o tópico
+BENCH_DRAIN_TIMEOUT = float(os.getenv("BENCH_DRAIN_TIMEOUT", 60)) # Espera máxima pelos últimos documentos
+# Campo em que o consumidor marca a ida do lote ao insert_many; repassado ao consumer.py iniciado aqui
+STORED_AT_FIELD = os.getenv("STORED_AT_FIELD", "stored_at")
+
+
+def compose_up():
+    command = ["docker", "compose", "-f", BENCH_COMPOSE_FILE, "up", "-d"] + BENCH_COMPOSE_SERVICES
+    print(f"Subindo serviços: {' '.join(command)}")
+    subprocess.run(command, check=True)
+
+
+def wait_for_services(timeout=90):
+    """Espera a porta do broker aceitar conexões e o MongoDB responder ao ping."""
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            socket.create_connection((MQTT_BROKER_HOST, MQTT_BROKER_PORT), timeout=2).close()
+            client = pymongo.MongoClient(MONGO_URI, serverSelectionTimeoutMS=2000)
+            try:
+                client.admin.command("ping")
+            finally:
+                client.close()
+            return
+        except (OSError, pymongo.errors.PyMongoError) as e:
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"Serviços indisponíveis após {timeout}s: {e}") from None
+            time.sleep(1)
+
+
+def start_consumer():
+    print("Iniciando consumer.py...")
+    # Mesmo interpretador e diretório do consumidor; a configuração vem do ambiente atual
+    process = subprocess.Popen([sys.executable, "consumer.py"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                               env=dict(os.environ, STORED_AT_FIELD=STORED_AT_FIELD))
+    time.sleep(BENCH_WARMUP)
+    if process.poll() is not None:
+        raise RuntimeError(f"consumer.py encerrou na inicialização (código {process.returncode})")
+    return process
+
+
+def stop_consumer(process):
+    # SIGINT: o consumidor descarrega o buffer de gravação antes de sair
+    process.send_signal(signal.SIGINT)
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+def wait_for_drain(collection, run_id, expected):
+    """Espera os documentos da execução pararem de chegar (ou todos chegarem)."""
+    deadline = time.monotonic() + BENCH_DRAIN_TIMEOUT
+    last = -1
+    while time.monotonic() < deadline:
+        stored = collection.count_documents({"run_id": run_id})
+        if stored >= expected or stored == last:
+            return stored
+        last = stored
+        time.sleep(2)
+    return collection.count_documents({"run_id": run_id})
+
+
+def percentile(values, fraction):
+    """Percentil pelo método do posto mais próximo; `values` já ordenado."""
+    if not values:
+        return float("nan")
+    return values[max(0, math.ceil(fraction * len(values)) - 1)]
+
+
+def format_latencies(values):
+    return (f"p50 {percentile(values, 0.50):.1f}  p95 {percentile(values, 0.95):.1f}  "
+            f"p99 {percentile(values, 0.99):.1f}  máx {values[-1] if values else float('nan'):.1f}")
+
+
+def report(collection, summary):
+    latencies = []
+    stored_latencies = []
+    seen = set()
+    duplicates = 0
+    first = last = None
+    cursor = collection.find({"run_id": summary["run_id"]},
+                             {"sent_at": 1, "received_at": 1, STORED_AT_FIELD: 1, "seq": 1, "deviceId": 1, "meta": 1})
+    for doc in cursor:
+        identity = (event_source(doc, "deviceId"), doc.get("seq"))
+        if identity in seen:
+            duplicates += 1
+            continue
+        seen.add(identity)
+        received = doc["received_at"].timestamp()
+        latencies.append((received - doc["sent_at"]) * 1000)
+        if doc.get(STORED_AT_FIELD) is not None:
+            stored_latencies.append((doc[STORED_AT_FIELD].timestamp() - doc["sent_at"]) * 1000)
+        first = received if first is None else min(first, received)
+        last = received if last is None else max(last, received)
+    latencies.sort()
+    stored_latencies.sort()
+    received_count = len(seen)
+    lost = summary["published"] - received_count
+    span = (last - first) if received_count > 1 else 0.0
+
+    print(f"\nExecução '{summary['run_id']}' (QoS {summary['qos']}):")
+    print(f"  publicadas:  {summary['published']} ({summary['rate']:,.0f} msg/s)")
+    print(f"  armazenadas: {received_count} ({received_count / span if span else 0:,.0f} msg/s), "
+          f"duplicadas: {duplicates}")
+    print(f"  perdidas:    {lost} ({lost / summary['published'] * 100 if summary['published'] else 0:.2f}%)")
+    # Até a recepção: não inclui a fila dos workers, a espera no lote nem a gravação
+    print(f"  latência publicação -> recepção no consumidor (ms): {format_latencies(latencies)}")
+    if stored_latencies:
+        # Até o lote seguir para o insert_many: inclui fila, lote e pontuação; não inclui a ida e volta do insert
+        print(f"  latência publicação -> gravação no MongoDB (ms):   {format_latencies(stored_latencies)}"
+              f" ({len(stored_latencies)} documento(s) com '{STORED_AT_FIELD}')")
+    else:
+        print(f"  latência publicação -> gravação: indisponível (consumidor sem STORED_AT_FIELD={STORED_AT_FIELD})")
+
+
+def main():
+    if BENCH_COMPOSE:
+        compose_up()
+    wait_for_services()
+    consumer = start_consumer() if BENCH_START_CONSUMER else None
+    client = pymongo.MongoClient(MONGO_URI, serverSelectionTimeoutMS=5000, tz_aware=True) # received_at e stored_at em UTC
+    try:
+        summary = loadgen.run()
+        collection = client[MONGO_DATABASE][MONGO_COLLECTION]
+        stored = wait_for_drain(collection, summary["run_id"], summary["published"])
+        print(f"{stored} documento(s) da execução encontrados em '{MONGO_COLLECTION}'.")
+        report(collection, summary)
+    finally:
+        if consumer is not None:
+            stop_consumer(consumer)
+        client.close()
+
+
+if __name__ == "__main__":
+    main()
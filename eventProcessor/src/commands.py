@@ -0,0 +1,277 @@
+import heapq
+import json
+import math
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+
+import paho.mqtt.client as mqtt
+
+from storage_layout import event_source
+
+MQTT_BROKER_HOST = os.getenv("MQTT_BROKER_HOST", "127.0.0.1")
+MQTT_BROKER_PORT = int(os.getenv("MQTT_BROKER_PORT", 1883))
+MQTT_USERNAME = os.getenv("MQTT_USERNAME", "user")
+MQTT_PASSWORD = os.getenv("MQTT_PASSWORD", "password")
+
+# Tópicos por dispositivo: o comando vai para devices/<id>/commands/pump e a confirmação volta em .../ack
+COMMAND_TOPIC_TEMPLATE = os.getenv("COMMAND_TOPIC_TEMPLATE", "devices/{device}/commands/pump")
+COMMAND_ACK_TOPIC_TEMPLATE = os.getenv("COMMAND_ACK_TOPIC_TEMPLATE", "devices/{device}/commands/ack")
+COMMAND_RATE_PER_DEVICE = float(os.getenv("COMMAND_RATE_PER_DEVICE", 1.0)) # Comandos por segundo por dispositivo
+COMMAND_BURST = int(os.getenv("COMMAND_BURST", 2)) # Comandos seguidos permitidos antes do limite de taxa
+COMMAND_ACK_TIMEOUT = float(os.getenv("COMMAND_ACK_TIMEOUT", 5)) # Segundos sem confirmação até reenviar
+COMMAND_MAX_RETRIES = int(os.getenv("COMMAND_MAX_RETRIES", 2))
+COMMAND_MAX_INFLIGHT = int(os.getenv("COMMAND_MAX_INFLIGHT", 10000)) # Publicações QoS1 sem PUBACK na conexão
+
+STATES = ("on", "off")
+
+
+def percentile(values, fraction):
+    """Percentil pelo método do posto mais próximo; `values` já ordenado."""
+    if not values:
+        return float("nan")
+    return values[max(0, math.ceil(fraction * len(values)) - 1)]
+
+
+class CommandDispatcher:
+    """Envia comandos de liga/desliga da bomba para o tópico de cada dispositivo.
+
+    - Coalescência: um comando igual ao último enviado para o dispositivo é descartado, e
+      comandos que chegam enquanto o anterior espera a vez substituem o pendente (só o
+      estado mais recente é enviado).
+    - Limite de taxa por dispositivo (token bucket): o excedente fica pendente e sai quando
+      houver ficha, já coalescido.
+    - Cada comando tem um `id`; o dispositivo confirma publicando `{"id": ..., "state": ...}`
+      no tópico de ack, e a latência entre a publicação e a confirmação é registrada. Sem
+      confirmação em `ack_timeout` segundos o comando é reenviado até `max_retries` vezes,
+      dobrando o prazo a cada tentativa para não agravar um broker ou rede sobrecarregados.
+
+    A publicação é feita por uma única thread, fora do caminho de quem chama `submit`.
+    """
+
+    def __init__(self, client, rate=COMMAND_RATE_PER_DEVICE, burst=COMMAND_BURST, ack_timeout=COMMAND_ACK_TIMEOUT,
+                 max_retries=COMMAND_MAX_RETRIES, topic_template=COMMAND_TOPIC_TEMPLATE,
+                 ack_topic_template=COMMAND_ACK_TOPIC_TEMPLATE, qos=1):
+        self.client = client
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.ack_timeout = ack_timeout
+        self.max_retries = max_retries
+        self.topic_template = topic_template
+        self.ack_topic_template = ack_topic_template
+        self.qos = qos
+        self._cond = threading.Condition()
+        self._desired = {}   # dispositivo -> estado ainda não enviado (já coalescido)
+        self._ready = deque() # dispositivos com comando pendente, na ordem de chegada
+        self._waiting = []   # heap (instante em que haverá ficha, dispositivo)
+        self._buckets = {}   # dispositivo -> [fichas, último instante]
+        self._sent = {}      # dispositivo -> último estado publicado
+        self._attempts = {}  # dispositivo -> tentativa do próximo envio (reenvios)
+        self._inflight = {}  # id -> (dispositivo, estado, instante da publicação, tentativa)
+        self._deadlines = [] # heap (prazo da confirmação, id); ids já confirmados são ignorados ao sair
+        self._next_id = 1
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="command-dispatcher", daemon=True)
+        self.latencies = deque(maxlen=200_000) # Segundos entre a publicação e a confirmação
+        self.counters = {
+            "submitted": 0, "coalesced": 0, "rate_limited": 0, "published": 0, "acked": 0,
+            "retried": 0, "failed": 0, "late_acks": 0,
+        }
+
+    def start(self):
+        ack_topic = self.ack_topic_template.format(device="+")
+        self.client.message_callback_add(ack_topic, self._on_ack)
+        self.client.subscribe(ack_topic, qos=1)
+        resubscribe_on_reconnect(self.client, (ack_topic, 1))
+        self._thread.start()
+        return self
+
+    def submit(self, device, state):
+        """Pede que o dispositivo fique no estado `state` ("on" ou "off")."""
+        if state not in STATES:
+            raise ValueError(f"Estado inválido: {state!r} (use um de {STATES})")
+        with self._cond:
+            self.counters["submitted"] += 1
+            if device in self._desired:
+                self._desired[device] = state # Substitui o pendente: só o mais recente importa
+                self.counters["coalesced"] += 1
+                return
+            if self._sent.get(device) == state:
+                self.counters["coalesced"] += 1
+                return
+            self._desired[device] = state
+            self._ready.append(device)
+            self._cond.notify()
+
+    def dispatch_decisions(self, batch, field="irrigation"):
+        """Converte as previsões gravadas pelo estágio de pontuação em comandos; devolve o lote."""
+        for doc in batch:
+            decision = doc.get(field)
+            device = event_source(doc, "deviceId")
+            if decision is not None and device is not None:
+                self.submit(device, "on" if decision.get("action") == 1 else "off")
+        return batch
+
+    def _take_token(self, device, now):
+        bucket = self._buckets.get(device)
+        if bucket is None:
+            bucket = self._buckets[device] = [float(self.burst), now]
+        else:
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+        if bucket[0] >= 1.0:
+            bucket[0] -= 1.0
+            return 0.0
+        return (1.0 - bucket[0]) / self.rate if self.rate > 0 else self.ack_timeout
+
+    def _expire(self, now):
+        while self._deadlines and self._deadlines[0][0] <= now:
+            command_id = heapq.heappop(self._deadlines)[1]
+            entry = self._inflight.pop(command_id, None)
+            if entry is None:
+                continue # Confirmado dentro do prazo
+            device, state, sent_at, attempt = entry
+            if self._sent.get(device) != state or device in self._desired:
+                continue # Já existe um comando mais novo para o dispositivo
+            del self._sent[device] # Estado do dispositivo desconhecido: o próximo pedido não é coalescido
+            if attempt < self.max_retries:
+                self.counters["retried"] += 1
+                self._attempts[device] = attempt + 1
+                self._desired[device] = state
+                self._ready.append(device)
+            else:
+                self.counters["failed"] += 1
+
+    def _next_batch(self, limit=1000):
+        """Escolhe, sob o lock, os comandos que podem sair agora."""
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                while self._waiting and self._waiting[0][0] <= now:
+                    self._ready.append(heapq.heappop(self._waiting)[1])
+                self._expire(now)
+                if self._ready or self._stop.is_set():
+                    break
+                timeout = self.ack_timeout
+                if self._waiting:
+                    timeout = min(timeout, self._waiting[0][0] - now)
+                if self._deadlines:
+                    timeout = min(timeout, self._deadlines[0][0] - now)
+                self._cond.wait(max(timeout, 0.001))
+            batch = []
+            while self._ready and len(batch) < limit:
+                device = self._ready.popleft()
+                state = self._desired.get(device)
+                if state is None:
+                    continue
+                if state == self._sent.get(device):
+                    del self._desired[device] # Voltou ao estado já enviado enquanto esperava
+                    self.counters["coalesced"] += 1
+                    continue
+                wait = self._take_token(device, now)
+                if wait > 0:
+                    self.counters["rate_limited"] += 1
+                    heapq.heappush(self._waiting, (now + wait, device))
+                    continue
+                del self._desired[device]
+                command_id = self._next_id
+                self._next_id += 1
+                attempt = self._attempts.pop(device, 0)
+                self._inflight[command_id] = (device, state, now, attempt)
+                heapq.heappush(self._deadlines, (now + self.ack_timeout * 2 ** attempt, command_id))
+                self._sent[device] = state
+                batch.append((command_id, device, state, attempt))
+            return batch
+
+    def _run(self):
+        while not self._stop.is_set():
+            for command_id, device, state, attempt in self._next_batch():
+                payload = json.dumps({"id": command_id, "cmd": "pump", "state": state, "attempt": attempt,
+                                      "issued_at": datetime.now(timezone.utc).isoformat()})
+                result = self.client.publish(self.topic_template.format(device=device), payload, qos=self.qos)
+                if result.rc == mqtt.MQTT_ERR_SUCCESS:
+                    self.counters["published"] += 1
+                else:
+                    print(f"Falha ao publicar comando {command_id} para '{device}': código {result.rc}")
+
+    def _on_ack(self, client, userdata, msg):
+        # Thread de rede do paho
+        received = time.monotonic()
+        try:
+            ack = json.loads(msg.payload)
+            command_id = int(ack["id"])
+        except (ValueError, KeyError, TypeError):
+            print(f"Confirmação inválida em '{msg.topic}': {msg.payload[:100]!r}")
+            return
+        with self._cond:
+            entry = self._inflight.pop(command_id, None)
+            if entry is None:
+                self.counters["late_acks"] += 1 # Depois do tempo limite ou duplicada
+                return
+            self.counters["acked"] += 1
+            self.latencies.append(received - entry[2])
+
+    def pending(self):
+        with self._cond:
+            return len(self._desired) + len(self._inflight)
+
+    def drain(self, timeout=10):
+        """Espera os comandos pendentes serem enviados e confirmados (ou falharem)."""
+        deadline = time.monotonic() + timeout
+        while self.pending() and time.monotonic() < deadline:
+            time.sleep(0.05)
+        return self.pending() == 0
+
+    def stats(self):
+        latencies = sorted(self.latencies)
+        summary = dict(self.counters)
+        summary["pending"] = self.pending()
+        for name, fraction in (("p50", 0.50), ("p95", 0.95), ("p99", 0.99)):
+            summary[f"ack_{name}_ms"] = round(percentile(latencies, fraction) * 1000, 2)
+        return summary
+
+    def close(self):
+        self._stop.set()
+        with self._cond:
+            self._cond.notify()
+        if self._thread.is_alive():
+            self._thread.join()
+
+
+def connect_client(client_id, timeout=10):
+    """Conexão MQTT 3.1.1 (a mesma versão do PubSubClient do firmware) com a rede em thread própria."""
+    client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=client_id, protocol=mqtt.MQTTv311)
+    if MQTT_USERNAME and MQTT_PASSWORD:
+        client.username_pw_set(MQTT_USERNAME, MQTT_PASSWORD)
+    client.max_inflight_messages_set(COMMAND_MAX_INFLIGHT)
+    connected = threading.Event()
+    client.on_connect = lambda c, userdata, flags, rc, properties=None: connected.set() if rc == 0 else print(
+        f"Falha ao conectar '{client_id}' ao broker MQTT, código de retorno: {rc}")
+    client.connect(MQTT_BROKER_HOST, MQTT_BROKER_PORT, 60)
+    client.loop_start()
+    if not connected.wait(timeout):
+        raise ConnectionError(f"'{client_id}' sem CONNACK após {timeout}s ({MQTT_BROKER_HOST}:{MQTT_BROKER_PORT})")
+    return client
+
+
+def resubscribe_on_reconnect(client, *subscriptions):
+    """Refaz as assinaturas a cada reconexão: na sessão limpa do MQTT 3.1.1 o broker as esquece quando a
+    conexão cai. Cada item é um argumento de `client.subscribe` ((tópico, qos) ou lista deles)."""
+    previous = client.on_connect
+
+    def on_connect(client, userdata, flags, rc, properties=None):
+        if previous is not None:
+            previous(client, userdata, flags, rc, properties)
+        if rc == 0:
+            for topics in subscriptions:
+                client.subscribe(topics)
+
+    client.on_connect = on_connect
+
+
+def start_dispatcher(client_id=None):
+    """Conecta ao broker e inicia um despachante com a configuração das variáveis de ambiente."""
+    client = connect_client(client_id or f"command-dispatcher-{os.getpid()}")
+    return CommandDispatcher(client).start()
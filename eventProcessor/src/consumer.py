@@ -1,8 +1,28 @@
 import paho.mqtt.client as mqtt
 import pymongo
-import json
+import logging
 import os
 import time
+import zlib
+from datetime import datetime, timezone
+
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.properties import Properties
+
+import payload_schema
+from payload_schema import PayloadRejected
+from pipeline import IngestPipeline, POLICY_NOACK
+from spool import DiskSpool, SpoolReplayer
+from rollups import RollupAggregator
+from scoring import BatchScorer
+from commands import connect_client, start_dispatcher
+from dedup import RecentIds, event_id
+from logs import get_logger
+from metrics import registry, start_metrics_server, start_profiler
+from query_cache import IngestNotifier
+from stage_timings import timer
+from storage_layout import LAYOUT_FLAT, LAYOUT_TIMESERIES, TIME_FIELD, ensure_collection, shape_document
+from write_buffer import MongoWriteBuffer
 
 # Configurações (preferencialmente via variáveis de ambiente)
 #MQTT_BROKER_HOST = os.getenv("MQTT_BROKER_HOST", "test.mosquitto.org") # Use 'rabbitmq' se rodar o script fora de um container na mesma rede docker
@@ -11,15 +31,83 @@ MQTT_BROKER_PORT = int(os.getenv("MQTT_BROKER_PORT", 1883))
 MQTT_TOPIC = os.getenv("MQTT_TOPIC", "sensor/data") # Tópico para se inscrever
 MQTT_USERNAME = os.getenv("MQTT_USERNAME", "user")
 MQTT_PASSWORD = os.getenv("MQTT_PASSWORD", "password")
+MQTT_QOS = int(os.getenv("MQTT_QOS", 1)) # QoS da subscrição
 
 MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017/") # Use 'mongodb://mongodb:27017/' se rodar o script em um container na mesma rede docker
 MONGO_DATABASE = os.getenv("MONGO_DATABASE", "trainstormdb")
 MONGO_COLLECTION = os.getenv("MONGO_COLLECTION", "events")
+MONGO_BATCH_SIZE = int(os.getenv("MONGO_BATCH_SIZE", 500)) # Documentos por insert_many
+MONGO_FLUSH_INTERVAL_MS = int(os.getenv("MONGO_FLUSH_INTERVAL_MS", 200)) # Tempo máximo que um documento espera no buffer
+MONGO_MAX_PENDING = int(os.getenv("MONGO_MAX_PENDING", 20000)) # Documentos no buffer antes de os workers esperarem
+STORAGE_LAYOUT = os.getenv("STORAGE_LAYOUT", LAYOUT_FLAT) # flat | timeseries (coleção time-series do MongoDB)
+MONGO_DEADLETTER_COLLECTION = os.getenv("MONGO_DEADLETTER_COLLECTION", "events_deadletter") # Payloads rejeitados
+
+# Rollups incrementais (min/max/média/contagem por chave e janela) gravados em <prefixo><janela>
+ROLLUPS_ENABLED = os.getenv("ROLLUPS_ENABLED", "1") == "1"
+ROLLUP_KEY = os.getenv("ROLLUP_KEY", "auto") # auto (deviceId, city ou topic) | deviceId | city | topic
+ROLLUP_FIELDS = os.getenv("ROLLUP_FIELDS", "temperature,humidity,windSpeed,precipitation").split(",")
+ROLLUP_COLLECTION_PREFIX = os.getenv("ROLLUP_COLLECTION_PREFIX", "events_rollup_") # events_rollup_1m, events_rollup_1h
+ROLLUP_LATENESS = int(os.getenv("ROLLUP_LATENESS", 10)) # Segundos de tolerância a eventos atrasados antes de fechar a janela
+ROLLUP_FLUSH_INTERVAL = int(os.getenv("ROLLUP_FLUSH_INTERVAL", 5))
+
+# Pontuação em linha: previsão de irrigação (FarmTechML) gravada no próprio documento do evento
+SCORING_ENABLED = os.getenv("SCORING_ENABLED", "0") == "1"
+SCORING_MODEL_PATH = os.getenv("SCORING_MODEL_PATH", "../../FarmTechML/modelo_irrigacao.npz") # Floresta compilada
+SCORING_MODULE_PATH = os.getenv("SCORING_MODULE_PATH", "../../FarmTechML") # Diretório de floresta_compilada.py
+SCORING_FIELD = os.getenv("SCORING_FIELD", "irrigation")
+SCORING_DEFAULT_NUTRIENTS = float(os.getenv("SCORING_DEFAULT_NUTRIENTS", 150.0)) # nutrientes_N quando o evento não traz
+SCORING_RELOAD_INTERVAL = int(os.getenv("SCORING_RELOAD_INTERVAL", 5)) # Segundos entre verificações de modelo novo
+# Comandos para a bomba (devices/<id>/commands/pump) a partir das previsões; exige SCORING_ENABLED=1
+COMMANDS_ENABLED = os.getenv("COMMANDS_ENABLED", "0") == "1"
+# Aviso por lote gravado para a API de consulta (query_api.py) invalidar o cache dos dispositivos do lote
+QUERY_INVALIDATION_ENABLED = os.getenv("QUERY_INVALIDATION_ENABLED", "1") == "1"
+# IDs determinísticos para os eventos com número de sequência e filtro das reentregas recentes
+DEDUP_ENABLED = os.getenv("DEDUP_ENABLED", "1") == "1"
+DEDUP_CACHE_SIZE = int(os.getenv("DEDUP_CACHE_SIZE", 200000)) # IDs recentes mantidos em memória por processo
+
+VALIDATION_ENABLED = os.getenv("VALIDATION_ENABLED", "1") == "1" # Valida os formatos conhecidos de payload
+VALIDATION_REJECT_UNKNOWN = os.getenv("VALIDATION_REJECT_UNKNOWN", "1") == "1" # Rejeita formatos desconhecidos
+PRINT_PAYLOADS = os.getenv("PRINT_PAYLOADS", "0") == "1" # Registra cada mensagem em DEBUG (o mesmo que LOG_LEVEL=DEBUG aqui)
+STAGE_TIMINGS_INTERVAL = int(os.getenv("STAGE_TIMINGS_INTERVAL", 30)) # Segundos entre relatórios de tempo por estágio (0 desativa)
+# Campo que recebe o instante em que o lote segue para o insert_many (vazio desativa; usado pelo bench_pipeline.py)
+STORED_AT_FIELD = os.getenv("STORED_AT_FIELD", "")
+
+# Spool local (write-ahead log) usado enquanto o MongoDB estiver indisponível
+SPOOL_ENABLED = os.getenv("SPOOL_ENABLED", "1") == "1"
+SPOOL_DIR = os.getenv("SPOOL_DIR", "spool")
+SPOOL_SEGMENT_BYTES = int(os.getenv("SPOOL_SEGMENT_BYTES", 16 * 1024 * 1024))
+SPOOL_MAX_BYTES = int(os.getenv("SPOOL_MAX_BYTES", 1024 * 1024 * 1024))
+SPOOL_FSYNC_BATCH = int(os.getenv("SPOOL_FSYNC_BATCH", 1000)) # Registros entre fsyncs
+SPOOL_FSYNC_INTERVAL_MS = int(os.getenv("SPOOL_FSYNC_INTERVAL_MS", 500))
+SPOOL_REPLAY_BATCH = int(os.getenv("SPOOL_REPLAY_BATCH", 5000)) # Documentos por insert_many na reprodução
+SPOOL_HEALTH_INTERVAL = int(os.getenv("SPOOL_HEALTH_INTERVAL", 5)) # Segundos entre verificações do MongoDB
+
+PIPELINE_WORKERS = int(os.getenv("PIPELINE_WORKERS", 4)) # Workers de decodificação/enriquecimento/gravação
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", 10000)) # Capacidade da fila entre o MQTT e os workers
+PIPELINE_BACKPRESSURE = os.getenv("PIPELINE_BACKPRESSURE", POLICY_NOACK) # noack | spill | drop
+PIPELINE_SPILL_PATH = os.getenv("PIPELINE_SPILL_PATH", "spill/ingest.spill")
+
+CONSUMER_MODE = os.getenv("CONSUMER_MODE", "sync") # sync (paho + threads) | async (asyncio) | multiprocess (supervisor.py)
+# Particionamento para brokers sem subscrições compartilhadas: cada processo fica só com a sua fatia
+CONSUMER_PARTITION_INDEX = int(os.getenv("CONSUMER_PARTITION_INDEX", 0))
+CONSUMER_PARTITION_COUNT = int(os.getenv("CONSUMER_PARTITION_COUNT", 1))
 
 mongo_client_instance = None
 db_collection = None
+write_buffer = None
+deadletter_buffer = None
+ingest_pipeline = None
+disk_spool = None
+event_observers = [] # Estágios que acompanham cada evento gravado ou no spool (ex.: rollups), nos dois modos
+recent_ids = RecentIds(DEDUP_CACHE_SIZE) if DEDUP_ENABLED else None
+
+log = get_logger("consumer")
+if PRINT_PAYLOADS:
+    log.setLevel(logging.DEBUG)
 
-def connect_to_mongodb():
+def connect_to_mongodb(block=True):
+    """Conecta ao MongoDB. Com block=False faz uma única tentativa e devolve False se falhar
+    (o cliente continua criado: o pymongo reconecta sozinho quando o servidor voltar)."""
     global mongo_client_instance, db_collection
     retry_delay = 5
     while True:
@@ -30,8 +118,12 @@ def connect_to_mongodb():
             db = mongo_client_instance[MONGO_DATABASE]
             db_collection = db[MONGO_COLLECTION]
             print(f"Conectado com sucesso ao MongoDB: DB='{MONGO_DATABASE}', Collection='{MONGO_COLLECTION}'.")
-            break
+            return True
         except pymongo.errors.ConnectionFailure as e:
+            if not block:
+                db_collection = mongo_client_instance[MONGO_DATABASE][MONGO_COLLECTION]
+                print(f"Falha na conexão com MongoDB: {e}. As mensagens serão gravadas no spool local.")
+                return False
             print(f"Falha na conexão com MongoDB: {e}. Tentando novamente em {retry_delay} segundos...")
             time.sleep(retry_delay)
         except Exception as e:
@@ -41,41 +133,246 @@ def connect_to_mongodb():
 def on_connect(client, userdata, flags, rc, properties=None): # properties adicionado para compatibilidade com paho-mqtt v2+
     if rc == 0:
         print(f"Conectado ao Broker MQTT: {MQTT_BROKER_HOST}:{MQTT_BROKER_PORT}")
-        client.subscribe(MQTT_TOPIC)
-        print(f"Inscrito no tópico: {MQTT_TOPIC}")
+        client.subscribe(MQTT_TOPIC, qos=MQTT_QOS)
+        print(f"Inscrito no tópico: {MQTT_TOPIC} (QoS {MQTT_QOS})")
     else:
         print(f"Falha ao conectar ao Broker MQTT, código de retorno: {rc}")
 
 def on_message(client, userdata, msg):
-    payload = msg.payload.decode()
-    print(f"Mensagem recebida do tópico '{msg.topic}': {payload}")
+    # Executa na thread de rede do paho: apenas enfileira os bytes brutos
+    if CONSUMER_PARTITION_COUNT > 1 and zlib.crc32(msg.payload) % CONSUMER_PARTITION_COUNT != CONSUMER_PARTITION_INDEX:
+        if PIPELINE_BACKPRESSURE == POLICY_NOACK and msg.qos > 0:
+            client.ack(msg.mid, msg.qos) # Mensagem de outra partição: confirma e descarta
+        return
+    ingest_pipeline.submit(msg.topic, msg.payload, msg.mid, msg.qos)
+
+def decode_event(topic, payload):
+    """Decodifica o payload direto dos bytes, valida o formato e enriquece com o tópico e o instante de recebimento.
+
+    Levanta PayloadRejected se o payload for inválido e devolve None se o evento já foi gravado ou está
+    num lote a caminho (reentrega do QoS 1), antes dos rollups e da gravação.
+    """
+    started = time.perf_counter_ns()
+    data = payload_schema.decode(payload, topic)
+    decoded = time.perf_counter_ns()
+    timer.record("decode", decoded - started)
+    if VALIDATION_ENABLED:
+        payload_schema.validate(data, VALIDATION_REJECT_UNKNOWN)
+        validated = time.perf_counter_ns()
+        timer.record("validate", validated - decoded)
+        decoded = validated
+    data["topic"] = topic
+    data["received_at"] = datetime.now(timezone.utc)
+    if recent_ids is not None:
+        key = event_id(data)
+        if key is not None:
+            if recent_ids.seen(key):
+                return None
+            data["_id"] = key
+    data = shape_document(data, STORAGE_LAYOUT)
+    timer.record("enrich", time.perf_counter_ns() - decoded)
+    return data
+
+def observe_batch(batch):
+    """Entrega aos observadores os documentos já gravados (ou no spool). Os rollups são aditivos: um evento visto
+    na decodificação e depois reentregue, porque o lote falhou, seria somado duas vezes."""
+    if not event_observers:
+        return
+    started = time.perf_counter_ns()
+    for data in batch:
+        for observe in event_observers:
+            observe(data)
+    timer.record("observe", time.perf_counter_ns() - started, len(batch))
+
+def process_payload(topic, payload, delivery=None):
+    """Estágio dos workers: decodifica, valida, enriquece e envia o documento ao buffer de gravação.
+
+    Devolve True se a confirmação da mensagem (`delivery`) ficou com um buffer, que a envia depois de gravar.
+    """
     try:
-        data = json.loads(payload)
-        if db_collection is not None:
-            db_collection.insert_one(data)
-            print(f"Dados inseridos no MongoDB: {data}")
-        else:
-            print("Coleção MongoDB não está disponível. Mensagem não armazenada.")
-    except json.JSONDecodeError:
-        print(f"Erro ao decodificar JSON: {payload}")
-    except Exception as e:
-        print(f"Erro ao processar mensagem ou inserir no MongoDB: {e}")
+        data = decode_event(topic, payload)
+    except PayloadRejected as e:
+        if deadletter_buffer is None:
+            return False
+        deadletter_buffer.add(payload_schema.dead_letter_document(topic, payload, e, datetime.now(timezone.utc)),
+                              delivery)
+        return True
+    if data is None:
+        return False # Reentrega de um evento já recebido
+    log.debug("Mensagem recebida do tópico '%s': %s", topic, data)
+    if write_buffer is None:
+        log.warning("Coleção MongoDB não está disponível. Mensagem não armazenada.")
+        return False
+    write_buffer.add(data, delivery) # A gravação acontece em lote na thread do buffer
+    return True
+
+def start_rollups(database):
+    """Liga a agregação incremental ao fluxo de eventos; devolve o agregador para o encerramento."""
+    aggregator = RollupAggregator(database, fields=ROLLUP_FIELDS, key=ROLLUP_KEY,
+                                  collection_prefix=ROLLUP_COLLECTION_PREFIX, lateness=ROLLUP_LATENESS,
+                                  flush_interval=ROLLUP_FLUSH_INTERVAL).start()
+    event_observers.append(aggregator.add)
+    return aggregator
+
+def start_scoring():
+    """Carrega o modelo para a pontuação em linha; devolve None se ela estiver desativada."""
+    if not SCORING_ENABLED:
+        return None
+    return BatchScorer(SCORING_MODEL_PATH, SCORING_MODULE_PATH, SCORING_DEFAULT_NUTRIENTS, SCORING_FIELD,
+                       SCORING_RELOAD_INTERVAL)
+
+def start_commands(scorer):
+    """Liga o despacho de comandos às previsões; devolve o gancho de gravação e o despachante (ou None)."""
+    if scorer is None:
+        if COMMANDS_ENABLED:
+            print("COMMANDS_ENABLED requer SCORING_ENABLED=1; comandos desativados.")
+        return None, None
+    if not COMMANDS_ENABLED:
+        return scorer.score, None
+    dispatcher = start_dispatcher()
+
+    def score_and_dispatch(batch):
+        return dispatcher.dispatch_decisions(scorer.score(batch), SCORING_FIELD)
+
+    return score_and_dispatch, dispatcher
+
+def stamp_stored_at(before_write):
+    """Envolve o gancho de pré-gravação para marcar em STORED_AT_FIELD o instante em que o lote vai ao MongoDB
+    (ou ao spool), depois da pontuação; sem o campo configurado devolve o gancho como está."""
+    if not STORED_AT_FIELD:
+        return before_write
+
+    def stamped(batch):
+        if before_write is not None:
+            batch = before_write(batch)
+        stored_at = datetime.now(timezone.utc)
+        for data in batch:
+            data[STORED_AT_FIELD] = stored_at
+        return batch
+
+    return stamped
+
+def start_invalidation():
+    """Conecta o publicador de avisos de ingestão; sem broker, a API de consulta depende só do TTL do cache."""
+    if not QUERY_INVALIDATION_ENABLED:
+        return None
+    try:
+        return IngestNotifier(connect_client(f"ingest-notifier-{os.getpid()}"), MONGO_COLLECTION)
+    except (OSError, ConnectionError) as e:
+        print(f"Avisos de ingestão desativados: {e}")
+        return None
+
+def write_hooks(notifier):
+    """Ganchos dos buffers de gravação, devolvidos como (após gravar, após falhar, após ir para o spool).
+
+    Os IDs do lote entram no filtro de reentregas e os eventos nos rollups só depois de persistidos, no MongoDB
+    ou no spool; se a gravação falhar os IDs são liberados. A API de consulta é avisada só do que está no MongoDB.
+    """
+    persisted = [observe_batch]
+    if recent_ids is not None:
+        persisted.insert(0, recent_ids.confirm)
+    written = persisted + ([notifier.notify] if notifier is not None else [])
+
+    def chain(steps):
+        def run(batch):
+            for step in steps:
+                step(batch)
+        return run
+
+    return chain(written), (recent_ids.release if recent_ids is not None else None), chain(persisted)
+
+def register_metrics(scorer, dispatcher, notifier):
+    """Expõe no /metrics os contadores que a pontuação, os comandos e os avisos de ingestão já mantêm."""
+    if scorer is not None:
+        registry.counters("scoring_events_total", "Eventos por resultado da pontuação pelo modelo",
+                          lambda: {"scored": scorer.scored, "skipped": scorer.skipped, "failed": scorer.failed}, label="result")
+        registry.value("scoring_reloads_total", "Recargas do modelo de irrigação", lambda: scorer.reloads, "counter")
+    if dispatcher is not None:
+        registry.counters("commands_total", "Comandos para os dispositivos por resultado",
+                          lambda: dict(dispatcher.counters), label="result")
+        registry.value("commands_pending", "Comandos aguardando envio ou confirmação", dispatcher.pending)
+    if recent_ids is not None:
+        registry.value("duplicates_filtered_total", "Reentregas descartadas pelo filtro de IDs recentes",
+                       lambda: recent_ids.duplicates, "counter")
+    if notifier is not None:
+        registry.value("ingest_notices_total", "Avisos de ingestão publicados para a API de consulta",
+                       lambda: notifier.published, "counter")
 
 def main():
-    connect_to_mongodb()
+    global write_buffer, deadletter_buffer, ingest_pipeline, disk_spool
+    connected = connect_to_mongodb(block=not SPOOL_ENABLED)
+
+    def prepare_storage():
+        ensure_collection(mongo_client_instance[MONGO_DATABASE], MONGO_COLLECTION, STORAGE_LAYOUT)
+
+    if connected:
+        prepare_storage()
+    spool_replayer = None
+    if SPOOL_ENABLED:
+        disk_spool = DiskSpool(SPOOL_DIR, SPOOL_SEGMENT_BYTES, SPOOL_MAX_BYTES, SPOOL_FSYNC_BATCH, SPOOL_FSYNC_INTERVAL_MS)
+        if not connected:
+            disk_spool.activate()
+        spool_replayer = SpoolReplayer(disk_spool, db_collection, lambda: mongo_client_instance.admin.command('ping'),
+                                       SPOOL_REPLAY_BATCH, SPOOL_HEALTH_INTERVAL,
+                                       prepare=None if connected else prepare_storage,
+                                       time_field=TIME_FIELD if STORAGE_LAYOUT == LAYOUT_TIMESERIES else None).start()
+    scorer = start_scoring()
+    before_write, dispatcher = start_commands(scorer)
+    before_write = stamp_stored_at(before_write)
+    notifier = start_invalidation()
+    after_write, after_failure, after_spool = write_hooks(notifier)
+    write_buffer = MongoWriteBuffer(db_collection, MONGO_BATCH_SIZE, MONGO_FLUSH_INTERVAL_MS, disk_spool,
+                                    before_write=before_write, after_write=after_write,
+                                    max_pending=MONGO_MAX_PENDING, after_failure=after_failure,
+                                    after_spool=after_spool).start()
+    deadletter_buffer = MongoWriteBuffer(mongo_client_instance[MONGO_DATABASE][MONGO_DEADLETTER_COLLECTION],
+                                         MONGO_BATCH_SIZE, MONGO_FLUSH_INTERVAL_MS, record_timings=False,
+                                         max_pending=MONGO_MAX_PENDING).start()
+    rollup_aggregator = start_rollups(mongo_client_instance[MONGO_DATABASE]) if ROLLUPS_ENABLED else None
+    print(f"Decodificador JSON: {payload_schema.JSON_BACKEND}; validação {'ativa' if VALIDATION_ENABLED else 'desativada'}.")
+    timer.start_reporter(STAGE_TIMINGS_INTERVAL)
+    ingest_pipeline = IngestPipeline(process_payload, PIPELINE_WORKERS, PIPELINE_QUEUE_SIZE,
+                                     PIPELINE_BACKPRESSURE, PIPELINE_SPILL_PATH)
+    registry.counters("pipeline_messages_total", "Mensagens por resultado no pipeline de ingestão",
+                      lambda: {key: value for key, value in ingest_pipeline.stats().items()
+                               if key not in ("queued", "spill_bytes")}, label="result")
+    registry.value("pipeline_queue_depth", "Mensagens aguardando um worker", lambda: ingest_pipeline.stats()["queued"])
+    registry.counters("documents_written_total", "Documentos por resultado da gravação no MongoDB",
+                      lambda: {"inserted": write_buffer.inserted, "failed": write_buffer.failed,
+                               "spooled": write_buffer.spooled, "duplicate": write_buffer.duplicates}, label="result")
+    registry.value("deadletter_written_total", "Payloads rejeitados gravados", lambda: deadletter_buffer.inserted,
+                   "counter")
+    if disk_spool is not None:
+        registry.counters("spool", "Estado do spool local (registros, bytes, segmentos)", disk_spool.snapshot,
+                          kind="gauge")
+    register_metrics(scorer, dispatcher, notifier)
+    start_metrics_server()
+    profiler = start_profiler()
 
-    mqtt_client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, protocol=mqtt.MQTTv5) # Especifica a versão da API de callback
+    manual_ack = PIPELINE_BACKPRESSURE == POLICY_NOACK
+    mqtt_client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, protocol=mqtt.MQTTv5,
+                              manual_ack=manual_ack) # Especifica a versão da API de callback
     mqtt_client.on_connect = on_connect
     mqtt_client.on_message = on_message
     # Adicione a configuração de usuário e senha aqui
     if MQTT_USERNAME and MQTT_PASSWORD:
         mqtt_client.username_pw_set(MQTT_USERNAME, MQTT_PASSWORD)
 
+    if manual_ack:
+        # O PUBACK de cada mensagem sai do buffer que a gravou (ou do worker, se não houver o que gravar)
+        write_buffer.acknowledge = deadletter_buffer.acknowledge = mqtt_client.ack
+    ingest_pipeline.start(ack=mqtt_client.ack if manual_ack else None)
+
+    # Receive Maximum limita as mensagens QoS1 sem ACK (na fila, nos workers e no buffer, até a gravação) à
+    # capacidade da fila: a fila nunca enche com QoS1 e, com o MongoDB lento, o broker para de enviar
+    connect_properties = Properties(PacketTypes.CONNECT)
+    connect_properties.ReceiveMaximum = min(PIPELINE_QUEUE_SIZE, 65535)
+
     retry_delay = 5
     while True:
         try:
             print(f"Tentando conectar ao broker MQTT em {MQTT_BROKER_HOST}:{MQTT_BROKER_PORT}...")
-            mqtt_client.connect(MQTT_BROKER_HOST, MQTT_BROKER_PORT, 60)
+            mqtt_client.connect(MQTT_BROKER_HOST, MQTT_BROKER_PORT, 60, properties=connect_properties)
             break # Sai do loop se conectado com sucesso
         except Exception as e:
             print(f"Falha na conexão MQTT: {e}. Tentando novamente em {retry_delay} segundos...")
@@ -87,9 +384,75 @@ def main():
         print("Desconectando...")
     finally:
         mqtt_client.disconnect()
+        ingest_pipeline.close() # Processa o que já estava na fila antes de descarregar o buffer
+        print(f"Pipeline encerrado: {ingest_pipeline.stats()}")
+        if write_buffer is not None:
+            write_buffer.close() # Descarrega os documentos pendentes antes de fechar o MongoDB
+            print(f"Buffer descarregado: {write_buffer.inserted} inseridos, {write_buffer.spooled} no spool, "
+                  f"{write_buffer.failed} com falha, {write_buffer.duplicates} já gravados.")
+        if recent_ids is not None:
+            print(f"Reentregas descartadas em memória: {recent_ids.duplicates}.")
+        if scorer is not None:
+            print(f"Pontuação: {scorer.stats()}")
+        if dispatcher is not None:
+            dispatcher.drain()
+            dispatcher.close()
+            print(f"Comandos: {dispatcher.stats()}")
+        if notifier is not None:
+            notifier.close()
+        if rollup_aggregator is not None:
+            rollup_aggregator.close()
+            print(f"Rollups: {rollup_aggregator.flushed_windows} janela(s) gravada(s).")
+        if deadletter_buffer is not None:
+            deadletter_buffer.close()
+            print(f"Payloads rejeitados gravados em '{MONGO_DEADLETTER_COLLECTION}': {deadletter_buffer.inserted}")
+        print(f"Tempos por estágio: {timer.report()}")
+        if profiler is not None:
+            print(f"Perfil salvo em '{profiler.stop().save()}'.")
+        if spool_replayer is not None:
+            spool_replayer.close()
+            disk_spool.close() # O que não foi reproduzido fica em disco para a próxima execução
+            print(f"Spool: {disk_spool.snapshot()}")
         if mongo_client_instance:
             mongo_client_instance.close()
         print("Limpeza concluída.")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    if CONSUMER_MODE == "multiprocess":
+        import supervisor
+        supervisor.main()
+    elif CONSUMER_MODE == "async":
+        import asyncio
+        import async_consumer
+        # Os rollups usam o driver síncrono em sua própria thread de gravação
+        rollup_client = pymongo.MongoClient(MONGO_URI, serverSelectionTimeoutMS=5000) if ROLLUPS_ENABLED else None
+        rollup_aggregator = start_rollups(rollup_client[MONGO_DATABASE]) if ROLLUPS_ENABLED else None
+        scorer = start_scoring()
+        before_write, dispatcher = start_commands(scorer)
+        before_write = stamp_stored_at(before_write)
+        notifier = start_invalidation()
+        register_metrics(scorer, dispatcher, notifier)
+        start_metrics_server()
+        profiler = start_profiler()
+        try:
+            asyncio.run(async_consumer.main(decode_event, before_write, *write_hooks(notifier)))
+        except KeyboardInterrupt:
+            print("Consumidor assíncrono encerrado.")
+        finally:
+            if recent_ids is not None:
+                print(f"Reentregas descartadas em memória: {recent_ids.duplicates}.")
+            if scorer is not None:
+                print(f"Pontuação: {scorer.stats()}")
+            if dispatcher is not None:
+                dispatcher.drain()
+                dispatcher.close()
+                print(f"Comandos: {dispatcher.stats()}")
+            if notifier is not None:
+                notifier.close()
+            if rollup_aggregator is not None:
+                rollup_aggregator.close()
+                rollup_client.close()
+            if profiler is not None:
+                print(f"Perfil salvo em '{profiler.stop().save()}'.")
+    else:
+        main()
\ No newline at end of file
@@ -5,6 +5,10 @@ import os
 import time
 import certifi
 
+from logs import get_logger
+
+log = get_logger("consumer_IoT")
+
 # Configure o Python para usar os certificados CA do certifi
 os.environ["SSL_CERT_FILE"] = certifi.where()
 
@@ -47,7 +51,7 @@ def on_connect(client, userdata, flags, rc, properties=None):
 
 def on_message(client, userdata, msg):
     payload = msg.payload.decode()
-    print(f"Mensagem C2D recebida do tópico '{msg.topic}': {payload}")
+    log.debug("Mensagem C2D recebida do tópico '%s': %s", msg.topic, payload)
     try:
         data = json.loads(payload)
         # Faça algo com a mensagem C2D, por exemplo, acionar uma ação no dispositivo
@@ -57,11 +61,11 @@ def on_message(client, userdata, msg):
         #     print(f"Dados C2D inseridos no MongoDB: {data}")
         # else:
         #     print("Coleção MongoDB não está disponível. Mensagem C2D não armazenada.")
-        print(f"Dados C2D processados: {data}")
+        log.info("Dados C2D processados: %s", data)
     except json.JSONDecodeError:
-        print(f"Erro ao decodificar JSON da mensagem C2D: {payload}")
+        log.error("Erro ao decodificar JSON da mensagem C2D: %s", payload)
     except Exception as e:
-        print(f"Erro ao processar mensagem C2D: {e}")
+        log.error("Erro ao processar mensagem C2D: %s", e)
 
 
 def consume_c2d_from_iot_hub():
@@ -0,0 +1,104 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+from bson import ObjectId
+
+from storage_layout import event_source
+
+DUPLICATE_KEY = 11000 # Código de erro do MongoDB para chave única repetida
+
+# Campos com o número de sequência do produtor (producer_IoT.py: messageId; loadgen.py: seq)
+SEQUENCE_FIELDS = ("messageId", "seq")
+# Campos que identificam a origem, na ordem de preferência
+SOURCE_FIELDS = ("deviceId", "city", "topic")
+
+
+def event_id(doc):
+    """ID determinístico do evento: origem + execução + instante + sequência.
+
+    Só os payloads com número de sequência recebem um ID; os demais (ex.: o firmware, que
+    publica em QoS 0 com um timestamp fixo) continuam com o ObjectId gerado pelo driver,
+    porque leituras diferentes com os mesmos valores seriam confundidas com reentregas.
+    O resultado é um ObjectId (12 bytes do hash), do mesmo tipo e tamanho dos demais `_id`.
+    """
+    sequence = None
+    for field in SEQUENCE_FIELDS:
+        sequence = doc.get(field)
+        if sequence is not None:
+            break
+    if sequence is None:
+        return None
+    source = None
+    for field in SOURCE_FIELDS:
+        source = event_source(doc, field)
+        if source is not None:
+            break
+    key = f"{source}\x1f{doc.get('run_id', '')}\x1f{doc.get('timestamp', '')}\x1f{sequence}"
+    return ObjectId(hashlib.blake2b(key.encode(), digest_size=12).digest())
+
+
+class RecentIds:
+    """Filtro dos IDs de evento vistos recentemente, limitado a `capacity` IDs gravados (LRU).
+
+    Descarta as reentregas do QoS 1 (reconexões, reinício do broker) antes dos rollups, da
+    pontuação e da gravação. Um ID aceito fica pendente até o lote ser gravado (`confirm`) e é
+    liberado se a gravação falhar (`release`), para que a reentrega do broker seja aceita de novo.
+    Reentregas mais antigas que a janela do filtro, ou recebidas por outro processo do modo
+    multiprocesso, esbarram no índice único de `_id` do MongoDB.
+    """
+
+    def __init__(self, capacity=200000):
+        self.capacity = max(1, capacity)
+        self._ids = OrderedDict()     # IDs de eventos já gravados
+        self._pending = OrderedDict() # IDs aceitos cujo lote ainda não foi gravado
+        self._lock = threading.Lock()
+        self.duplicates = 0
+
+    def seen(self, key):
+        """Devolve True se o ID já foi gravado ou está num lote a caminho; senão o marca como pendente."""
+        with self._lock:
+            if key in self._ids:
+                self._ids.move_to_end(key)
+                self.duplicates += 1
+                return True
+            if key in self._pending:
+                self.duplicates += 1
+                return True
+            self._pending[key] = None
+            if len(self._pending) > self.capacity:
+                self._pending.popitem(last=False) # Ex.: lotes desviados ao spool, que não passam por confirm
+            return False
+
+    def confirm(self, batch):
+        """Registra como gravados os IDs pendentes de um lote (after_write)."""
+        with self._lock:
+            for doc in batch:
+                key = doc.get("_id")
+                if key in self._pending:
+                    del self._pending[key]
+                    self._ids[key] = None
+            while len(self._ids) > self.capacity:
+                self._ids.popitem(last=False)
+
+    def release(self, batch):
+        """Esquece os IDs pendentes de um lote que não foi gravado: a reentrega da mensagem passa pelo filtro."""
+        with self._lock:
+            for doc in batch:
+                self._pending.pop(doc.get("_id"), None)
+
+    def __len__(self):
+        return len(self._ids)
+
+
+def count_write_errors(details):
+    """Separa os erros de um BulkWriteError em (duplicados, outros)."""
+    errors = details.get("writeErrors", [])
+    duplicates = sum(1 for error in errors if error.get("code") == DUPLICATE_KEY)
+    return duplicates, len(errors) - duplicates
+
+
+def inserted_documents(batch, details):
+    """Documentos de um insert_many não ordenado que não aparecem nos erros do BulkWriteError."""
+    failed = {error.get("index") for error in details.get("writeErrors", [])}
+    return [doc for index, doc in enumerate(batch) if index not in failed]
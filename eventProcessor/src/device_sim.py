@@ -0,0 +1,166 @@
+import heapq
+import json
+import os
+import random
+import threading
+import time
+
+from commands import COMMAND_ACK_TOPIC_TEMPLATE, COMMAND_TOPIC_TEMPLATE, connect_client, resubscribe_on_reconnect
+
+DEVICE_SIM_DEVICES = int(os.getenv("DEVICE_SIM_DEVICES", 1000))       # Dispositivos simulados
+DEVICE_SIM_CONNECTIONS = int(os.getenv("DEVICE_SIM_CONNECTIONS", 4))  # Conexões MQTT, cada uma com uma fatia dos dispositivos
+DEVICE_SIM_ACK_DELAY_MS = float(os.getenv("DEVICE_SIM_ACK_DELAY_MS", 0)) # Tempo de acionamento do relé antes da confirmação
+DEVICE_SIM_DROP_RATE = float(os.getenv("DEVICE_SIM_DROP_RATE", 0))   # Fração de comandos sem confirmação (força reenvios)
+DEVICE_SIM_SUBSCRIBE_CHUNK = 500 # Tópicos por pacote SUBSCRIBE
+
+
+class SimulatedDevices:
+    """Uma conexão MQTT que faz o papel do firmware para uma fatia dos dispositivos.
+
+    Cada dispositivo assina o seu próprio tópico de comando, aplica o estado da bomba e
+    confirma no tópico de ack com o `id` recebido. Comandos com `id` menor que o último
+    aplicado chegaram fora de ordem e são contados, mas não alteram o estado.
+    """
+
+    def __init__(self, index, devices, ack_delay=0.0, drop_rate=0.0, seed=None):
+        self.index = index
+        self.devices = devices
+        self.ack_delay = ack_delay
+        self.drop_rate = drop_rate
+        self.random = random.Random(seed)
+        self.state = {device: "off" for device in devices}
+        self.last_id = {}
+        self.received = 0
+        self.acked = 0
+        self.dropped = 0
+        self.out_of_order = 0
+        self.client = None
+        self._pending = [] # heap (instante da confirmação, id, dispositivo, estado)
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self._acker = threading.Thread(target=self._run_acks, name=f"device-sim-{index}", daemon=True)
+        self._device_by_topic = {COMMAND_TOPIC_TEMPLATE.format(device=device): device for device in devices}
+
+    def connect(self, run_id, timeout=30):
+        self.client = connect_client(f"device-sim-{run_id}-{self.index}")
+        self.client.on_message = self._on_message
+        pending = set()
+        subscribed = threading.Condition()
+
+        def on_subscribe(client, userdata, mid, reason_codes, properties=None):
+            with subscribed:
+                pending.discard(mid)
+                subscribed.notify()
+
+        self.client.on_subscribe = on_subscribe
+        topics = list(self._device_by_topic)
+        chunks = [[(topic, 1) for topic in topics[start:start + DEVICE_SIM_SUBSCRIBE_CHUNK]]
+                  for start in range(0, len(topics), DEVICE_SIM_SUBSCRIBE_CHUNK)]
+        with subscribed:
+            for chunk in chunks:
+                _, mid = self.client.subscribe(chunk)
+                pending.add(mid)
+            # Só devolve com todas as assinaturas confirmadas: comandos anteriores ao SUBACK se perderiam
+            if not subscribed.wait_for(lambda: not pending, timeout):
+                raise TimeoutError(f"conexão {self.index}: {len(pending)} SUBSCRIBE(s) sem SUBACK após {timeout}s")
+        resubscribe_on_reconnect(self.client, *chunks)
+        self._acker.start()
+
+    def _on_message(self, client, userdata, msg):
+        device = self._device_by_topic.get(msg.topic)
+        if device is None:
+            return
+        try:
+            command = json.loads(msg.payload)
+            command_id, state = int(command["id"]), command["state"]
+        except (ValueError, KeyError, TypeError):
+            print(f"Comando inválido para '{device}': {msg.payload[:100]!r}")
+            return
+        self.received += 1
+        if command_id < self.last_id.get(device, 0):
+            self.out_of_order += 1
+        else:
+            self.last_id[device] = command_id
+            self.state[device] = state # digitalWrite(RELAY_PIN, ...) no firmware
+        if self.drop_rate and self.random.random() < self.drop_rate:
+            self.dropped += 1
+            return
+        if self.ack_delay <= 0:
+            self._ack(command_id, device, state)
+            return
+        with self._cond:
+            heapq.heappush(self._pending, (time.monotonic() + self.ack_delay, command_id, device, state))
+            self._cond.notify()
+
+    def _ack(self, command_id, device, state):
+        self.client.publish(COMMAND_ACK_TOPIC_TEMPLATE.format(device=device),
+                            json.dumps({"id": command_id, "state": state}), qos=1)
+        self.acked += 1
+
+    def _run_acks(self):
+        while not self._stop.is_set():
+            with self._cond:
+                now = time.monotonic()
+                due = []
+                while self._pending and self._pending[0][0] <= now:
+                    due.append(heapq.heappop(self._pending))
+                if not due:
+                    self._cond.wait(self._pending[0][0] - now if self._pending else 0.5)
+                    continue
+            for _, command_id, device, state in due:
+                self._ack(command_id, device, state)
+
+    def close(self):
+        self._stop.set()
+        with self._cond:
+            self._cond.notify()
+        self._acker.join()
+        self.client.disconnect()
+        self.client.loop_stop()
+
+
+def device_names(count):
+    return [f"loadgen-{i:05d}" for i in range(count)] # Mesmos nomes do loadgen.py
+
+
+def start(devices=DEVICE_SIM_DEVICES, connections=DEVICE_SIM_CONNECTIONS, ack_delay_ms=DEVICE_SIM_ACK_DELAY_MS,
+          drop_rate=DEVICE_SIM_DROP_RATE, run_id="sim", seed=None):
+    """Conecta os dispositivos simulados e devolve as conexões (feche com `close` em cada uma)."""
+    names = device_names(devices)
+    connections = max(1, min(connections, devices))
+    pool = [SimulatedDevices(i, names[i::connections], ack_delay_ms / 1000, drop_rate,
+                             None if seed is None else seed + i) for i in range(connections)]
+    for connection in pool:
+        connection.connect(run_id)
+    print(f"{devices} dispositivo(s) simulado(s) em {connections} conexão(ões), confirmação após "
+          f"{ack_delay_ms:.0f} ms, {drop_rate:.0%} sem confirmação")
+    return pool
+
+
+def device_states(pool):
+    states = {}
+    for connection in pool:
+        states.update(connection.state)
+    return states
+
+
+def summarize(pool):
+    return {
+        "received": sum(connection.received for connection in pool),
+        "acked": sum(connection.acked for connection in pool),
+        "dropped": sum(connection.dropped for connection in pool),
+        "out_of_order": sum(connection.out_of_order for connection in pool),
+    }
+
+
+if __name__ == "__main__":
+    pool = start()
+    try:
+        while True:
+            time.sleep(10)
+            print(f"Dispositivos simulados: {summarize(pool)}")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for connection in pool:
+            connection.close()
@@ -0,0 +1,293 @@
+import asyncio
+import base64
+import hashlib
+import hmac
+import json
+import os
+import random
+import ssl
+import time
+import urllib.parse
+import uuid
+
+import aiomqtt
+
+import telemetry_codec
+from commands import percentile
+from logs import get_logger
+
+try:
+    import resource # Só em sistemas Unix
+except ImportError:
+    resource = None
+
+log = get_logger("fleet_sim")
+
+IOT_HUB_NAME = os.getenv("IOT_HUB_NAME", "tsx-brs-iot001") # Mesmo padrão do producer_IoT.py
+IOT_HUB_HOST = f"{IOT_HUB_NAME}.azure-devices.net"
+IOT_HUB_API_VERSION = "2021-04-12"
+
+FLEET_TARGET = os.getenv("FLEET_TARGET", "local")     # local: broker que imita o IoT Hub; azure: IOT_HUB_HOST com TLS
+FLEET_HOST = os.getenv("FLEET_HOST", "localhost")     # Broker do alvo local
+FLEET_PORT = int(os.getenv("FLEET_PORT", 1885))       # Perfil iothub do event-resource/docker-compose.yml
+FLEET_GROUP_KEY = os.getenv("FLEET_GROUP_KEY", "")    # Chave (base64) do grupo de registro; vazia gera uma aleatória
+FLEET_DEVICES = int(os.getenv("FLEET_DEVICES", 1000))                 # Dispositivos virtuais, uma conexão cada
+FLEET_DEVICE_PREFIX = os.getenv("FLEET_DEVICE_PREFIX", "fleet-")
+FLEET_RATE = float(os.getenv("FLEET_RATE", 5000))                     # Msg/s somando a frota (0 = sem limite)
+FLEET_DURATION = float(os.getenv("FLEET_DURATION", 30))               # Segundos de envio
+FLEET_QOS = int(os.getenv("FLEET_QOS", 1))                            # 0 ou 1 (o IoT Hub não aceita QoS 2)
+FLEET_INFLIGHT = int(os.getenv("FLEET_INFLIGHT", 8))                  # Publicações QoS1 sem PUBACK por dispositivo
+FLEET_CONNECT_RATE = float(os.getenv("FLEET_CONNECT_RATE", 200))      # Conexões novas por segundo
+FLEET_TOKEN_TTL = int(os.getenv("FLEET_TOKEN_TTL", 3600))             # Validade do token SAS em segundos
+FLEET_REPORT_INTERVAL = float(os.getenv("FLEET_REPORT_INTERVAL", 5))  # Segundos entre relatórios (0 desativa)
+PAYLOAD_FORMAT = os.getenv("PAYLOAD_FORMAT", "json") # json ou binary (telemetry_codec), como no producer_IoT.py
+
+TOKEN_RENEW_FRACTION = 0.8 # Reconecta com um token novo depois de 80% da validade do anterior
+MAX_RECONNECT_DELAY = 30
+
+
+def derive_device_key(group_key, device_id):
+    """Chave simétrica do dispositivo derivada da chave do grupo, como no registro em grupo do DPS."""
+    digest = hmac.new(base64.b64decode(group_key), device_id.encode(), hashlib.sha256).digest()
+    return base64.b64encode(digest).decode()
+
+
+def generate_sas_token(resource_uri, key, ttl, policy_name=None):
+    """Token SAS do IoT Hub para `resource_uri` (ex.: <hub>/devices/<id>); devolve (token, expiração em epoch)."""
+    expiry = int(time.time() + ttl)
+    encoded_uri = urllib.parse.quote_plus(resource_uri)
+    signature = hmac.new(base64.b64decode(key), f"{encoded_uri}\n{expiry}".encode(), hashlib.sha256).digest()
+    token = (f"SharedAccessSignature sr={encoded_uri}"
+             f"&sig={urllib.parse.quote_plus(base64.b64encode(signature))}&se={expiry}")
+    if policy_name:
+        token += f"&skn={policy_name}"
+    return token, expiry
+
+
+def d2c_topic(device_id):
+    """Tópico de telemetria do IoT Hub, com o content type no formato binário (igual ao producer_IoT.py)."""
+    topic = f"devices/{device_id}/messages/events/"
+    if PAYLOAD_FORMAT == "binary":
+        topic += urllib.parse.urlencode({"$.ct": telemetry_codec.CONTENT_TYPE})
+    return topic
+
+
+def raise_open_files_limit():
+    """Sobe o limite de descritores abertos até o máximo permitido: cada dispositivo usa um socket."""
+    if resource is None:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard == resource.RLIM_INFINITY or soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+class Fleet:
+    """Estado compartilhado da frota: alvo, contadores, latências de PUBACK e ritmo das conexões.
+
+    Todos os dispositivos rodam no mesmo event loop, então os contadores não precisam de lock.
+    """
+
+    def __init__(self, devices, rate, qos, run_id, group_key):
+        self.run_id = run_id
+        self.qos = qos
+        self.interval = devices / rate if rate > 0 else 0.0 # Intervalo entre envios de cada dispositivo
+        self.group_key = group_key
+        if FLEET_TARGET == "azure":
+            import certifi # Só o alvo azure usa TLS
+            self.host, self.port = IOT_HUB_HOST, 8883
+            self.tls_context = ssl.create_default_context(cafile=certifi.where())
+        else:
+            self.host, self.port = FLEET_HOST, FLEET_PORT
+            self.tls_context = None
+        self.devices = [VirtualDevice(self, f"{FLEET_DEVICE_PREFIX}{i:05d}") for i in range(devices)]
+        self.sent = 0
+        self.failed = 0
+        self.connected = 0
+        self.connections = 0
+        self.renewals = 0
+        self.connection_errors = 0
+        self.max_lag = 0.0
+        self.latencies = []
+        self._next_connect = 0.0
+
+    async def connect_slot(self):
+        """Espaça as conexões em FLEET_CONNECT_RATE por segundo (o IoT Hub limita conexões novas por unidade)."""
+        if FLEET_CONNECT_RATE <= 0:
+            return
+        loop = asyncio.get_running_loop()
+        slot = max(loop.time(), self._next_connect)
+        self._next_connect = slot + 1.0 / FLEET_CONNECT_RATE
+        await asyncio.sleep(slot - loop.time())
+
+    def stats(self):
+        return {"sent": self.sent, "failed": self.failed, "connected": self.connected,
+                "connections": self.connections, "renewals": self.renewals, "connection_errors": self.connection_errors}
+
+
+class VirtualDevice:
+    """Um dispositivo da frota: uma conexão MQTT própria, autenticada como no IoT Hub.
+
+    Client id é o deviceId, o usuário é `<hub>/<deviceId>/?api-version=...` e a senha é um token
+    SAS assinado com a chave do dispositivo. A conexão é mantida durante todo o envio e só é
+    refeita para trocar o token antes de vencer ou depois de uma queda. As publicações QoS1 são
+    enviadas em sequência sem esperar o PUBACK da anterior, até FLEET_INFLIGHT pendentes.
+    """
+
+    def __init__(self, fleet, device_id):
+        self.fleet = fleet
+        self.device_id = device_id
+        self.key = derive_device_key(fleet.group_key, device_id)
+        self.topic = d2c_topic(device_id)
+        self.username = f"{IOT_HUB_HOST}/{device_id}/?api-version={IOT_HUB_API_VERSION}"
+        # Começa nos segundos desde a época (cabe no uint32 do formato binário), como no producer_IoT.py
+        self.sequence = int(time.time())
+        self._window = asyncio.Semaphore(max(1, FLEET_INFLIGHT))
+        self._pending = set()
+        self._error = None # Falha de publicação: a conexão caiu ou parou de responder
+
+    def payload(self):
+        self.sequence += 1
+        reading = {
+            "deviceId": self.device_id,
+            "messageId": self.sequence,
+            "temperature": round(random.uniform(15, 35), 1),
+            "humidity": round(random.uniform(30, 90), 1),
+        }
+        if PAYLOAD_FORMAT == "binary":
+            return telemetry_codec.encode_iot_hub(reading)
+        # Campos extras para medir latência ponta a ponta e perdas no MongoDB (como no loadgen.py)
+        reading.update(run_id=self.fleet.run_id, sent_at=time.time())
+        return json.dumps(reading)
+
+    async def _publish(self, client, payload):
+        started = time.perf_counter()
+        try:
+            await client.publish(self.topic, payload, qos=self.fleet.qos)
+        except aiomqtt.MqttError as e:
+            self.fleet.failed += 1
+            self._error = e
+        else:
+            self.fleet.sent += 1
+            if self.fleet.qos > 0:
+                self.fleet.latencies.append(time.perf_counter() - started)
+        finally:
+            self._window.release()
+
+    async def _send_until(self, client, next_send, until):
+        """Publica no ritmo da agenda até `until`; devolve o instante do próximo envio."""
+        loop = asyncio.get_running_loop()
+        interval = self.fleet.interval
+        while True:
+            if self._error is not None:
+                error, self._error = self._error, None
+                raise error
+            now = loop.time()
+            if not interval:
+                next_send = now
+            if next_send >= until:
+                return next_send
+            if next_send > now:
+                await asyncio.sleep(next_send - now)
+            elif now - next_send > self.fleet.max_lag:
+                self.fleet.max_lag = now - next_send
+            await self._window.acquire() # Com FLEET_INFLIGHT publicações pendentes, espera um PUBACK
+            task = loop.create_task(self._publish(client, self.payload()))
+            self._pending.add(task)
+            task.add_done_callback(self._pending.discard)
+            next_send += interval
+
+    async def run(self, deadline):
+        loop = asyncio.get_running_loop()
+        next_send = None
+        delay = 1
+        while next_send is None or next_send < deadline:
+            await self.fleet.connect_slot()
+            if loop.time() >= deadline:
+                return
+            token, expiry = generate_sas_token(f"{IOT_HUB_HOST}/devices/{self.device_id}", self.key, FLEET_TOKEN_TTL)
+            renew_at = loop.time() + (expiry - time.time()) * TOKEN_RENEW_FRACTION
+            try:
+                # IoT Hub fala MQTT 3.1.1; a mesma conexão serve a todos os envios até a renovação do token
+                async with aiomqtt.Client(self.fleet.host, self.fleet.port, identifier=self.device_id,
+                                          username=self.username, password=token,
+                                          protocol=aiomqtt.ProtocolVersion.V311, clean_session=True,
+                                          tls_context=self.fleet.tls_context,
+                                          max_inflight_messages=max(1, FLEET_INFLIGHT)) as client:
+                    self.fleet.connections += 1
+                    self.fleet.connected += 1
+                    self._error = None # Falhas das publicações pendentes na conexão anterior
+                    delay = 1
+                    if next_send is None:
+                        # Fase aleatória: os dispositivos não publicam todos no mesmo instante
+                        next_send = loop.time() + random.uniform(0, self.fleet.interval)
+                    else:
+                        next_send = max(next_send, loop.time()) # Desconectado, o dispositivo não acumula envios
+                    try:
+                        next_send = await self._send_until(client, next_send, min(deadline, renew_at))
+                    finally:
+                        if self._pending:
+                            await asyncio.wait(set(self._pending)) # PUBACKs pendentes antes de desconectar
+                        self.fleet.connected -= 1
+                if next_send < deadline:
+                    self.fleet.renewals += 1
+            except aiomqtt.MqttError as e:
+                self.fleet.connection_errors += 1
+                log.warning("%s: erro de conexão (%s); nova tentativa em %ds", self.device_id, e, delay)
+                # Com jitter: a frota não reconecta em rajada
+                await asyncio.sleep(min(delay * random.uniform(0.5, 1.5), max(0.0, deadline - loop.time())))
+                delay = min(delay * 2, MAX_RECONNECT_DELAY)
+
+
+async def report_periodically(fleet, interval):
+    previous, previous_at = 0, time.perf_counter()
+    while True:
+        await asyncio.sleep(interval)
+        now = time.perf_counter()
+        rate = (fleet.sent - previous) / (now - previous_at)
+        previous, previous_at = fleet.sent, now
+        print(f"Frota: {fleet.connected} conectado(s), {fleet.sent} enviada(s) ({rate:,.0f} msg/s), "
+              f"{fleet.failed} falha(s), {fleet.connection_errors} erro(s) de conexão")
+
+
+async def run(devices=FLEET_DEVICES, rate=FLEET_RATE, duration=FLEET_DURATION, qos=FLEET_QOS, run_id=None):
+    """Conecta a frota, publica durante `duration` segundos e devolve o resumo do envio."""
+    run_id = run_id or uuid.uuid4().hex[:12]
+    group_key = FLEET_GROUP_KEY or base64.b64encode(os.urandom(32)).decode() # O broker local não confere a assinatura
+    raise_open_files_limit()
+    fleet = Fleet(devices, rate, qos, run_id, group_key)
+    print(f"Frota '{run_id}': {devices} dispositivo(s), {rate:,.0f} msg/s, QoS {qos}, {duration:.0f}s em "
+          f"{fleet.host}:{fleet.port} ({FLEET_TARGET}), até {FLEET_INFLIGHT} envio(s) pendente(s) por dispositivo")
+
+    loop = asyncio.get_running_loop()
+    started = time.perf_counter()
+    deadline = loop.time() + duration
+    reporter = None
+    if FLEET_REPORT_INTERVAL > 0:
+        reporter = asyncio.create_task(report_periodically(fleet, FLEET_REPORT_INTERVAL))
+    try:
+        await asyncio.gather(*(device.run(deadline) for device in fleet.devices))
+    finally:
+        if reporter is not None:
+            reporter.cancel()
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(fleet.latencies)
+    summary = dict(fleet.stats(), run_id=run_id, qos=qos, elapsed=elapsed,
+                   rate=fleet.sent / elapsed if elapsed > 0 else 0.0, max_lag=fleet.max_lag,
+                   puback_ms={name: percentile(latencies, fraction) * 1000
+                              for name, fraction in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99))})
+    print(f"Enviadas {fleet.sent} mensagem(ns) em {elapsed:.1f}s ({summary['rate']:,.0f} msg/s), "
+          f"{fleet.failed} falha(s), {fleet.connections} conexão(ões), {fleet.renewals} renovação(ões) de token, "
+          f"{fleet.connection_errors} erro(s) de conexão, "
+          f"atraso máximo em relação à agenda {fleet.max_lag * 1000:.0f} ms")
+    if latencies:
+        print("Latência até o PUBACK: " + ", ".join(f"{name}={value:.1f} ms"
+                                                   for name, value in summary["puback_ms"].items()))
+    return summary
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        print("Envio interrompido.")
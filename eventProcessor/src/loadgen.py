@@ -0,0 +1,145 @@
+import json
+import os
+import threading
+import time
+import uuid
+
+import paho.mqtt.client as mqtt
+
+from producer import generate_random_weather_data
+
+MQTT_BROKER_HOST = os.getenv("MQTT_BROKER_HOST", "localhost")
+MQTT_BROKER_PORT = int(os.getenv("MQTT_BROKER_PORT", 1883))
+MQTT_TOPIC = os.getenv("MQTT_TOPIC", "sensor/data") # Mesmo tópico padrão do consumer.py
+MQTT_USERNAME = os.getenv("MQTT_USERNAME", "user")
+MQTT_PASSWORD = os.getenv("MQTT_PASSWORD", "password")
+
+LOADGEN_DEVICES = int(os.getenv("LOADGEN_DEVICES", 100))         # Dispositivos virtuais
+LOADGEN_RATE = float(os.getenv("LOADGEN_RATE", 1000))            # Mensagens por segundo, somando todos os dispositivos
+LOADGEN_CONNECTIONS = int(os.getenv("LOADGEN_CONNECTIONS", 4))   # Conexões MQTT (uma thread de publicação cada)
+LOADGEN_DURATION = float(os.getenv("LOADGEN_DURATION", 30))      # Segundos de carga sustentada
+LOADGEN_QOS = int(os.getenv("LOADGEN_QOS", 0))                   # 0 ou 1
+LOADGEN_MAX_INFLIGHT = int(os.getenv("LOADGEN_MAX_INFLIGHT", 1000)) # Mensagens QoS1 sem PUBACK por conexão
+
+
+class LoadConnection:
+    """Uma conexão MQTT que publica, no ritmo pedido, as leituras de uma fatia dos dispositivos virtuais.
+
+    As publicações seguem um relógio de agenda (não um sleep fixo entre mensagens), então o
+    ritmo alvo se mantém mesmo quando uma publicação atrasa; o atraso acumulado é reportado.
+    """
+
+    def __init__(self, index, devices, rate, run_id, qos):
+        self.index = index
+        self.devices = devices
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self.run_id = run_id
+        self.qos = qos
+        self.sequences = {device: 0 for device in devices}
+        self.published = 0
+        self.acknowledged = 0
+        self.failed = 0
+        self.max_lag = 0.0
+        self.client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=f"loadgen-{run_id}-{index}",
+                                  protocol=mqtt.MQTTv5)
+        if MQTT_USERNAME and MQTT_PASSWORD:
+            self.client.username_pw_set(MQTT_USERNAME, MQTT_PASSWORD)
+        self.client.max_inflight_messages_set(LOADGEN_MAX_INFLIGHT)
+        self.client.on_publish = self._on_publish
+        self._connected = threading.Event()
+        self.client.on_connect = self._on_connect
+
+    def _on_connect(self, client, userdata, flags, rc, properties=None):
+        if rc == 0:
+            self._connected.set()
+        else:
+            print(f"Conexão {self.index}: falha ao conectar, código de retorno: {rc}")
+
+    def _on_publish(self, client, userdata, mid, reason_code, properties):
+        self.acknowledged += 1 # Chamado na thread de rede da conexão
+
+    def connect(self, timeout=10):
+        self.client.connect(MQTT_BROKER_HOST, MQTT_BROKER_PORT, 60)
+        self.client.loop_start()
+        if not self._connected.wait(timeout):
+            raise ConnectionError(f"conexão {self.index} sem CONNACK após {timeout}s")
+
+    def payload(self, device):
+        reading = generate_random_weather_data()
+        seq = self.sequences[device]
+        self.sequences[device] = seq + 1
+        # Campos extras para medir latência ponta a ponta e perdas no MongoDB
+        reading.update(deviceId=device, seq=seq, run_id=self.run_id, sent_at=time.time())
+        return json.dumps(reading)
+
+    def run(self, deadline):
+        started = time.perf_counter()
+        next_send = started
+        count = 0
+        while next_send < deadline:
+            now = time.perf_counter()
+            if next_send > now:
+                time.sleep(next_send - now)
+            else:
+                self.max_lag = max(self.max_lag, now - next_send)
+            device = self.devices[count % len(self.devices)]
+            result = self.client.publish(MQTT_TOPIC, self.payload(device), qos=self.qos)
+            if result.rc == mqtt.MQTT_ERR_SUCCESS:
+                self.published += 1
+            else:
+                self.failed += 1
+            count += 1
+            next_send = started + count * self.interval
+
+    def close(self, timeout=10):
+        # Aguarda os PUBACKs pendentes antes de desconectar
+        deadline = time.monotonic() + timeout
+        while self.qos > 0 and self.acknowledged < self.published and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.client.disconnect()
+        self.client.loop_stop()
+
+
+def run(devices=LOADGEN_DEVICES, rate=LOADGEN_RATE, connections=LOADGEN_CONNECTIONS, duration=LOADGEN_DURATION,
+        qos=LOADGEN_QOS, run_id=None):
+    """Publica carga sustentada e devolve o resumo do envio (com o run_id gravado em cada mensagem)."""
+    run_id = run_id or uuid.uuid4().hex[:12]
+    connections = max(1, min(connections, devices))
+    names = [f"loadgen-{i:05d}" for i in range(devices)]
+    pool = [LoadConnection(i, names[i::connections], rate / connections, run_id, qos) for i in range(connections)]
+    for connection in pool:
+        connection.connect()
+    print(f"Carga '{run_id}': {devices} dispositivo(s), {rate:,.0f} msg/s, {connections} conexão(ões), "
+          f"QoS {qos}, {duration:.0f}s em '{MQTT_TOPIC}' ({MQTT_BROKER_HOST}:{MQTT_BROKER_PORT})")
+
+    started = time.perf_counter()
+    deadline = started + duration
+    threads = [threading.Thread(target=connection.run, args=(deadline,), name=f"loadgen-{connection.index}")
+               for connection in pool]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    for connection in pool:
+        connection.close()
+
+    published = sum(connection.published for connection in pool)
+    summary = {
+        "run_id": run_id,
+        "qos": qos,
+        "published": published,
+        "acknowledged": sum(connection.acknowledged for connection in pool) if qos > 0 else None,
+        "failed": sum(connection.failed for connection in pool),
+        "elapsed": elapsed,
+        "rate": published / elapsed if elapsed > 0 else 0.0,
+        "max_lag": max(connection.max_lag for connection in pool),
+    }
+    acked = f", {summary['acknowledged']} PUBACK(s)" if qos > 0 else ""
+    print(f"Publicadas {published} mensagem(ns) em {elapsed:.1f}s ({summary['rate']:,.0f} msg/s){acked}, "
+          f"{summary['failed']} falha(s), atraso máximo em relação à agenda {summary['max_lag'] * 1000:.0f} ms")
+    return summary
+
+
+if __name__ == "__main__":
+    run()
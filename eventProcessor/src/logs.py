@@ -0,0 +1,99 @@
+import logging
+import os
+import threading
+import time
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper() # DEBUG mostra cada mensagem recebida/publicada
+LOG_RATE = float(os.getenv("LOG_RATE", 5))   # Registros por segundo permitidos para cada mensagem (modelo + nível)
+LOG_BURST = int(os.getenv("LOG_BURST", 20))  # Registros seguidos antes do limite
+LOG_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+LOG_SUMMARY_INTERVAL = float(os.getenv("LOG_SUMMARY_INTERVAL", 60)) # Segundos entre os resumos em INFO dos produtores
+
+
+class RateLimitFilter(logging.Filter):
+    """Limita cada mensagem de log (mesmo logger, nível e modelo) a `rate` registros por segundo.
+
+    A chave é o modelo da mensagem (`record.msg`, antes da formatação com os argumentos), então
+    um erro repetido a cada evento vira poucas linhas por segundo em vez de uma por evento. O
+    próximo registro aceito informa quantos foram suprimidos desde o anterior.
+    """
+
+    def __init__(self, rate=LOG_RATE, burst=LOG_BURST):
+        super().__init__()
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._buckets = {} # chave -> [fichas, último instante, suprimidos]
+        self._lock = threading.Lock()
+        self.suppressed = 0
+
+    def filter(self, record):
+        if self.rate <= 0:
+            return True
+        key = (record.name, record.levelno, record.msg)
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [float(self.burst), now, 0]
+            else:
+                bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+            if bucket[0] < 1.0:
+                bucket[2] += 1
+                self.suppressed += 1
+                return False
+            bucket[0] -= 1.0
+            skipped, bucket[2] = bucket[2], 0
+        if skipped:
+            record.msg = f"{record.msg} [+{skipped} suprimida(s)]"
+        return True
+
+
+rate_limit = RateLimitFilter()
+
+
+def configure(level=LOG_LEVEL):
+    """Configura o log da raiz uma única vez: saída no console com limite de taxa por mensagem."""
+    root = logging.getLogger()
+    if any(rate_limit in handler.filters for handler in root.handlers):
+        return
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    handler.addFilter(rate_limit)
+    root.addHandler(handler)
+    root.setLevel(level)
+
+
+class PeriodicSummary:
+    """Contadores de um laço repetitivo (ex.: publicações de um produtor), registrados em INFO a cada `interval`
+    segundos; o detalhe de cada iteração fica em DEBUG."""
+
+    def __init__(self, log, label, interval=LOG_SUMMARY_INTERVAL):
+        self.log = log
+        self.label = label
+        self.interval = interval
+        self.totals = {}
+        self._window = {}
+        self._last = time.monotonic()
+
+    def count(self, **amounts):
+        for name, amount in amounts.items():
+            self._window[name] = self._window.get(name, 0) + amount
+            self.totals[name] = self.totals.get(name, 0) + amount
+        if time.monotonic() - self._last >= self.interval:
+            self.report()
+
+    def report(self):
+        """Registra o que foi contado desde o último resumo (chamado também no encerramento)."""
+        now = time.monotonic()
+        if self._window:
+            window = ", ".join(f"{name}={value}" for name, value in self._window.items())
+            totals = ", ".join(f"{name}={value}" for name, value in self.totals.items())
+            self.log.info("%s nos últimos %.0f s: %s (total: %s)", self.label, now - self._last, window, totals)
+        self._window = {}
+        self._last = now
+
+
+def get_logger(name):
+    configure()
+    return logging.getLogger(name)
@@ -0,0 +1,206 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+from logs import rate_limit
+from stage_timings import BUCKETS_NS, timer
+
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", 9464)) # Endpoint Prometheus em /metrics (0 desativa)
+PROFILER_ENABLED = os.getenv("PROFILER_ENABLED", "0") == "1" # Amostragem contínua das pilhas durante a execução
+PROFILER_INTERVAL_MS = float(os.getenv("PROFILER_INTERVAL_MS", 10))
+PROFILER_OUTPUT = os.getenv("PROFILER_OUTPUT", "profile.folded") # Pilhas no formato "collapsed" (flamegraph.pl, speedscope)
+
+PREFIX = "farmtech_"
+
+
+class MetricsRegistry:
+    """Métricas no formato de texto do Prometheus, coletadas na hora da leitura.
+
+    O caminho quente continua incrementando os próprios contadores (inteiros nos objetos do
+    pipeline, do buffer, do pontuador...); cada coletor registrado só os lê quando /metrics é
+    consultado. Um coletor devolve tuplas (nome, tipo, ajuda, [(rótulos, valor), ...]); nos
+    histogramas, a amostra pode ter um terceiro item com o sufixo do nome (`_bucket`, `_sum`, `_count`).
+    """
+
+    def __init__(self):
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def register(self, collector):
+        with self._lock:
+            self._collectors.append(collector)
+        return collector
+
+    def counters(self, name, help_text, values, label="kind", kind="counter"):
+        """Registra um dicionário de contadores (ou uma função que o devolve) como uma métrica com rótulo."""
+        def collect():
+            current = values() if callable(values) else values
+            samples = [({label: key}, int(value) if isinstance(value, bool) else value)
+                       for key, value in current.items() if isinstance(value, (int, float))]
+            return [(name, kind, help_text, samples)]
+        return self.register(collect)
+
+    def value(self, name, help_text, read, kind="gauge"):
+        """Registra um único valor lido por `read()` na hora da coleta."""
+        return self.register(lambda: [(name, kind, help_text, [({}, read())])])
+
+    def render(self):
+        with self._lock:
+            collectors = list(self._collectors)
+        lines = []
+        for collector in collectors:
+            try:
+                families = collector()
+            except Exception as e:
+                lines.append(f"# coletor falhou: {e}")
+                continue
+            for name, kind, help_text, samples in families:
+                lines.append(f"# HELP {PREFIX}{name} {help_text}")
+                lines.append(f"# TYPE {PREFIX}{name} {kind}")
+                for labels, value, *suffix in samples:
+                    lines.append(f"{PREFIX}{name}{suffix[0] if suffix else ''}{format_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    escaped = {key: str(value).replace("\\", "\\\\").replace('"', '\\"') for key, value in labels.items()}
+    return "{" + ",".join(f'{key}="{value}"' for key, value in escaped.items()) + "}"
+
+
+def stage_histograms():
+    """Histogramas de duração dos estágios do StageTimer (decode, validate, enrich, store, score...)."""
+    bounds = [f"{limit / 1e9:g}" for limit in BUCKETS_NS] + ["+Inf"]
+    histogram = []
+    for stage, (calls, total_ns, buckets) in sorted(timer.histograms().items()):
+        cumulative = 0
+        for bound, count in zip(bounds, buckets):
+            cumulative += count
+            histogram.append(({"stage": stage, "le": bound}, cumulative, "_bucket"))
+        histogram.append(({"stage": stage}, total_ns / 1e9, "_sum"))
+        histogram.append(({"stage": stage}, calls, "_count"))
+    items = [({"stage": stage}, count) for stage, (count, _, _) in sorted(timer.snapshot().items())]
+    return [
+        ("stage_duration_seconds", "histogram", "Duração de cada chamada por estágio", histogram),
+        ("stage_items_total", "counter", "Itens (mensagens ou documentos) processados por estágio", items),
+    ]
+
+
+class SamplingProfiler:
+    """Amostra as pilhas de todas as threads a cada `interval` segundos (sys._current_frames).
+
+    Não instrumenta o código, então o custo é fixo e independe da vazão. As amostras são
+    agregadas no formato "collapsed" (`thread;módulo:função;... contagem`), lido pelo
+    flamegraph.pl e pelo speedscope.
+    """
+
+    def __init__(self, interval=PROFILER_INTERVAL_MS / 1000):
+        self.interval = interval
+        self.samples = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        own = threading.get_ident()
+        names = {}
+        while not self._stop.wait(self.interval):
+            if len(names) != threading.active_count():
+                names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.samples[";".join(reversed(stack))] += 1
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        return self
+
+    def collapsed(self):
+        return "".join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+
+    def save(self, path=PROFILER_OUTPUT):
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(self.collapsed())
+        return path
+
+
+registry = MetricsRegistry()
+registry.register(stage_histograms)
+registry.value("log_suppressed_total", "Registros de log descartados pelo limite de taxa",
+               lambda: rate_limit.suppressed, "counter")
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path == "/metrics":
+            body = registry.render().encode()
+            content_type = "text/plain; version=0.0.4; charset=utf-8"
+        elif url.path == "/debug/profile":
+            # Perfil sob demanda: amostra por `seconds` segundos (padrão 10) e devolve as pilhas
+            params = dict(parse_qsl(url.query))
+            try:
+                seconds = min(float(params.get("seconds", 10)), 300.0)
+            except ValueError:
+                seconds = 10.0
+            profiler = SamplingProfiler().start()
+            time.sleep(seconds)
+            body = profiler.stop().collapsed().encode()
+            content_type = "text/plain; charset=utf-8"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MetricsServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+
+def start_metrics_server(host=METRICS_HOST, port=METRICS_PORT):
+    """Sobe o endpoint /metrics em uma thread; devolve o servidor ou None se desativado ou porta ocupada."""
+    if port <= 0:
+        return None
+    try:
+        server = MetricsServer((host, port), MetricsHandler)
+    except OSError as e:
+        print(f"Endpoint de métricas indisponível em {host}:{port}: {e}")
+        return None
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    print(f"Métricas em http://{host}:{port}/metrics (perfil sob demanda em /debug/profile?seconds=10)")
+    return server
+
+
+def start_profiler():
+    """Inicia o profiler contínuo se PROFILER_ENABLED=1; salve com `stop().save()` no encerramento."""
+    if not PROFILER_ENABLED:
+        return None
+    print(f"Profiler por amostragem ativo: a cada {PROFILER_INTERVAL_MS:g} ms, pilhas salvas em '{PROFILER_OUTPUT}'.")
+    return SamplingProfiler().start()
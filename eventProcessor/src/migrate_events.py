@@ -0,0 +1,96 @@
+import os
+import time
+
+import pymongo
+from bson import ObjectId, json_util
+
+from storage_layout import LAYOUT_TIMESERIES, ensure_collection, to_timeseries_document
+
+MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017/")
+MONGO_DATABASE = os.getenv("MONGO_DATABASE", "trainstormdb")
+MIGRATION_SOURCE = os.getenv("MIGRATION_SOURCE", "events")        # Coleção plana de origem
+MIGRATION_TARGET = os.getenv("MIGRATION_TARGET", "events_ts")     # Coleção time-series de destino
+MIGRATION_BATCH = int(os.getenv("MIGRATION_BATCH", 10000))        # Documentos por insert_many
+MIGRATION_CHECKPOINT = os.getenv("MIGRATION_CHECKPOINT", "migrate_events.checkpoint")
+
+
+def load_checkpoint():
+    try:
+        with open(MIGRATION_CHECKPOINT) as f:
+            return json_util.loads(f.read())
+    except FileNotFoundError:
+        return {"last_id": None, "pending": None, "migrated": 0}
+
+
+def save_checkpoint(state):
+    tmp_path = MIGRATION_CHECKPOINT + ".tmp"
+    with open(tmp_path, "w") as f:
+        f.write(json_util.dumps(state)) # Preserva o tipo do _id (ObjectId, string...)
+    os.replace(tmp_path, MIGRATION_CHECKPOINT)
+
+
+def rollback_pending(target, state):
+    """Remove o lote que estava sendo gravado quando a migração anterior parou.
+
+    Coleções time-series não garantem _id único, então o lote é apagado e regravado.
+    """
+    pending = state.get("pending")
+    if not pending:
+        return
+    result = target.delete_many({"_id": {"$gte": pending[0], "$lte": pending[1]}})
+    print(f"Lote interrompido removido do destino: {result.deleted_count} documento(s).")
+    state["pending"] = None
+    save_checkpoint(state)
+
+
+def main():
+    client = pymongo.MongoClient(MONGO_URI, serverSelectionTimeoutMS=5000)
+    database = client[MONGO_DATABASE]
+    source = database[MIGRATION_SOURCE]
+    target = ensure_collection(database, MIGRATION_TARGET, LAYOUT_TIMESERIES)
+
+    state = load_checkpoint()
+    rollback_pending(target, state)
+    query = {}
+    if state["last_id"] is not None:
+        query = {"_id": {"$gt": state["last_id"]}}
+        print(f"Retomando a migração após _id {state['last_id']} ({state['migrated']} já migrados).")
+
+    total = source.estimated_document_count()
+    started = time.perf_counter()
+    migrated_now = 0
+    # Lê na ordem do _id (índice padrão) em lotes grandes; o checkpoint permite retomar após interrupções
+    cursor = source.find(query, sort=[("_id", pymongo.ASCENDING)], batch_size=MIGRATION_BATCH)
+    batch = []
+    try:
+        for doc in cursor:
+            if "received_at" not in doc and isinstance(doc["_id"], ObjectId):
+                # Eventos antigos sem received_at: o instante de criação do ObjectId serve de fallback para `ts`
+                doc["received_at"] = doc["_id"].generation_time
+            batch.append(to_timeseries_document(doc))
+            if len(batch) >= MIGRATION_BATCH:
+                migrated_now += write_batch(target, batch, state)
+                batch = []
+                rate = migrated_now / (time.perf_counter() - started)
+                print(f"  {state['migrated']}/{total} documento(s) migrado(s) ({rate:,.0f} doc/s)")
+        if batch:
+            migrated_now += write_batch(target, batch, state)
+    finally:
+        cursor.close()
+        client.close()
+    elapsed = time.perf_counter() - started
+    print(f"Migração concluída: {migrated_now} documento(s) em {elapsed:.1f}s para '{MIGRATION_TARGET}'.")
+    print(f"Para usar a nova coleção: STORAGE_LAYOUT=timeseries MONGO_COLLECTION={MIGRATION_TARGET} python consumer.py")
+
+
+def write_batch(target, batch, state):
+    state["pending"] = [batch[0]["_id"], batch[-1]["_id"]]
+    save_checkpoint(state)
+    target.insert_many(batch, ordered=False)
+    state.update(last_id=batch[-1]["_id"], pending=None, migrated=state["migrated"] + len(batch))
+    save_checkpoint(state)
+    return len(batch)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+import json
+
+import telemetry_codec
+
+try:
+    import orjson # Opcional: decodifica direto dos bytes, bem mais rápido que o json da biblioteca padrão
+except ImportError:
+    orjson = None
+
+if orjson is not None:
+    JSON_BACKEND = "orjson"
+    JSONDecodeError = orjson.JSONDecodeError
+    loads = orjson.loads
+else:
+    JSON_BACKEND = "json"
+    JSONDecodeError = json.JSONDecodeError
+    loads = json.loads # Também aceita bytes (detecta a codificação)
+
+NUMBER = (int, float)
+
+# Formatos conhecidos: campo -> (tipos aceitos, mínimo, máximo)
+FIRMWARE_SCHEMA = { # FarmTechIOT/src/main.cpp
+    "timestamp": (str, None, None),
+    "humidity": (NUMBER, 0, 100),
+    "temperature_C": (NUMBER, -40, 80),
+}
+WEATHER_SCHEMA = { # producer.py: generate_random_weather_data
+    "timestamp": (str, None, None),
+    "city": (str, None, None),
+    "date": (str, None, None),
+    "temperature": (NUMBER, -90, 60),
+    "humidity": (NUMBER, 0, 100),
+    "windSpeed": (NUMBER, 0, 500),
+    "windDirection": (str, None, None),
+    "precipitation": (NUMBER, 0, 2000),
+    "pressure": (NUMBER, 800, 1100),
+}
+IOT_HUB_SCHEMA = { # producer_IoT.py
+    "deviceId": (str, None, None),
+    "messageId": (int, None, None),
+    "temperature": (NUMBER, -90, 60),
+    "humidity": (NUMBER, 0, 100),
+}
+
+
+class PayloadRejected(Exception):
+    """Payload que não pôde ser decodificado ou não corresponde a nenhum formato conhecido."""
+
+
+def compile_validator(name, schema):
+    """Gera o código de uma função de validação específica para o formato, sem laços nem dicionários de regras.
+
+    A função devolve None quando o documento é válido ou a mensagem de erro.
+    """
+    lines = [f"def validate_{name}(doc):"]
+    for index, (field, (types, minimum, maximum)) in enumerate(schema.items()):
+        type_names = types if isinstance(types, tuple) else (types,)
+        type_check = " and ".join(f"t is not {t.__name__}" for t in type_names)
+        lines += [
+            f"    v = doc.get({field!r}, _MISSING)",
+            f"    if v is _MISSING: return {f'campo obrigatório ausente: {field}'!r}",
+            "    t = type(v)",
+            f"    if {type_check}: return {f'tipo inválido em {field}'!r}",
+        ]
+        if minimum is not None:
+            lines.append(f"    if v < {minimum!r} or v > {maximum!r}: return {f'{field} fora da faixa [{minimum}, {maximum}]'!r}")
+    lines.append("    return None")
+    namespace = {"_MISSING": object()}
+    exec("\n".join(lines), namespace)
+    return namespace[f"validate_{name}"]
+
+
+# Cada formato é identificado por um campo exclusivo dele, verificado nesta ordem
+VALIDATORS = (
+    ("firmware", "temperature_C", compile_validator("firmware", FIRMWARE_SCHEMA)),
+    ("weather", "city", compile_validator("weather", WEATHER_SCHEMA)),
+    ("iot_hub", "deviceId", compile_validator("iot_hub", IOT_HUB_SCHEMA)),
+)
+
+
+def decode(payload, topic=""):
+    """Decodifica os bytes do payload sem convertê-los antes para str (JSON ou formato binário compacto)."""
+    if telemetry_codec.is_binary(topic, payload):
+        try:
+            return telemetry_codec.decode(payload)
+        except telemetry_codec.TelemetryCodecError as e:
+            raise PayloadRejected(f"binário inválido: {e}") from None
+    try:
+        doc = loads(payload)
+    except (JSONDecodeError, UnicodeDecodeError) as e:
+        raise PayloadRejected(f"JSON inválido: {e}") from None
+    if type(doc) is not dict:
+        raise PayloadRejected("o payload não é um objeto JSON")
+    return doc
+
+
+def validate(doc, reject_unknown=True):
+    """Valida o documento contra o formato correspondente e devolve o nome do formato."""
+    for name, marker, validator in VALIDATORS:
+        if marker in doc:
+            error = validator(doc)
+            if error is not None:
+                raise PayloadRejected(f"{name}: {error}")
+            return name
+    if reject_unknown:
+        raise PayloadRejected("formato de payload desconhecido")
+    return None
+
+
+def dead_letter_document(topic, payload, reason, received_at):
+    """Documento gravado na coleção de rejeitados: payload bruto, motivo e origem."""
+    return {"topic": topic, "payload": bytes(payload), "error": str(reason), "received_at": received_at}
@@ -0,0 +1,184 @@
+import os
+import queue
+import struct
+import threading
+
+from logs import get_logger
+
+# Políticas de contrapressão quando a fila de ingestão está cheia
+POLICY_NOACK = "noack"  # Só confirma mensagens QoS1 depois de gravadas (o broker para de enviar)
+POLICY_SPILL = "spill"  # Derrama o excedente em disco e reprocessa quando a fila esvaziar
+POLICY_DROP = "drop"    # Descarta o excedente e contabiliza
+POLICIES = (POLICY_NOACK, POLICY_SPILL, POLICY_DROP)
+
+_STOP = object()
+
+log = get_logger("pipeline")
+
+
+class SpillFile:
+    """Arquivo de transbordo: registros (tópico, payload) prefixados pelo tamanho, lidos em ordem FIFO."""
+
+    _HEADER = struct.Struct(">HI")
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._read_offset = 0
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(path, "a+b")
+        self._size = self._file.seek(0, os.SEEK_END)
+
+    def __len__(self):
+        with self._lock:
+            return self._size - self._read_offset
+
+    def append(self, topic, payload):
+        topic_bytes = topic.encode()
+        with self._lock:
+            self._file.seek(0, os.SEEK_END)
+            self._file.write(self._HEADER.pack(len(topic_bytes), len(payload)) + topic_bytes + payload)
+            self._size = self._file.tell()
+
+    def read(self, max_records):
+        """Lê até `max_records` registros; trunca o arquivo quando tudo já foi consumido."""
+        records = []
+        with self._lock:
+            if self._read_offset >= self._size:
+                return records
+            self._file.flush()
+            self._file.seek(self._read_offset)
+            while len(records) < max_records and self._read_offset < self._size:
+                topic_len, payload_len = self._HEADER.unpack(self._file.read(self._HEADER.size))
+                topic = self._file.read(topic_len).decode()
+                payload = self._file.read(payload_len)
+                self._read_offset += self._HEADER.size + topic_len + payload_len
+                records.append((topic, payload))
+            if self._read_offset >= self._size:
+                self._file.truncate(0)
+                self._size = self._read_offset = 0
+        return records
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+class IngestPipeline:
+    """Desacopla o callback do MQTT do armazenamento.
+
+    O callback apenas enfileira os bytes brutos do payload em uma fila limitada;
+    um pool de workers executa `process(topic, payload, delivery)` (decodificar, enriquecer e gravar).
+    Na política noack, `delivery` é o (mid, qos) de cada mensagem QoS1: `process` devolve True quando
+    repassa a confirmação ao buffer de gravação, que a envia depois de gravar o lote; senão o worker confirma.
+    """
+
+    def __init__(self, process, workers=4, queue_size=10000, policy=POLICY_NOACK, spill_path="spill/ingest.spill"):
+        if policy not in POLICIES:
+            raise ValueError(f"Política de contrapressão inválida: {policy!r} (use uma de {POLICIES})")
+        self.process = process
+        self.policy = policy
+        self.queue_size = queue_size
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._spill = SpillFile(spill_path) if policy == POLICY_SPILL else None
+        self._ack = None
+        self._closing = False
+        self._workers = [
+            threading.Thread(target=self._worker, name=f"ingest-worker-{i}", daemon=True) for i in range(max(1, workers))
+        ]
+        self._counters_lock = threading.Lock()
+        self.counters = {"received": 0, "processed": 0, "errors": 0, "dropped": 0, "spilled": 0, "deferred_acks": 0}
+
+    def _count(self, name, amount=1):
+        with self._counters_lock:
+            self.counters[name] += amount
+
+    def start(self, ack=None):
+        """Inicia os workers. `ack(mid, qos)` é obrigatório na política noack (client.ack do paho), e é o mesmo
+        que o buffer de gravação usa para as mensagens repassadas a ele."""
+        if self.policy == POLICY_NOACK and ack is None:
+            raise ValueError("A política noack exige a função de confirmação manual (client.ack).")
+        self._ack = ack
+        for worker in self._workers:
+            worker.start()
+        return self
+
+    def submit(self, topic, payload, mid=0, qos=0):
+        """Chamado na thread de rede do paho: nunca decodifica nem grava, apenas enfileira."""
+        self._count("received")
+        item = (topic, payload, mid, qos)
+        try:
+            self._queue.put_nowait(item)
+            return
+        except queue.Full:
+            pass
+        if self.policy == POLICY_NOACK and qos > 0:
+            # Com Receive Maximum = tamanho da fila e o ACK só depois da gravação, o broker não excede a
+            # capacidade. Se exceder, a mensagem fica sem ACK (o broker a reenvia na reconexão): bloquear
+            # aqui pararia a thread de rede do paho, e com ela o keepalive e os ACKs das outras mensagens.
+            self._count("deferred_acks")
+        elif self.policy == POLICY_SPILL:
+            self._spill.append(topic, payload)
+            self._count("spilled")
+        else:
+            self._count("dropped")
+
+    def _next_item(self):
+        if self._spill is not None and not self._closing and self._queue.qsize() < self.queue_size // 2:
+            self._refill_from_spill()
+        try:
+            return self._queue.get(timeout=0.5)
+        except queue.Empty:
+            return None
+
+    def _refill_from_spill(self):
+        """Com a fila abaixo da metade, reinjeta o que foi derramado em disco."""
+        free_slots = self.queue_size - self._queue.qsize()
+        for topic, payload in self._spill.read(free_slots):
+            try:
+                self._queue.put_nowait((topic, payload, 0, 0))
+            except queue.Full:
+                self._spill.append(topic, payload)
+
+    def _worker(self):
+        while True:
+            item = self._next_item()
+            if item is None:
+                continue
+            try:
+                if item is _STOP:
+                    return
+                topic, payload, mid, qos = item
+                delivery = (mid, qos) if self._ack is not None and qos > 0 else None
+                try:
+                    handed_off = self.process(topic, payload, delivery)
+                    self._count("processed")
+                except Exception as e:
+                    # Sem ACK: o broker reenvia a mensagem na reconexão
+                    self._count("errors")
+                    log.error("Erro ao processar mensagem do tópico '%s': %s", topic, e)
+                    continue
+                if delivery is not None and not handed_off:
+                    self._ack(mid, qos) # Nada a gravar (ex.: reentrega já recebida)
+            finally:
+                self._queue.task_done()
+
+    def close(self):
+        """Aguarda a fila esvaziar e encerra os workers. O transbordo pendente permanece em disco."""
+        self._queue.join()
+        self._closing = True
+        for _ in self._workers:
+            self._queue.put(_STOP)
+        for worker in self._workers:
+            worker.join()
+        if self._spill is not None:
+            self._spill.close()
+
+    def stats(self):
+        with self._counters_lock:
+            counters = dict(self.counters)
+        counters["queued"] = self._queue.qsize()
+        counters["spill_bytes"] = len(self._spill) if self._spill is not None else 0
+        return counters
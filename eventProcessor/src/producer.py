@@ -5,6 +5,12 @@ import time
 import random
 from datetime import datetime, timezone
 
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.properties import Properties
+
+import telemetry_codec
+from logs import PeriodicSummary, get_logger
+
 # Configurações do Broker MQTT
 # Configurações (preferencialmente via variáveis de ambiente)
 MQTT_BROKER_HOST = os.getenv("MQTT_BROKER_HOST", "localhost") # Use 'rabbitmq' se rodar o script fora de um container na mesma rede docker
@@ -12,11 +18,14 @@ MQTT_BROKER_PORT = int(os.getenv("MQTT_BROKER_PORT", 1883))
 MQTT_TOPIC = os.getenv("MQTT_TOPIC", "weather/data") # Tópico para se inscrever
 MQTT_USERNAME = os.getenv("MQTT_USERNAME", "user")
 MQTT_PASSWORD = os.getenv("MQTT_PASSWORD", "password")
+PAYLOAD_FORMAT = os.getenv("PAYLOAD_FORMAT", "json") # json | binary (telemetry_codec)
 
 # Cidades de exemplo
 CITIES = ["New York", "London", "Tokyo", "Sao Paulo", "Paris", "Berlin"]
 WIND_DIRECTIONS = ["N", "NE", "E", "SE", "S", "SW", "W", "NW"]
 
+log = get_logger("producer")
+
 
 def generate_random_weather_data():
     """Gera dados meteorológicos aleatórios."""
@@ -46,7 +55,17 @@ def on_publish(client, userdata, mid, reason_code, properties): # Assinatura atu
     # Para verificar o sucesso, comparamos com o valor numérico ou usamos o próprio objeto
     # No entanto, a mensagem de sucesso já é tratada no loop principal após client.publish()
     # Esta função é mais para logging ou ações adicionais após a confirmação do broker.
-    print(f"Mensagem {mid} publicada com código de razão: {reason_code}")
+    log.debug("Mensagem %s publicada com código de razão: %s", mid, reason_code)
+
+
+def encode_payload(data):
+    """Serializa a leitura no formato configurado e devolve (payload, propriedades MQTT v5)."""
+    properties = Properties(PacketTypes.PUBLISH)
+    if PAYLOAD_FORMAT == "binary":
+        properties.ContentType = telemetry_codec.CONTENT_TYPE
+        return telemetry_codec.encode(data), properties
+    properties.ContentType = "application/json"
+    return json.dumps(data), properties
 
 
 def main():
@@ -67,23 +86,28 @@ def main():
 
     client.loop_start()  # Inicia o loop em uma thread separada
 
+    summary = PeriodicSummary(log, f"Publicações em '{MQTT_TOPIC}'")
     try:
         while True:
             weather_payload = generate_random_weather_data()
-            payload_json = json.dumps(weather_payload)
+            payload, properties = encode_payload(weather_payload)
 
-            result = client.publish(MQTT_TOPIC, payload_json)
+            result = client.publish(MQTT_TOPIC, payload, properties=properties)
             result.wait_for_publish()  # Espera a confirmação da publicação
 
             if result.rc == mqtt.MQTT_ERR_SUCCESS:
-                print(f"Publicado no tópico '{MQTT_TOPIC}': {payload_json}")
+                log.debug("Publicado no tópico '%s' (%s, %d bytes): %s", MQTT_TOPIC, PAYLOAD_FORMAT, len(payload),
+                          weather_payload)
+                summary.count(publicadas=1, bytes=len(payload))
             else:
-                print(f"Falha ao publicar mensagem no tópico '{MQTT_TOPIC}', erro: {mqtt.error_string(result.rc)}")
+                log.error("Falha ao publicar mensagem no tópico '%s', erro: %s", MQTT_TOPIC, mqtt.error_string(result.rc))
+                summary.count(falhas=1)
 
             time.sleep(5)  # Intervalo entre publicações (5 segundos)
     except KeyboardInterrupt:
         print("Publicação interrompida pelo usuário.")
     finally:
+        summary.report()
         client.loop_stop()
         client.disconnect()
         print("Desconectado do broker MQTT.")
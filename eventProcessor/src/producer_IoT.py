@@ -6,6 +6,11 @@ import os
 import time
 import urllib.parse  # Para codificar propriedades no tópico
 
+import telemetry_codec
+from logs import PeriodicSummary, get_logger
+
+log = get_logger("producer_IoT")
+
 # --- Configurações para Azure IoT Hub ---
 IOT_HUB_NAME = os.getenv("IOT_HUB_NAME", "tsx-brs-iot001")
 DEVICE_ID = os.getenv("DEVICE_ID", "device01")
@@ -25,6 +30,12 @@ CLIENT_ID = DEVICE_ID
 # Você pode adicionar propriedades customizadas codificadas na URL, ex: %24.ct=application%2Fjson&%24.ce=utf-8
 MQTT_TOPIC_D2C = f"devices/{DEVICE_ID}/messages/events/"
 
+# Formato do payload: json (padrão) ou binary (telemetry_codec). No formato binário o content type
+# vai como propriedade do sistema do IoT Hub ($.ct) codificada no tópico.
+PAYLOAD_FORMAT = os.getenv("PAYLOAD_FORMAT", "json")
+if PAYLOAD_FORMAT == "binary":
+    MQTT_TOPIC_D2C += urllib.parse.urlencode({"$.ct": telemetry_codec.CONTENT_TYPE})
+
 
 # Exemplo com propriedades:
 # properties = urllib.parse.urlencode({"prop1":"value1", "$contentType": "application/json", "$contentEncoding": "utf-8"})
@@ -43,7 +54,7 @@ def on_connect(client, userdata, flags, rc, properties=None):
 
 
 def on_publish(client, userdata, mid, reason_code, properties):
-    print(f"Mensagem {mid} publicada com código de razão: {reason_code}")
+    log.debug("Mensagem %s publicada com código de razão: %s", mid, reason_code)
 
 
 def send_data_to_iot_hub():
@@ -70,7 +81,10 @@ def send_data_to_iot_hub():
         return
 
     mqtt_client.loop_start()
-    count = 0
+    # Começa nos segundos desde a época (cabe no uint32 do formato binário): com uma mensagem a cada
+    # 10 s, os messageId de uma nova execução não repetem os da anterior e a deduplicação não os confunde
+    count = int(time.time())
+    summary = PeriodicSummary(log, f"Publicações em '{MQTT_TOPIC_D2C}'")
     try:
         while True:
             count += 1
@@ -80,20 +94,26 @@ def send_data_to_iot_hub():
                 "temperature": 20 + (count % 10),
                 "humidity": 60 + (count % 20)
             }
-            payload_json = json.dumps(message_payload)
+            if PAYLOAD_FORMAT == "binary":
+                payload = telemetry_codec.encode_iot_hub(message_payload)
+            else:
+                payload = json.dumps(message_payload)
 
-            result = mqtt_client.publish(MQTT_TOPIC_D2C, payload_json, qos=1)  # QoS 1 é recomendado
+            result = mqtt_client.publish(MQTT_TOPIC_D2C, payload, qos=1)  # QoS 1 é recomendado
             result.wait_for_publish(timeout=5)
 
             if result.rc == mqtt.MQTT_ERR_SUCCESS:
-                print(f"Publicado no tópico '{MQTT_TOPIC_D2C}': {payload_json}")
+                log.debug("Publicado no tópico '%s' (%d bytes): %s", MQTT_TOPIC_D2C, len(payload), message_payload)
+                summary.count(publicadas=1, bytes=len(payload))
             else:
-                print(f"Falha ao publicar mensagem, erro: {mqtt.error_string(result.rc)}")
+                log.error("Falha ao publicar mensagem, erro: %s", mqtt.error_string(result.rc))
+                summary.count(falhas=1)
 
             time.sleep(10)  # Intervalo entre publicações
     except KeyboardInterrupt:
         print("Envio interrompido.")
     finally:
+        summary.report()
         mqtt_client.loop_stop()
         mqtt_client.disconnect()
         print("Desconectado do Azure IoT Hub.")
@@ -0,0 +1,469 @@
+import base64
+import json
+import os
+import queue
+import re
+import sqlite3
+import threading
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+import pymongo
+from bson import ObjectId, json_util
+
+from logs import get_logger
+from query_cache import QueryCache, listen_for_invalidations
+from rollups import WINDOWS
+from storage_layout import LAYOUT_FLAT, LAYOUT_TIMESERIES, META_FIELD, TIME_FIELD, parse_timestamp
+
+MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017/")
+MONGO_DATABASE = os.getenv("MONGO_DATABASE", "trainstormdb")
+MONGO_COLLECTION = os.getenv("MONGO_COLLECTION", "events")
+STORAGE_LAYOUT = os.getenv("STORAGE_LAYOUT", LAYOUT_FLAT)
+ROLLUP_COLLECTION_PREFIX = os.getenv("ROLLUP_COLLECTION_PREFIX", "events_rollup_")
+
+QUERY_HOST = os.getenv("QUERY_HOST", "127.0.0.1")
+QUERY_PORT = int(os.getenv("QUERY_PORT", 8090))
+QUERY_SQLITE_PATH = os.getenv("QUERY_SQLITE_PATH", "../../FarmTechML/farmtech.db") # Tabela previsoes_irrigacao
+QUERY_CACHE_ENTRIES = int(os.getenv("QUERY_CACHE_ENTRIES", 1024))
+QUERY_CACHE_TTL = float(os.getenv("QUERY_CACHE_TTL", 30)) # Segundos; limite de idade mesmo sem avisos de ingestão
+QUERY_CACHE_MIN_FRESH_MS = int(os.getenv("QUERY_CACHE_MIN_FRESH_MS", 1000)) # Idade mínima para um aviso remover a entrada
+QUERY_CACHE_MAX_ENTRY_BYTES = int(os.getenv("QUERY_CACHE_MAX_ENTRY_BYTES", 1024 * 1024)) # Páginas maiores não são guardadas
+QUERY_PAGE_SIZE = int(os.getenv("QUERY_PAGE_SIZE", 1000))
+QUERY_MAX_PAGE_SIZE = int(os.getenv("QUERY_MAX_PAGE_SIZE", 10000))
+QUERY_INVALIDATION_ENABLED = os.getenv("QUERY_INVALIDATION_ENABLED", "1") == "1" # Assina os avisos do consumidor
+
+STREAM_CHUNK_BYTES = 64 * 1024
+SQLITE_FETCH_ROWS = 500
+MONGO_FETCH_DOCS = 1000
+SQLITE_BUCKETS = {"minute": 16, "hour": 13, "day": 10} # Prefixo de "%Y-%m-%d %H:%M:%S" que define a janela
+WINDOW_PATTERN = re.compile(r"^(\d+)([mhd])$")
+DATE_TRUNC_UNITS = {"m": "minute", "h": "hour", "d": "day"}
+
+log = get_logger("query_api")
+
+
+class BadRequest(ValueError):
+    pass
+
+
+class Unavailable(RuntimeError):
+    pass
+
+
+def to_json(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, ObjectId):
+        return str(value)
+    raise TypeError(f"{type(value).__name__} não é serializável em JSON")
+
+
+def encode_line(doc):
+    return json.dumps(doc, default=to_json, ensure_ascii=False).encode() + b"\n"
+
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json_util.dumps(values).encode()).decode()
+
+
+def decode_cursor(token):
+    try:
+        return json_util.loads(base64.urlsafe_b64decode(token.encode()))
+    except (ValueError, TypeError):
+        raise BadRequest("cursor inválido") from None
+
+
+class EventQueries:
+    """Consultas sobre a coleção de eventos nos dois layouts de armazenamento."""
+
+    def __init__(self, database, collection, layout, rollup_prefix):
+        self.collection = database[collection]
+        self.database = database
+        self.rollup_prefix = rollup_prefix
+        timeseries = layout == LAYOUT_TIMESERIES
+        self.time_field = TIME_FIELD if timeseries else "received_at"
+        self.device_field = f"{META_FIELD}.device" if timeseries else "deviceId"
+
+    def _match(self, devices, start, end):
+        match = {}
+        if devices:
+            match[self.device_field] = {"$in": devices}
+        if start or end:
+            match[self.time_field] = {}
+            if start:
+                match[self.time_field]["$gte"] = start
+            if end:
+                match[self.time_field]["$lt"] = end
+        return match
+
+    def latest(self, devices):
+        """Último evento de cada dispositivo.
+
+        A ordenação decrescente nos dois campos percorre o índice (dispositivo, tempo) de trás
+        para a frente, e o $group com $first vira uma varredura de uma entrada por dispositivo.
+        """
+        pipeline = [
+            {"$match": self._match(devices, None, None) or {self.device_field: {"$exists": True}}},
+            {"$sort": {self.device_field: -1, self.time_field: -1}},
+            {"$group": {"_id": f"${self.device_field}", "event": {"$first": "$$ROOT"}}},
+            {"$replaceRoot": {"newRoot": "$event"}},
+            {"$sort": {self.device_field: 1}},
+        ]
+        return list(self.collection.aggregate(pipeline))
+
+    def page(self, devices, start, end, after, limit):
+        """Cursor com até `limit` eventos em ordem de (tempo, _id), a partir do cursor `after`."""
+        match = self._match(devices, start, end)
+        if after is not None:
+            after_time, after_id = after
+            keyset = {"$or": [{self.time_field: {"$gt": after_time}}, {self.time_field: after_time, "_id": {"$gt": after_id}}]}
+            match = {"$and": [match, keyset]} if match else keyset
+        return self.collection.find(match).sort([(self.time_field, 1), ("_id", 1)]).limit(limit).batch_size(
+            min(limit, MONGO_FETCH_DOCS))
+
+    def next_cursor(self, doc):
+        return encode_cursor([doc[self.time_field], doc["_id"]])
+
+    def aggregate(self, field, window, devices, start, end):
+        """Estatísticas de `field` por janela: lê os rollups de 1m/1h; outras janelas agregam os eventos."""
+        if window in WINDOWS:
+            query = {}
+            if devices:
+                query["key"] = {"$in": devices}
+            if start or end:
+                query["window_start"] = {}
+                if start:
+                    query["window_start"]["$gte"] = start
+                if end:
+                    query["window_start"]["$lt"] = end
+            cursor = self.database[self.rollup_prefix + window].find(
+                query, {"_id": 0, "key": 1, "window_start": 1, field: 1}).sort([("window_start", 1), ("key", 1)])
+            return [{"key": doc["key"], "window_start": doc["window_start"], **doc[field]}
+                    for doc in cursor if field in doc]
+        parsed = WINDOW_PATTERN.match(window)
+        if parsed is None:
+            raise BadRequest(f"janela inválida: {window!r} (use 1m, 1h ou <n>m, <n>h, <n>d)")
+        bucket = {"$dateTrunc": {"date": f"${self.time_field}", "unit": DATE_TRUNC_UNITS[parsed.group(2)],
+                                 "binSize": int(parsed.group(1))}}
+        pipeline = [
+            {"$match": {**self._match(devices, start, end), field: {"$type": "number"}}},
+            {"$group": {"_id": {"key": f"${self.device_field}", "window_start": bucket},
+                        "count": {"$sum": 1}, "sum": {"$sum": f"${field}"}, "min": {"$min": f"${field}"},
+                        "max": {"$max": f"${field}"}, "mean": {"$avg": f"${field}"}}},
+            {"$sort": {"_id.window_start": 1, "_id.key": 1}},
+        ]
+        return [{**doc.pop("_id"), **doc} for doc in self.collection.aggregate(pipeline, allowDiskUse=True)]
+
+
+class PredictionQueries:
+    """Consultas somente leitura sobre a tabela previsoes_irrigacao do SQLite do FarmTechML."""
+
+    def __init__(self, path, pool_size=8):
+        self.path = path
+        self._pool = queue.LifoQueue()
+        self._pool_size = pool_size
+        self._watch = None
+        self._watch_lock = threading.Lock()
+
+    def _connect(self):
+        if not os.path.exists(self.path):
+            raise Unavailable(f"banco SQLite não encontrado: {self.path}")
+        conn = sqlite3.connect(f"file:{os.path.abspath(self.path)}?mode=ro", uri=True, timeout=30,
+                               check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def acquire(self):
+        try:
+            return self._pool.get_nowait()
+        except queue.Empty:
+            return self._connect()
+
+    def release(self, conn):
+        if self._pool.qsize() < self._pool_size:
+            self._pool.put(conn)
+        else:
+            conn.close()
+
+    def version(self):
+        """`PRAGMA data_version` muda quando outra conexão (o GravadorPrevisoes) confirma uma gravação."""
+        with self._watch_lock:
+            if self._watch is None:
+                self._watch = self._connect()
+            return self._watch.execute("PRAGMA data_version").fetchone()[0]
+
+    def _query(self, sql, params):
+        conn = self.acquire()
+        try:
+            return [dict(row) for row in conn.execute(sql, params)]
+        except sqlite3.OperationalError as e:
+            raise Unavailable(f"consulta ao SQLite falhou: {e}") from None
+        finally:
+            self.release(conn)
+
+    def latest(self, limit):
+        return self._query("SELECT * FROM previsoes_irrigacao ORDER BY id DESC LIMIT ?", (limit,))
+
+    def page(self, start, end, after, limit):
+        """Gerador de até `limit` linhas em ordem de id, lidas do cursor em blocos."""
+        clauses, params = [], []
+        if start:
+            clauses.append("timestamp >= ?")
+            params.append(start.strftime("%Y-%m-%d %H:%M:%S"))
+        if end:
+            clauses.append("timestamp < ?")
+            params.append(end.strftime("%Y-%m-%d %H:%M:%S"))
+        if after is not None:
+            clauses.append("id > ?")
+            params.append(int(after))
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        conn = self.acquire()
+        try:
+            cursor = conn.execute(f"SELECT * FROM previsoes_irrigacao {where} ORDER BY id LIMIT ?", (*params, limit))
+            while True:
+                rows = cursor.fetchmany(SQLITE_FETCH_ROWS)
+                if not rows:
+                    break
+                for row in rows:
+                    yield dict(row)
+        except sqlite3.OperationalError as e:
+            raise Unavailable(f"consulta ao SQLite falhou: {e}") from None
+        finally:
+            self.release(conn)
+
+    @staticmethod
+    def next_cursor(row):
+        return encode_cursor([row["id"]])
+
+    def aggregate(self, window, start, end):
+        length = SQLITE_BUCKETS.get(window)
+        if length is None:
+            raise BadRequest(f"janela inválida: {window!r} (use um de {tuple(SQLITE_BUCKETS)})")
+        clauses, params = [], []
+        if start:
+            clauses.append("timestamp >= ?")
+            params.append(start.strftime("%Y-%m-%d %H:%M:%S"))
+        if end:
+            clauses.append("timestamp < ?")
+            params.append(end.strftime("%Y-%m-%d %H:%M:%S"))
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        return self._query(f"""
+            SELECT substr(timestamp, 1, {length}) AS window_start, COUNT(*) AS count,
+                   SUM(previsao_modelo) AS irrigar, AVG(umidade_solo) AS umidade_solo_media,
+                   AVG(temperatura) AS temperatura_media, AVG(nutrientes_N) AS nutrientes_N_media
+            FROM previsoes_irrigacao {where}
+            GROUP BY window_start ORDER BY window_start
+        """, params)
+
+
+class QueryService:
+    """Rotas da API sobre as duas fontes, com o cache de resultados na frente."""
+
+    def __init__(self, events, predictions, cache):
+        self.events = events
+        self.predictions = predictions
+        self.cache = cache
+        self.mqtt_client = None # Assinatura dos avisos de ingestão do consumidor
+        self._predictions_version = None
+        self._version_lock = threading.Lock()
+
+    def refresh_predictions(self):
+        """Descarta o cache de previsões se o SQLite recebeu gravações desde a última consulta."""
+        version = self.predictions.version()
+        with self._version_lock:
+            changed = self._predictions_version is not None and version != self._predictions_version
+            self._predictions_version = version
+        if changed:
+            self.cache.clear("predictions")
+
+
+def parse_params(query):
+    params = dict(parse_qsl(query, keep_blank_values=False))
+    devices = sorted(set(filter(None, params.get("device", "").split(",")))) or None
+    start = end = None
+    for name in ("from", "to"):
+        if name in params:
+            value = parse_timestamp(params[name])
+            if value is None:
+                raise BadRequest(f"'{name}' deve ser um instante ISO 8601")
+            if name == "from":
+                start = value
+            else:
+                end = value
+    try:
+        limit = int(params.get("limit", QUERY_PAGE_SIZE))
+    except ValueError:
+        raise BadRequest("'limit' deve ser um inteiro") from None
+    if not 1 <= limit <= QUERY_MAX_PAGE_SIZE:
+        raise BadRequest(f"'limit' deve estar entre 1 e {QUERY_MAX_PAGE_SIZE}")
+    return params, devices, start, end, limit
+
+
+def criar_handler(service):
+    cache = service.cache
+
+    class QueryHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1" # Conexões persistentes: o painel faz várias requisições por atualização
+
+        def _send(self, status, body, content_type="application/json", cache_status=None):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            if cache_status:
+                self.send_header("X-Cache", cache_status)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _error(self, status, message):
+            self._send(status, json.dumps({"erro": message}).encode())
+
+        def _cached_json(self, key, loader, source, devices=None, until=None):
+            body, hit = cache.get_or_load(key, lambda: json.dumps(loader(), default=to_json).encode(), source,
+                                          devices, until)
+            self._send(200, body, cache_status="hit" if hit else "miss")
+
+        def _stream(self, key, rows, next_cursor, limit, source, devices=None, until=None):
+            """Envia a página em NDJSON direto do cursor (chunked); a última linha traz o próximo cursor.
+
+            A página vai para o cache se couber em QUERY_CACHE_MAX_ENTRY_BYTES; a requisição
+            seguinte igual é servida de memória, com Content-Length.
+            """
+            cached = cache.get(key)
+            if cached is not None:
+                return self._send(200, cached, "application/x-ndjson", "hit")
+            generation = cache.generation(source)
+            rows = iter(rows)
+            try:
+                first = next(rows, None) # Erros de consulta aparecem aqui, antes do cabeçalho
+            except (Unavailable, pymongo.errors.PyMongoError, sqlite3.Error) as e:
+                return self._error(503, str(e))
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.send_header("X-Cache", "miss")
+            self.end_headers()
+            kept, kept_bytes = [], 0
+            pending, pending_bytes = [], 0
+            count, last = 0, None
+
+            def emit(line, flush=False):
+                nonlocal pending_bytes, kept_bytes, kept
+                pending.append(line)
+                pending_bytes += len(line)
+                if kept is not None:
+                    kept.append(line)
+                    kept_bytes += len(line)
+                    if kept_bytes > QUERY_CACHE_MAX_ENTRY_BYTES:
+                        kept = None
+                if pending_bytes >= STREAM_CHUNK_BYTES or flush:
+                    data = b"".join(pending)
+                    self.wfile.write(f"{len(data):X}\r\n".encode() + data + b"\r\n")
+                    pending.clear()
+                    pending_bytes = 0
+
+            try:
+                if first is not None:
+                    for doc in _chain(first, rows):
+                        emit(encode_line(doc))
+                        count += 1
+                        last = doc
+                token = next_cursor(last) if count == limit else None
+                emit(encode_line({"next": token, "count": count}), flush=True)
+            except Exception as e:
+                # O status 200 já foi enviado: não há resposta de erro possível. A conexão é encerrada sem o
+                # chunk final, e o cliente vê a resposta incompleta em vez de um segundo cabeçalho no corpo
+                log.warning("Envio de '%s' interrompido após %d linha(s): %s", self.path, count, e)
+                self.close_connection = True
+                close = getattr(rows, "close", None)
+                if close is not None:
+                    close()
+                return
+            self.wfile.write(b"0\r\n\r\n")
+            if kept is not None:
+                cache.put(key, b"".join(kept), source, devices, until, generation)
+
+        def do_GET(self):
+            url = urlsplit(self.path)
+            key = (url.path, tuple(sorted(parse_qsl(url.query))))
+            try:
+                params, devices, start, end, limit = parse_params(url.query)
+                if url.path.startswith("/predictions"):
+                    service.refresh_predictions()
+                if url.path == "/events/latest":
+                    self._cached_json(key, lambda: service.events.latest(devices), "events", devices)
+                elif url.path == "/events":
+                    after = decode_cursor(params["after"]) if "after" in params else None
+                    self._stream(key, service.events.page(devices, start, end, after, limit),
+                                 service.events.next_cursor, limit, "events", devices, end)
+                elif url.path == "/events/aggregate":
+                    field, window = params.get("field", "temperature"), params.get("window", "1h")
+                    self._cached_json(key, lambda: service.events.aggregate(field, window, devices, start, end),
+                                      "events", devices, end)
+                elif url.path == "/predictions/latest":
+                    self._cached_json(key, lambda: service.predictions.latest(limit), "predictions")
+                elif url.path == "/predictions":
+                    after = decode_cursor(params["after"])[0] if "after" in params else None
+                    self._stream(key, service.predictions.page(start, end, after, limit),
+                                 service.predictions.next_cursor, limit, "predictions")
+                elif url.path == "/predictions/aggregate":
+                    window = params.get("window", "hour")
+                    self._cached_json(key, lambda: service.predictions.aggregate(window, start, end), "predictions")
+                elif url.path == "/cache":
+                    self._send(200, json.dumps(cache.stats()).encode())
+                else:
+                    self._error(404, "rota não encontrada")
+            except BadRequest as e:
+                self._error(400, str(e))
+            except (Unavailable, pymongo.errors.PyMongoError) as e:
+                self._error(503, str(e))
+
+        def log_message(self, format, *args):
+            pass # O painel atualiza com frequência; um print por requisição só atrapalharia
+
+    return QueryHandler
+
+
+def _chain(first, rows):
+    yield first
+    yield from rows
+
+
+class ServidorConsultas(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+
+def start_service(host=QUERY_HOST, port=QUERY_PORT):
+    """Conecta às duas fontes e sobe o servidor HTTP; devolve (servidor, serviço, cliente MongoDB)."""
+    mongo_client = pymongo.MongoClient(MONGO_URI, serverSelectionTimeoutMS=5000, tz_aware=True)
+    events = EventQueries(mongo_client[MONGO_DATABASE], MONGO_COLLECTION, STORAGE_LAYOUT, ROLLUP_COLLECTION_PREFIX)
+    cache = QueryCache(QUERY_CACHE_ENTRIES, QUERY_CACHE_TTL, QUERY_CACHE_MIN_FRESH_MS / 1000)
+    service = QueryService(events, PredictionQueries(QUERY_SQLITE_PATH), cache)
+    if QUERY_INVALIDATION_ENABLED:
+        from commands import connect_client
+        try:
+            service.mqtt_client = listen_for_invalidations(connect_client(f"query-api-{os.getpid()}"), cache,
+                                                           MONGO_COLLECTION)
+        except (OSError, ConnectionError) as e:
+            print(f"Avisos de ingestão indisponíveis ({e}); o cache de eventos expira só pelo TTL.")
+    server = ServidorConsultas((host, port), criar_handler(service))
+    print(f"API de consulta em http://{host}:{port} ('{MONGO_DATABASE}.{MONGO_COLLECTION}', layout {STORAGE_LAYOUT}; "
+          f"previsões em '{QUERY_SQLITE_PATH}'; cache de {QUERY_CACHE_ENTRIES} entradas, TTL {QUERY_CACHE_TTL:.0f}s)")
+    return server, service, mongo_client
+
+
+if __name__ == "__main__":
+    server, service, mongo_client = start_service()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nAPI de consulta encerrada.")
+    finally:
+        print(f"Cache: {service.cache.stats()}")
+        server.server_close()
+        if service.mqtt_client is not None:
+            service.mqtt_client.disconnect()
+            service.mqtt_client.loop_stop()
+        mongo_client.close()
@@ -0,0 +1,178 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from storage_layout import event_source, event_time, parse_timestamp
+
+QUERY_INVALIDATION_TOPIC = os.getenv("QUERY_INVALIDATION_TOPIC", "events/ingested") # Avisos de lotes gravados
+
+ALL_DEVICES = "*"
+
+
+class QueryCache:
+    """Cache LRU com TTL dos resultados da API de consulta, invalidado pela ingestão.
+
+    Cada entrada guarda a fonte (`events`, `predictions`), os dispositivos de que depende
+    (ou ALL_DEVICES) e o fim do intervalo consultado (`until`, None se aberto). Um aviso
+    de ingestão para a fonte remove só as entradas que o lote pode ter alterado: as dos
+    dispositivos do lote, as de todos os dispositivos e as de intervalos que terminam
+    depois do evento mais antigo do lote. Entradas com menos de `min_fresh` segundos
+    sobrevivem ao aviso, para que uma rajada de atualizações de painel não vire uma rajada
+    de consultas ao banco enquanto a ingestão grava continuamente.
+    """
+
+    def __init__(self, max_entries=1024, ttl=30.0, min_fresh=1.0):
+        self.max_entries = max(1, max_entries)
+        self.ttl = ttl
+        self.min_fresh = min_fresh
+        self._entries = OrderedDict() # chave -> (valor, instante, fonte, dispositivos, until)
+        self._loading = {}            # chave -> Future das cargas em andamento
+        self._generation = {}         # fonte -> invalidações; carga iniciada antes de uma não é guardada
+        self._lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0, "coalesced": 0, "expired": 0, "evicted": 0, "invalidated": 0}
+
+    def generation(self, source):
+        with self._lock:
+            return self._generation.get(source, 0)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.counters["misses"] += 1
+                return None
+            if time.monotonic() - entry[1] > self.ttl:
+                del self._entries[key]
+                self.counters["expired"] += 1
+                self.counters["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.counters["hits"] += 1
+            return entry[0]
+
+    def put(self, key, value, source, devices=None, until=None, generation=None):
+        """Guarda o resultado, a menos que a fonte tenha sido invalidada desde `generation`."""
+        with self._lock:
+            if generation is not None and self._generation.get(source, 0) != generation:
+                return False
+            self._entries[key] = (value, time.monotonic(), source, frozenset(devices or (ALL_DEVICES,)), until)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.counters["evicted"] += 1
+            return True
+
+    def get_or_load(self, key, loader, source, devices=None, until=None):
+        """Devolve (valor, hit). Requisições iguais simultâneas esperam uma única execução de `loader`."""
+        value = self.get(key)
+        if value is not None:
+            return value, True
+        with self._lock:
+            future = self._loading.get(key)
+            owner = future is None
+            if owner:
+                future = self._loading[key] = Future()
+                generation = self._generation.get(source, 0)
+            else:
+                self.counters["coalesced"] += 1
+        if not owner:
+            return future.result(), True
+        try:
+            value = loader()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._loading.pop(key, None)
+        self.put(key, value, source, devices, until, generation)
+        future.set_result(value)
+        return value, False
+
+    def invalidate(self, source, devices=None, since=None):
+        """Remove as entradas de `source` afetadas por um lote com os `devices` e eventos a partir de `since`."""
+        devices = set(devices) if devices else None
+        now = time.monotonic()
+        with self._lock:
+            self._generation[source] = self._generation.get(source, 0) + 1
+            removed = []
+            for key, (_, stored, entry_source, entry_devices, until) in self._entries.items():
+                if entry_source != source or now - stored < self.min_fresh:
+                    continue
+                if until is not None and since is not None and until <= since:
+                    continue # Intervalo fechado antes dos eventos do lote
+                if devices is None or ALL_DEVICES in entry_devices or not entry_devices.isdisjoint(devices):
+                    removed.append(key)
+            for key in removed:
+                del self._entries[key]
+            self.counters["invalidated"] += len(removed)
+            return len(removed)
+
+    def clear(self, source):
+        return self.invalidate(source)
+
+    def stats(self):
+        with self._lock:
+            summary = dict(self.counters, entries=len(self._entries))
+        lookups = summary["hits"] + summary["misses"]
+        summary["hit_ratio"] = round(summary["hits"] / lookups, 4) if lookups else 0.0
+        return summary
+
+
+class IngestNotifier:
+    """Publica um aviso por lote gravado, para a API de consulta invalidar o cache.
+
+    O aviso leva a coleção, os dispositivos do lote e o instante mais antigo entre a leitura
+    e o recebimento dos eventos (`since`), em QoS 0: se um aviso se perder, o TTL do cache
+    limita o tempo em que um resultado antigo pode ser servido.
+    """
+
+    def __init__(self, client, collection, topic=QUERY_INVALIDATION_TOPIC):
+        self.client = client
+        self.collection = collection
+        self.topic = topic
+        self.published = 0
+
+    def notify(self, batch):
+        devices = set()
+        since = None
+        for doc in batch:
+            device = event_source(doc, "deviceId")
+            if device is not None:
+                devices.add(device)
+            for when in (event_time(doc), doc.get("received_at")):
+                if when is not None and (since is None or when < since):
+                    since = when
+        notice = {"collection": self.collection, "devices": sorted(devices), "count": len(batch),
+                  "since": since.isoformat() if since else None}
+        self.client.publish(self.topic, json.dumps(notice), qos=0)
+        self.published += 1
+
+    def close(self):
+        self.client.disconnect()
+        self.client.loop_stop()
+
+
+def listen_for_invalidations(client, cache, collection, source="events", topic=QUERY_INVALIDATION_TOPIC):
+    """Assina os avisos de ingestão da coleção e os aplica ao cache."""
+
+    def on_notice(client, userdata, msg):
+        try:
+            notice = json.loads(msg.payload)
+        except ValueError:
+            return
+        if notice.get("collection") != collection:
+            return
+        since = parse_timestamp(notice.get("since"))
+        # Lote sem deviceId (ex.: leituras por cidade) só afeta as consultas de todos os dispositivos
+        cache.invalidate(source, notice.get("devices") or [ALL_DEVICES], since)
+
+    from commands import resubscribe_on_reconnect # Só quem assina os avisos depende do paho
+
+    client.message_callback_add(topic, on_notice)
+    client.subscribe(topic, qos=0)
+    resubscribe_on_reconnect(client, (topic, 0))
+    return client
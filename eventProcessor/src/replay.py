@@ -0,0 +1,443 @@
+import glob
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+import pymongo
+from bson import json_util
+from pymongo import UpdateOne
+
+from dedup import count_write_errors, event_id
+from rollups import FIELDS as ROLLUP_DEFAULT_FIELDS, KEY_FIELDS as ROLLUP_KEY_FIELDS, WINDOWS, RollupAggregator
+from scoring import FEATURE_SOURCES, BatchScorer
+from spool import iter_segment, list_segments, segment_path
+from stage_timings import timer
+from storage_layout import (LAYOUT_FLAT, LAYOUT_TIMESERIES, META_FIELD, TIME_FIELD, event_source, event_time,
+                            parse_timestamp, shape_document)
+
+try:
+    import pyarrow.parquet as pq # Opcional: só para REPLAY_SOURCE=parquet
+except ImportError:
+    pq = None
+
+# Mesmas variáveis de ambiente do consumidor (consumer.py)
+MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017/")
+MONGO_DATABASE = os.getenv("MONGO_DATABASE", "trainstormdb")
+MONGO_COLLECTION = os.getenv("MONGO_COLLECTION", "events")
+STORAGE_LAYOUT = os.getenv("STORAGE_LAYOUT", LAYOUT_FLAT)
+ROLLUP_KEY = os.getenv("ROLLUP_KEY", "auto")
+ROLLUP_FIELDS = os.getenv("ROLLUP_FIELDS", ",".join(ROLLUP_DEFAULT_FIELDS)).split(",")
+ROLLUP_COLLECTION_PREFIX = os.getenv("ROLLUP_COLLECTION_PREFIX", "events_rollup_")
+SCORING_MODEL_PATH = os.getenv("SCORING_MODEL_PATH", "../../FarmTechML/modelo_irrigacao.npz")
+SCORING_MODULE_PATH = os.getenv("SCORING_MODULE_PATH", "../../FarmTechML")
+SCORING_FIELD = os.getenv("SCORING_FIELD", "irrigation")
+SCORING_DEFAULT_NUTRIENTS = float(os.getenv("SCORING_DEFAULT_NUTRIENTS", 150.0))
+
+REPLAY_SOURCE = os.getenv("REPLAY_SOURCE", "mongo") # mongo (MONGO_COLLECTION) | spool | parquet
+REPLAY_PATH = os.getenv("REPLAY_PATH", "spool")     # Diretório do spool, ou arquivo/diretório Parquet
+REPLAY_FROM = os.getenv("REPLAY_FROM", "")          # Início do intervalo (ISO 8601, inclusivo)
+REPLAY_TO = os.getenv("REPLAY_TO", "")              # Fim do intervalo (ISO 8601, exclusivo)
+REPLAY_LATENESS = int(os.getenv("REPLAY_LATENESS", 3600)) # Segundos entre o timestamp e o received_at tolerados (layout flat)
+REPLAY_DEVICES = [device for device in os.getenv("REPLAY_DEVICES", "").split(",") if device] # deviceId (vazio: todos)
+REPLAY_SCORE = os.getenv("REPLAY_SCORE", "0") == "1"     # Recalcula a previsão de irrigação com o modelo atual
+REPLAY_ROLLUPS = os.getenv("REPLAY_ROLLUPS", "0") == "1" # Reconstrói os rollups do intervalo
+REPLAY_STORE = os.getenv("REPLAY_STORE", "1") == "1"     # Grava os documentos (spool/parquet) ou a nova previsão (mongo)
+REPLAY_DRY_RUN = os.getenv("REPLAY_DRY_RUN", "0") == "1" # Lê e processa sem gravar nada nem salvar checkpoint
+REPLAY_RATE = float(os.getenv("REPLAY_RATE", 0))         # Documentos por segundo (0: sem limite)
+REPLAY_BATCH = int(os.getenv("REPLAY_BATCH", 5000))      # Documentos por lote
+REPLAY_WORKERS = int(os.getenv("REPLAY_WORKERS", 4))     # Lotes processados em paralelo
+REPLAY_MAX_INFLIGHT = int(os.getenv("REPLAY_MAX_INFLIGHT", 16)) # Lotes lidos e ainda não concluídos
+REPLAY_CHECKPOINT = os.getenv("REPLAY_CHECKPOINT", "replay.checkpoint")
+REPLAY_RESET = os.getenv("REPLAY_RESET", "0") == "1"     # Ignora o checkpoint e recomeça do início
+REPLAY_REPORT_INTERVAL = int(os.getenv("REPLAY_REPORT_INTERVAL", 5))
+REPLAY_ROLLUP_ATTEMPTS = int(os.getenv("REPLAY_ROLLUP_ATTEMPTS", 3)) # Tentativas de gravar os rollups de cada lote
+
+SOURCES = ("mongo", "spool", "parquet")
+
+
+# --- checkpoint ---
+
+def job_signature(start, end):
+    """Identifica o trabalho: um checkpoint de outro intervalo ou origem não é retomado."""
+    return {"source": REPLAY_SOURCE, "path": REPLAY_PATH if REPLAY_SOURCE != "mongo" else MONGO_COLLECTION,
+            "from": start, "to": end, "devices": sorted(REPLAY_DEVICES), "lateness": REPLAY_LATENESS}
+
+
+def load_checkpoint(signature):
+    if REPLAY_RESET:
+        return None
+    try:
+        with open(REPLAY_CHECKPOINT) as f:
+            state = json_util.loads(f.read())
+    except FileNotFoundError:
+        return None
+    if state.get("job") != json_util.loads(json_util.dumps(signature)):
+        print(f"Checkpoint '{REPLAY_CHECKPOINT}' é de outro trabalho ({state.get('job')}); recomeçando do início.")
+        return None
+    return state
+
+
+def remove_checkpoint():
+    try:
+        os.remove(REPLAY_CHECKPOINT)
+    except FileNotFoundError:
+        pass
+
+
+def save_checkpoint(state):
+    tmp_path = REPLAY_CHECKPOINT + ".tmp"
+    with open(tmp_path, "w") as f:
+        f.write(json_util.dumps(state)) # Preserva o tipo do _id e os datetimes da posição
+    os.replace(tmp_path, REPLAY_CHECKPOINT)
+
+
+# --- origens: geram (posição após o lote, documentos) em ordem ---
+
+def replay_projection():
+    """Só os campos usados pela pontuação e pelos rollups: a leitura do MongoDB não traz o documento inteiro."""
+    fields = {"_id", "received_at", "timestamp", TIME_FIELD, META_FIELD, "topic"}
+    fields.update(source for _, sources in FEATURE_SOURCES for source in sources)
+    fields.update(ROLLUP_KEY_FIELDS)
+    fields.update(ROLLUP_FIELDS)
+    return {field: 1 for field in fields}
+
+
+def mongo_batches(collection, start, end, position):
+    """Eventos de MONGO_COLLECTION em ordem de (instante, _id), com paginação por chave a partir da posição.
+
+    No layout flat só o `received_at` é indexado e comparável (o `timestamp` é o texto do produtor): o intervalo
+    é alargado por REPLAY_LATENESS nos dois lados e o Replayer filtra pelo instante do evento.
+    """
+    time_field = TIME_FIELD if STORAGE_LAYOUT == LAYOUT_TIMESERIES else "received_at"
+    device_field = f"{META_FIELD}.device" if STORAGE_LAYOUT == LAYOUT_TIMESERIES else "deviceId"
+    if STORAGE_LAYOUT != LAYOUT_TIMESERIES:
+        lateness = timedelta(seconds=REPLAY_LATENESS)
+        start = start - lateness if start else start
+        end = end + lateness if end else end
+    query = {}
+    if start or end:
+        query[time_field] = {key: value for key, value in (("$gte", start), ("$lt", end)) if value}
+    if REPLAY_DEVICES:
+        query[device_field] = {"$in": REPLAY_DEVICES}
+    if position is not None:
+        last_time, last_id = position
+        query = {"$and": [query, {"$or": [{time_field: {"$gt": last_time}},
+                                          {time_field: last_time, "_id": {"$gt": last_id}}]}]}
+    cursor = collection.find(query, replay_projection(), sort=[(time_field, pymongo.ASCENDING), ("_id", pymongo.ASCENDING)],
+                             batch_size=REPLAY_BATCH)
+    try:
+        batch = []
+        for doc in cursor:
+            batch.append(doc)
+            if len(batch) >= REPLAY_BATCH:
+                yield [batch[-1].get(time_field), batch[-1]["_id"]], batch
+                batch = []
+        if batch:
+            yield [batch[-1].get(time_field), batch[-1]["_id"]], batch
+    finally:
+        cursor.close()
+
+
+def spool_batches(position):
+    """Documentos dos segmentos do spool (REPLAY_PATH), na ordem em que foram gravados."""
+    first_seq, first_offset = position or (None, 0)
+    for seq in list_segments(REPLAY_PATH):
+        if first_seq is not None and seq < first_seq:
+            continue
+        offset = first_offset if seq == first_seq else 0
+        batch, end = [], offset
+        for end, doc in iter_segment(segment_path(REPLAY_PATH, seq), offset):
+            batch.append(doc)
+            if len(batch) >= REPLAY_BATCH:
+                yield [seq, end], batch
+                batch = []
+        if batch:
+            yield [seq, end], batch
+
+
+def parquet_files():
+    if os.path.isfile(REPLAY_PATH):
+        return [REPLAY_PATH]
+    # Partições por data (ex.: data=2025-01-01/) ordenam pelo nome
+    return sorted(glob.glob(os.path.join(REPLAY_PATH, "**", "*.parquet"), recursive=True))
+
+
+def parquet_batches(position):
+    """Linhas dos arquivos Parquet de REPLAY_PATH, arquivo por arquivo; colunas nulas ficam fora do documento."""
+    if pq is None:
+        raise RuntimeError("REPLAY_SOURCE=parquet requer o pyarrow (pip install pyarrow).")
+    first_file, first_row = position or (0, 0)
+    for index, path in enumerate(parquet_files()):
+        if index < first_file:
+            continue
+        skip = first_row if index == first_file else 0
+        row = 0
+        for record_batch in pq.ParquetFile(path).iter_batches(batch_size=REPLAY_BATCH):
+            rows = record_batch.num_rows
+            if row + rows <= skip:
+                row += rows
+                continue
+            if row < skip:
+                record_batch = record_batch.slice(skip - row)
+            row += rows
+            docs = [{key: value for key, value in doc.items() if value is not None} for doc in record_batch.to_pylist()]
+            yield [index, row], docs
+
+
+# --- processamento ---
+
+class Replayer:
+    """Reprocessa eventos guardados pelos estágios do consumidor, em lotes paralelos.
+
+    A leitura é sequencial e em ordem; cada lote é filtrado, pontuado e gravado por um worker
+    do pool. Os lotes são concluídos na ordem de leitura: os rollups e o checkpoint só avançam
+    quando todos os lotes anteriores terminaram, então uma interrupção retoma do último lote
+    confirmado sem pular eventos.
+    """
+
+    def __init__(self, target, scorer=None, aggregator=None, start=None, end=None, store=True, dry_run=False):
+        self.target = target         # Coleção gravada (None em dry-run sem MongoDB)
+        self.scorer = scorer
+        self.aggregator = aggregator
+        self.start = start
+        self.end = end
+        self.store = store and not dry_run
+        self.dry_run = dry_run
+        self.counters = {"read": 0, "filtered": 0, "written": 0, "duplicates": 0, "failed": 0}
+
+    def _keep(self, doc):
+        # Dispositivos já filtrados na consulta do MongoDB; o intervalo vale pelo instante do evento em todas as
+        # origens (no layout flat a consulta usa o received_at alargado)
+        if REPLAY_SOURCE != "mongo" and REPLAY_DEVICES and event_source(doc, "deviceId") not in REPLAY_DEVICES:
+            return False
+        if self.start or self.end:
+            when = event_time(doc)
+            if when is None or (self.start and when < self.start) or (self.end and when >= self.end):
+                return False
+        return True
+
+    def _prepare(self, doc):
+        # Documentos do Parquet não têm _id: o mesmo ID determinístico da ingestão torna a reexecução idempotente
+        if "_id" not in doc:
+            key = event_id(doc)
+            if key is not None:
+                doc["_id"] = key
+        if TIME_FIELD not in doc:
+            doc = shape_document(doc, STORAGE_LAYOUT)
+        return doc
+
+    def process(self, batch):
+        """Executado no pool: devolve (lote filtrado, contadores do lote)."""
+        counts = dict.fromkeys(self.counters, 0)
+        counts["read"] = len(batch)
+        batch = [doc for doc in batch if self._keep(doc)]
+        counts["filtered"] = counts["read"] - len(batch)
+        if REPLAY_SOURCE != "mongo":
+            batch = [self._prepare(doc) for doc in batch]
+        if self.scorer is not None and batch:
+            self.scorer.score(batch)
+        if self.store and batch:
+            started = time.perf_counter_ns()
+            if REPLAY_SOURCE == "mongo":
+                self._update_scores(batch, counts)
+            else:
+                self._insert(batch, counts)
+            timer.record("replay_write", time.perf_counter_ns() - started, len(batch))
+        return batch, counts
+
+    def _insert(self, batch, counts):
+        try:
+            result = self.target.insert_many(batch, ordered=False)
+            counts["written"] += len(result.inserted_ids)
+        except pymongo.errors.BulkWriteError as e:
+            details = e.details or {}
+            duplicates, rejected = count_write_errors(details)
+            counts["written"] += details.get("nInserted", 0)
+            counts["duplicates"] += duplicates
+            counts["failed"] += rejected
+
+    def _update_scores(self, batch, counts):
+        # Reescreve só o campo da previsão; documentos sem as features mantêm o que já tinham
+        requests = [UpdateOne({"_id": doc["_id"]}, {"$set": {SCORING_FIELD: doc[SCORING_FIELD]}})
+                    for doc in batch if SCORING_FIELD in doc]
+        if not requests:
+            return
+        try:
+            result = self.target.bulk_write(requests, ordered=False)
+            counts["written"] += result.modified_count
+        except pymongo.errors.BulkWriteError as e:
+            details = e.details or {}
+            counts["written"] += details.get("nModified", 0)
+            counts["failed"] += len(details.get("writeErrors", []))
+
+    def commit(self, batch, counts):
+        """Executado em ordem na thread principal, depois que o lote foi gravado."""
+        if self.aggregator is not None:
+            # O lote já foi filtrado pelo instante do evento: só as janelas do intervalo foram apagadas
+            for doc in batch:
+                self.aggregator.add(doc)
+        for name, value in counts.items():
+            self.counters[name] += value
+
+
+class RollupFlushError(Exception):
+    pass
+
+
+def flush_rollups(aggregator):
+    """Grava os rollups de um lote antes do checkpoint; as janelas que falham voltam ao estado e são tentadas de novo."""
+    for attempt in range(max(1, REPLAY_ROLLUP_ATTEMPTS)):
+        if attempt:
+            time.sleep(2 ** attempt)
+        aggregator.flush(closed_only=False)
+        if not aggregator.pending_windows():
+            return
+    raise RollupFlushError(f"{aggregator.pending_windows()} janela(s) de rollup não gravada(s) "
+                           f"após {REPLAY_ROLLUP_ATTEMPTS} tentativa(s)")
+
+
+def rebuild_window(start, end):
+    """Alarga o intervalo até os limites da maior janela: os rollups são apagados e refeitos por janela inteira."""
+    largest = max(WINDOWS.values())
+    if start is not None:
+        start = datetime.fromtimestamp(start.timestamp() // largest * largest, timezone.utc)
+    if end is not None:
+        end = datetime.fromtimestamp(-(-end.timestamp() // largest) * largest, timezone.utc)
+    return start, end
+
+
+def clear_rollups(database, start, end, dry_run):
+    """Remove as janelas do intervalo, que a reprodução grava de novo (a gravação dos rollups é aditiva)."""
+    query = {}
+    if start or end:
+        query["window_start"] = {key: value for key, value in (("$gte", start), ("$lt", end)) if value}
+    if REPLAY_DEVICES:
+        query["key"] = {"$in": REPLAY_DEVICES}
+    for name in WINDOWS:
+        collection = database[ROLLUP_COLLECTION_PREFIX + name]
+        if dry_run:
+            print(f"  [dry-run] {collection.count_documents(query)} janela(s) seriam refeitas em '{collection.name}'.")
+        else:
+            print(f"  {collection.delete_many(query).deleted_count} janela(s) removida(s) de '{collection.name}'.")
+
+
+def main():
+    if REPLAY_SOURCE not in SOURCES:
+        raise ValueError(f"REPLAY_SOURCE inválido: {REPLAY_SOURCE!r} (use um de {SOURCES})")
+    if REPLAY_SOURCE == "mongo" and not (REPLAY_SCORE or REPLAY_ROLLUPS):
+        print("Nada a fazer: com REPLAY_SOURCE=mongo use REPLAY_SCORE=1 e/ou REPLAY_ROLLUPS=1.")
+        return
+    start = parse_timestamp(REPLAY_FROM) if REPLAY_FROM else None
+    end = parse_timestamp(REPLAY_TO) if REPLAY_TO else None
+    if REPLAY_ROLLUPS:
+        start, end = rebuild_window(start, end)
+    signature = job_signature(start, end)
+    state = load_checkpoint(signature)
+    position = state["position"] if state else None
+
+    needs_mongo = REPLAY_SOURCE == "mongo" or not REPLAY_DRY_RUN
+    client = pymongo.MongoClient(MONGO_URI, serverSelectionTimeoutMS=5000, tz_aware=True) if needs_mongo else None
+    database = client[MONGO_DATABASE] if client is not None else None
+    collection = database[MONGO_COLLECTION] if database is not None else None
+
+    scorer = None
+    if REPLAY_SCORE:
+        scorer = BatchScorer(SCORING_MODEL_PATH, SCORING_MODULE_PATH, SCORING_DEFAULT_NUTRIENTS, SCORING_FIELD,
+                             reload_interval=float("inf"), # A reprodução inteira usa a mesma versão
+                             track_latency=False)
+    aggregator = None
+    if REPLAY_ROLLUPS:
+        if database is not None and state is None:
+            clear_rollups(database, start, end, REPLAY_DRY_RUN)
+        if database is not None and not REPLAY_DRY_RUN:
+            for name in WINDOWS: # Mesmo índice criado pelo consumidor, caso os rollups nunca tenham rodado
+                database[ROLLUP_COLLECTION_PREFIX + name].create_index(
+                    [("key", pymongo.ASCENDING), ("window_start", pymongo.ASCENDING)], unique=True)
+        aggregator = RollupAggregator(database, fields=ROLLUP_FIELDS, key=ROLLUP_KEY,
+                                      collection_prefix=ROLLUP_COLLECTION_PREFIX)
+    replayer = Replayer(collection, scorer, aggregator, start, end, store=REPLAY_STORE, dry_run=REPLAY_DRY_RUN)
+    if REPLAY_SOURCE == "mongo":
+        batches = mongo_batches(collection, start, end, position)
+    elif REPLAY_SOURCE == "spool":
+        batches = spool_batches(position)
+    else:
+        batches = parquet_batches(position)
+
+    replayed = state["replayed"] if state else 0
+    if state:
+        print(f"Retomando a reprodução após {position} ({replayed} documento(s) já reproduzidos).")
+    print(f"Reprodução de '{REPLAY_SOURCE}' ({REPLAY_PATH if REPLAY_SOURCE != 'mongo' else MONGO_COLLECTION}): "
+          f"intervalo [{start or '-'}, {end or '-'}), pontuação {'sim' if scorer else 'não'}, "
+          f"rollups {'sim' if aggregator else 'não'}, gravação {'sim' if replayer.store else 'não'}"
+          f"{' (dry-run)' if REPLAY_DRY_RUN else ''}, {REPLAY_WORKERS} worker(s), lotes de {REPLAY_BATCH}.")
+
+    pending = deque() # (posição, future) na ordem de leitura
+    started = time.perf_counter()
+    last_report = started
+    next_allowed = started
+    completed = None
+
+    def complete_oldest():
+        nonlocal replayed, last_report, completed
+        batch_position, future = pending.popleft()
+        batch, counts = future.result() # Propaga falhas de gravação: o checkpoint fica no último lote confirmado
+        replayer.commit(batch, counts)
+        replayed += counts["read"]
+        completed = batch_position
+        if not REPLAY_DRY_RUN:
+            if aggregator is not None:
+                flush_rollups(aggregator) # Rollups do lote gravados antes de avançar o checkpoint
+            save_checkpoint({"job": signature, "position": batch_position, "replayed": replayed})
+        now = time.perf_counter()
+        if now - last_report >= REPLAY_REPORT_INTERVAL:
+            last_report = now
+            rate = replayer.counters["read"] / (now - started)
+            print(f"  {replayed} documento(s) | {rate:,.0f} doc/s | {replayer.counters}")
+
+    with ThreadPoolExecutor(max_workers=max(1, REPLAY_WORKERS), thread_name_prefix="replay") as pool:
+        try:
+            read_started = time.perf_counter_ns()
+            for batch_position, batch in batches:
+                timer.record("replay_read", time.perf_counter_ns() - read_started, len(batch))
+                if REPLAY_RATE > 0:
+                    # Limite de taxa: cada lote "custa" len(batch) / REPLAY_RATE segundos
+                    delay = next_allowed - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                    next_allowed = max(next_allowed, time.perf_counter() - 1.0) + len(batch) / REPLAY_RATE
+                pending.append((batch_position, pool.submit(replayer.process, batch)))
+                while len(pending) >= max(1, REPLAY_MAX_INFLIGHT) or (pending and pending[0][1].done()):
+                    complete_oldest()
+                read_started = time.perf_counter_ns()
+            while pending:
+                complete_oldest()
+        except KeyboardInterrupt:
+            print("Reprodução interrompida; execute novamente para retomar do checkpoint.")
+        except pymongo.errors.PyMongoError as e:
+            print(f"Reprodução interrompida por erro no MongoDB ({e}); execute novamente para retomar do checkpoint.")
+        except RollupFlushError as e:
+            # A gravação é aditiva e parte das janelas do lote pode ter sido aplicada: retomar do checkpoint
+            # as somaria de novo. Sem checkpoint, a próxima execução apaga as janelas do intervalo e as refaz.
+            remove_checkpoint()
+            print(f"Reprodução interrompida: {e}. Checkpoint removido; execute novamente para refazer os rollups.")
+        finally:
+            # Lotes ainda na fila não começam; os que já estão gravando terminam antes do encerramento do pool
+            for _, future in pending:
+                future.cancel()
+    if client is not None:
+        client.close()
+
+    elapsed = time.perf_counter() - started
+    rate = replayer.counters["read"] / elapsed if elapsed > 0 else 0.0
+    print(f"Reprodução concluída até {completed}: {replayer.counters} em {elapsed:.1f}s ({rate:,.0f} doc/s).")
+    if scorer is not None:
+        print(f"Pontuação: {scorer.stats()}")
+    if aggregator is not None:
+        print(f"Rollups: {aggregator.flushed_windows} janela(s) gravada(s).")
+    print(f"Tempos por estágio: {timer.report()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import pymongo
+from pymongo import UpdateOne
+
+from storage_layout import event_source, event_time
+
+WINDOWS = {"1m": 60, "1h": 3600} # Nome da janela -> duração em segundos
+FIELDS = ("temperature", "humidity", "windSpeed", "precipitation")
+KEY_FIELDS = ("deviceId", "city", "topic") # Ordem de preferência da chave de agregação no modo "auto"
+
+
+class RollupAggregator:
+    """Agregação incremental (count/sum/min/max/mean) por chave e janela de tempo.
+
+    As janelas ficam em memória e são descarregadas quando fecham (fim da janela + tolerância
+    a atraso). A gravação usa upsert com operadores de soma, mínimo e máximo, então lotes
+    parciais, eventos atrasados e vários processos consumidores se combinam no mesmo documento.
+    """
+
+    def __init__(self, database, windows=None, fields=FIELDS, key="auto", collection_prefix="events_rollup_",
+                 lateness=10, flush_interval=5):
+        self.database = database
+        self.windows = windows or WINDOWS
+        self.fields = tuple(fields)
+        self.key = key
+        self.collection_prefix = collection_prefix
+        self.lateness = lateness
+        self.flush_interval = flush_interval
+        self._state = {} # (janela, início em segundos, chave) -> {campo: [count, sum, min, max]}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="rollups", daemon=True)
+        self.flushed_windows = 0
+
+    def start(self):
+        for name in self.windows:
+            self.database[self.collection_prefix + name].create_index(
+                [("key", pymongo.ASCENDING), ("window_start", pymongo.ASCENDING)], unique=True)
+        self._thread.start()
+        return self
+
+    def _key_of(self, doc):
+        if self.key != "auto":
+            return event_source(doc, self.key)
+        for field in KEY_FIELDS:
+            value = event_source(doc, field)
+            if value is not None:
+                return value
+        return None
+
+    def add(self, doc):
+        """Incorpora um evento decodificado às janelas abertas."""
+        key = self._key_of(doc)
+        when = event_time(doc)
+        if key is None or when is None:
+            return
+        values = [(field, doc[field]) for field in self.fields if isinstance(doc.get(field), (int, float))]
+        if not values:
+            return
+        epoch = when.timestamp()
+        with self._lock:
+            for name, seconds in self.windows.items():
+                window = (name, int(epoch // seconds) * seconds, key)
+                stats = self._state.get(window)
+                if stats is None:
+                    stats = self._state[window] = {}
+                for field, value in values:
+                    current = stats.get(field)
+                    if current is None:
+                        stats[field] = [1, value, value, value]
+                    else:
+                        current[0] += 1
+                        current[1] += value
+                        if value < current[2]:
+                            current[2] = value
+                        if value > current[3]:
+                            current[3] = value
+
+    def pending_windows(self):
+        """Janelas ainda não gravadas (abertas ou devolvidas ao estado por uma falha de gravação)."""
+        with self._lock:
+            return len(self._state)
+
+    def _take(self, closed_only):
+        now = time.time()
+        taken = {}
+        with self._lock:
+            for window in list(self._state):
+                name, start, _ = window
+                if not closed_only or start + self.windows[name] + self.lateness <= now:
+                    taken[window] = self._state.pop(window)
+        return taken
+
+    def _merge_back(self, taken):
+        # Gravação falhou: devolve as janelas ao estado em memória para a próxima tentativa
+        with self._lock:
+            for window, stats in taken.items():
+                current = self._state.setdefault(window, {})
+                for field, (count, total, minimum, maximum) in stats.items():
+                    if field in current:
+                        c = current[field]
+                        current[field] = [c[0] + count, c[1] + total, min(c[2], minimum), max(c[3], maximum)]
+                    else:
+                        current[field] = [count, total, minimum, maximum]
+
+    @staticmethod
+    def _update(window, stats, seconds):
+        name, start, key = window
+        window_start = datetime.fromtimestamp(start, timezone.utc)
+        merge, mean = {}, {}
+        for field, (count, total, minimum, maximum) in stats.items():
+            merge[f"{field}.count"] = {"$add": [{"$ifNull": [f"${field}.count", 0]}, count]}
+            merge[f"{field}.sum"] = {"$add": [{"$ifNull": [f"${field}.sum", 0]}, total]}
+            merge[f"{field}.min"] = {"$min": [{"$ifNull": [f"${field}.min", minimum]}, minimum]}
+            merge[f"{field}.max"] = {"$max": [{"$ifNull": [f"${field}.max", maximum]}, maximum]}
+            mean[f"{field}.mean"] = {"$divide": [f"${field}.sum", f"${field}.count"]}
+        merge["window_end"] = window_start + timedelta(seconds=seconds)
+        merge["updated_at"] = "$$NOW"
+        # Pipeline de atualização: soma ao que já existe e recalcula a média no servidor
+        return UpdateOne({"key": key, "window_start": window_start}, [{"$set": merge}, {"$set": mean}], upsert=True)
+
+    def flush(self, closed_only=True):
+        taken = self._take(closed_only)
+        if not taken:
+            return 0
+        by_collection = {}
+        for window, stats in taken.items():
+            by_collection.setdefault(window[0], {})[window] = stats
+        flushed = 0
+        for name, windows in by_collection.items():
+            ordered_windows = list(windows.items())
+            requests = [self._update(window, stats, self.windows[name]) for window, stats in ordered_windows]
+            try:
+                self.database[self.collection_prefix + name].bulk_write(requests, ordered=False)
+            except pymongo.errors.BulkWriteError as e:
+                # Só as operações com erro voltam ao estado; as demais já foram aplicadas
+                failed = {error["index"] for error in (e.details or {}).get("writeErrors", [])}
+                self._merge_back({ordered_windows[i][0]: ordered_windows[i][1] for i in failed})
+                flushed += len(windows) - len(failed)
+                continue
+            except pymongo.errors.PyMongoError as e:
+                print(f"Falha ao gravar rollups de '{name}' ({e}); tentando novamente no próximo ciclo.")
+                self._merge_back(windows)
+                continue
+            flushed += len(windows)
+        self.flushed_windows += flushed
+        return flushed
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush(closed_only=True)
+
+    def close(self):
+        """Descarrega inclusive as janelas abertas: a gravação aditiva as completa na próxima execução."""
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+        self.flush(closed_only=False)
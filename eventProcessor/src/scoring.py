@@ -0,0 +1,160 @@
+import hashlib
+import importlib
+import io
+import os
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+
+from logs import get_logger
+from stage_timings import timer
+
+# Campos do evento usados como features do modelo de irrigação (FarmTechML), na ordem do treino
+FEATURE_SOURCES = (
+    ("umidade_solo", ("humidity",)),
+    ("temperatura", ("temperature", "temperature_C")),
+    ("nutrientes_N", ("nutrientes_N", "nitrogen")),
+)
+STATUS = {0: "NÃO IRRIGAR", 1: "IRRIGAR"}
+
+log = get_logger("scoring")
+
+
+def import_forest_class(module_path):
+    """Importa FlorestaCompilada do FarmTechML (só depende do NumPy)."""
+    module_path = os.path.abspath(module_path)
+    if module_path not in sys.path:
+        sys.path.append(module_path)
+    return importlib.import_module("floresta_compilada").FlorestaCompilada
+
+
+class BatchScorer:
+    """Avalia o modelo de irrigação em lotes de eventos, antes da gravação no MongoDB.
+
+    `score(batch)` é chamado pelo buffer de gravação com o lote já formado (até
+    MONGO_BATCH_SIZE documentos ou MONGO_FLUSH_INTERVAL_MS), então a previsão é uma única
+    chamada vetorizada por lote e sai no mesmo documento do evento, junto com a versão do modelo
+    (nome do arquivo e sha256 do conteúdo). O arquivo é verificado a cada `reload_interval`
+    segundos e recarregado quando é substituído por um conteúdo diferente.
+    """
+
+    def __init__(self, model_path, module_path, default_nutrients=150.0, field="irrigation", reload_interval=5,
+                 track_latency=True):
+        self.model_path = model_path
+        self.track_latency = track_latency # Latência recebimento -> decisão; sem sentido ao reprocessar eventos antigos
+        self.forest_class = import_forest_class(module_path)
+        self.default_nutrients = default_nutrients # Os sensores atuais não medem nitrogênio
+        self.field = field
+        self.reload_interval = reload_interval
+        self._lock = threading.Lock()
+        self._stat = None
+        self._sha256 = None
+        self._model, self._version = self._load()
+        self._checked = time.monotonic()
+        self.scored = 0
+        self.skipped = 0
+        self.failed = 0
+        self.reloads = 0
+        self._latency_total = 0.0
+        self._latency_max = 0.0
+
+    def _artifact_stat(self):
+        """Identifica a troca do arquivo sem lê-lo: o os.replace do treino cria um novo inode."""
+        stat = os.stat(self.model_path)
+        return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+    def _load(self):
+        """Carrega o modelo dos mesmos bytes usados no hash; a versão é o nome do arquivo e o sha256 do conteúdo."""
+        stat = self._artifact_stat()
+        with open(self.model_path, "rb") as f:
+            data = f.read()
+        sha256 = hashlib.sha256(data).hexdigest()
+        self._stat = stat
+        if sha256 == self._sha256:
+            return self._model, self._version # Mesmo conteúdo (arquivo regravado ou tocado): nada a recarregar
+        started = time.perf_counter_ns()
+        model = self.forest_class.carregar(io.BytesIO(data))
+        timer.record("model_load", time.perf_counter_ns() - started)
+        version = f"{os.path.basename(self.model_path)}@{sha256[:12]}"
+        self._sha256 = sha256
+        print(f"Modelo de irrigação carregado: {version} ({len(model.raizes)} árvores).")
+        return model, version
+
+    def _maybe_reload(self):
+        now = time.monotonic()
+        if now - self._checked < self.reload_interval:
+            return
+        self._checked = now
+        try:
+            if self._artifact_stat() != self._stat:
+                previous = self._version
+                self._model, self._version = self._load() # O treino publica o .npz com os.replace: arquivo sempre completo
+                if self._version != previous:
+                    self.reloads += 1
+        except Exception as e:
+            log.warning("Falha ao recarregar o modelo (%s); mantendo %s.", e, self._version)
+
+    def _features(self, doc):
+        row = []
+        for feature, sources in FEATURE_SOURCES:
+            value = next((doc[field] for field in sources if isinstance(doc.get(field), (int, float))), None)
+            if value is None:
+                if feature != "nutrientes_N":
+                    return None
+                value = self.default_nutrients
+            row.append(value)
+        return row
+
+    def score(self, batch):
+        """Acrescenta a previsão aos documentos com umidade e temperatura; devolve o próprio lote."""
+        started = time.perf_counter_ns()
+        try:
+            with self._lock: # O buffer síncrono e o executor do modo assíncrono podem chamar de threads diferentes
+                self._maybe_reload()
+                model, version = self._model, self._version
+            indexes, rows = [], []
+            for index, doc in enumerate(batch):
+                row = self._features(doc)
+                if row is not None:
+                    indexes.append(index)
+                    rows.append(row)
+            self.skipped += len(batch) - len(rows)
+            if not rows:
+                return batch
+            proba = model.predict_proba(np.array(rows, dtype=np.float64))
+            actions = model.classes_.take(np.argmax(proba, axis=1))
+            scored_at = datetime.now(timezone.utc)
+            for index, action, row_proba in zip(indexes, actions.tolist(), proba.max(axis=1).tolist()):
+                doc = batch[index]
+                doc[self.field] = {
+                    "action": action,
+                    "status": STATUS.get(action, str(action)),
+                    "probability": round(row_proba, 4),
+                    "model": version,
+                    "scored_at": scored_at,
+                }
+                received_at = doc.get("received_at") if self.track_latency else None
+                if received_at is not None:
+                    latency = (scored_at - received_at).total_seconds()
+                    self._latency_total += latency
+                    if latency > self._latency_max:
+                        self._latency_max = latency
+            self.scored += len(rows)
+        except Exception as e:
+            # Sem previsão o evento ainda é gravado: a pontuação nunca descarta leituras
+            self.failed += len(batch)
+            log.error("Erro ao avaliar lote de %d evento(s) com o modelo: %s", len(batch), e)
+        finally:
+            timer.record("score", time.perf_counter_ns() - started, len(batch))
+        return batch
+
+    def stats(self):
+        average = self._latency_total / self.scored * 1000 if self.scored else 0.0
+        return {
+            "scored": self.scored, "skipped": self.skipped, "failed": self.failed, "reloads": self.reloads,
+            "model": self._version, "decision_latency_avg_ms": round(average, 2),
+            "decision_latency_max_ms": round(self._latency_max * 1000, 2),
+        }
@@ -0,0 +1,383 @@
+import json
+import os
+import struct
+import threading
+import time
+import zlib
+
+import bson
+import pymongo
+
+from dedup import count_write_errors
+from logs import get_logger
+
+log = get_logger("spool")
+
+_RECORD_HEADER = struct.Struct(">II") # tamanho do documento BSON, crc32
+_SEGMENT_PREFIX = "segment-"
+_SEGMENT_SUFFIX = ".log"
+
+
+def list_segments(directory):
+    """Números de sequência dos segmentos do diretório, em ordem de gravação."""
+    segments = []
+    for name in os.listdir(directory):
+        if name.startswith(_SEGMENT_PREFIX) and name.endswith(_SEGMENT_SUFFIX):
+            segments.append(int(name[len(_SEGMENT_PREFIX):-len(_SEGMENT_SUFFIX)]))
+    return sorted(segments)
+
+
+def segment_path(directory, seq):
+    return os.path.join(directory, f"{_SEGMENT_PREFIX}{seq:012d}{_SEGMENT_SUFFIX}")
+
+
+def iter_segment(path, offset=0, on_corrupt=None):
+    """Gera (offset após o registro, documento) de um segmento; registros com crc inválido são pulados."""
+    with open(path, "rb") as f:
+        f.seek(offset)
+        while True:
+            header = f.read(_RECORD_HEADER.size)
+            if len(header) < _RECORD_HEADER.size:
+                return # Fim do segmento (ou cabeçalho incompleto de uma escrita interrompida)
+            length, crc = _RECORD_HEADER.unpack(header)
+            data = f.read(length)
+            if len(data) < length:
+                return
+            offset += _RECORD_HEADER.size + length
+            if zlib.crc32(data) != crc:
+                if on_corrupt is not None:
+                    on_corrupt()
+                continue
+            yield offset, bson.decode(data)
+
+
+class DiskSpool:
+    """Spool local somente-anexação, dividido em segmentos, para quando o MongoDB está indisponível.
+
+    Cada registro é um documento BSON (com `_id` já atribuído) precedido de tamanho e crc32.
+    O fsync é feito em lote: a cada `fsync_batch` registros ou `fsync_interval_ms` milissegundos.
+    Ao exceder `max_bytes`, o segmento mais antigo é descartado e contabilizado nas métricas.
+    """
+
+    def __init__(self, directory="spool", segment_bytes=16 * 1024 * 1024, max_bytes=1024 * 1024 * 1024,
+                 fsync_batch=1000, fsync_interval_ms=500):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self.fsync_batch = fsync_batch
+        self.fsync_interval = fsync_interval_ms / 1000.0
+        self.active = False # True enquanto o armazenamento está indisponível: as gravações vão para o spool
+        self._lock = threading.Lock()
+        self._checkpoint_path = os.path.join(directory, "checkpoint")
+        os.makedirs(directory, exist_ok=True)
+        self._segments = self._list_segments()
+        self._checkpoint = self._load_checkpoint()
+        self._file = None
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+        self.metrics = {
+            "appended_records": 0, "appended_bytes": 0, "replayed_records": 0, "duplicate_records": 0,
+            "rejected_records": 0, "dropped_records": 0, "dropped_bytes": 0, "corrupt_records": 0, "fsyncs": 0,
+        }
+        if self._segments:
+            self.active = True # Há dados de uma execução anterior: drena antes de voltar a gravar direto
+
+    # --- segmentos e checkpoint ---
+
+    def _segment_path(self, seq):
+        return segment_path(self.directory, seq)
+
+    def _list_segments(self):
+        return list_segments(self.directory)
+
+    def _load_checkpoint(self):
+        try:
+            with open(self._checkpoint_path) as f:
+                data = json.load(f)
+            return data["segment"], data["offset"]
+        except (FileNotFoundError, ValueError, KeyError):
+            return None, 0
+
+    def _save_checkpoint(self, seq, offset):
+        tmp_path = self._checkpoint_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"segment": seq, "offset": offset}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self._checkpoint_path) # Troca atômica: nunca há checkpoint pela metade
+        self._checkpoint = (seq, offset)
+
+    def _open_new_segment(self):
+        seq = (self._segments[-1] + 1) if self._segments else 1
+        self._segments.append(seq)
+        self._file = open(self._segment_path(seq), "ab")
+
+    def _close_active(self):
+        if self._file is not None:
+            self._sync()
+            self._file.close()
+            self._file = None
+
+    def _sync(self):
+        if self._file is not None and self._unsynced:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self.metrics["fsyncs"] += 1
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def _size_bytes(self):
+        total = 0
+        for seq in self._segments:
+            try:
+                total += os.path.getsize(self._segment_path(seq))
+            except FileNotFoundError:
+                pass
+        return total
+
+    def _enforce_limit(self):
+        # Descarta os segmentos mais antigos (exceto o ativo) até caber em max_bytes
+        while len(self._segments) > 1 and self._size_bytes() > self.max_bytes:
+            seq = self._segments.pop(0)
+            path = self._segment_path(seq)
+            start = self._checkpoint[1] if self._checkpoint[0] == seq else 0
+            records = sum(1 for _ in self._iter_records(path, start))
+            self.metrics["dropped_records"] += records
+            self.metrics["dropped_bytes"] += os.path.getsize(path) - start
+            os.remove(path)
+            print(f"Spool cheio: segmento {seq} descartado ({records} registro(s)).")
+
+    # --- escrita ---
+
+    def append(self, docs):
+        """Anexa documentos ao segmento ativo. Os documentos devem já ter `_id` para que a reprodução seja idempotente."""
+        with self._lock:
+            if self._file is None:
+                self._open_new_segment()
+            for doc in docs:
+                if "_id" not in doc:
+                    doc["_id"] = bson.ObjectId()
+                data = bson.encode(doc)
+                self._file.write(_RECORD_HEADER.pack(len(data), zlib.crc32(data)) + data)
+                self.metrics["appended_records"] += 1
+                self.metrics["appended_bytes"] += _RECORD_HEADER.size + len(data)
+                self._unsynced += 1
+            if self._unsynced >= self.fsync_batch or time.monotonic() - self._last_sync >= self.fsync_interval:
+                self._sync()
+            if self._file.tell() >= self.segment_bytes:
+                self._close_active()
+            self._enforce_limit()
+
+    def sync_if_due(self):
+        with self._lock:
+            if self._unsynced and time.monotonic() - self._last_sync >= self.fsync_interval:
+                self._sync()
+
+    def is_empty(self):
+        with self._lock:
+            return not self._segments
+
+    def activate(self):
+        self.active = True
+
+    def deactivate(self):
+        """Volta a gravar direto no MongoDB; o que ainda estiver no segmento ativo é selado para reprodução."""
+        with self._lock:
+            self._close_active()
+            self.active = False
+
+    # --- leitura / reprodução ---
+
+    def _count_corrupt(self):
+        self.metrics["corrupt_records"] += 1
+
+    def _iter_records(self, path, offset):
+        return iter_segment(path, offset, self._count_corrupt)
+
+    def seal(self):
+        """Fecha o segmento ativo para que ele possa ser reproduzido."""
+        with self._lock:
+            self._close_active()
+
+    def sealed_segments(self):
+        with self._lock:
+            if self._file is not None:
+                return list(self._segments[:-1])
+            return list(self._segments)
+
+    def read_batches(self, seq, batch_size):
+        """Gera lotes (offset_final, documentos) de um segmento selado a partir do checkpoint."""
+        start = self._checkpoint[1] if self._checkpoint[0] == seq else 0
+        batch, end = [], start
+        try:
+            for end, doc in self._iter_records(self._segment_path(seq), start):
+                batch.append(doc)
+                if len(batch) >= batch_size:
+                    yield end, batch
+                    batch = []
+        except FileNotFoundError:
+            return # Segmento descartado pelo limite de tamanho durante a reprodução
+        if batch:
+            yield end, batch
+
+    def commit(self, seq, offset):
+        with self._lock:
+            self._save_checkpoint(seq, offset)
+
+    def finish_segment(self, seq):
+        with self._lock:
+            if seq in self._segments:
+                self._segments.remove(seq)
+            try:
+                os.remove(self._segment_path(seq))
+            except FileNotFoundError:
+                pass
+            self._save_checkpoint(None, 0)
+
+    def snapshot(self):
+        """Métricas do spool, incluindo tamanho atual em disco."""
+        with self._lock:
+            metrics = dict(self.metrics)
+            metrics["segments"] = len(self._segments)
+            metrics["size_bytes"] = self._size_bytes()
+            metrics["active"] = self.active
+        return metrics
+
+    def close(self):
+        with self._lock:
+            self._close_active()
+
+
+class SpoolReplayer:
+    """Thread que verifica a saúde do MongoDB e drena o spool em lotes grandes quando ele volta."""
+
+    def __init__(self, spool, collection, ping, batch_size=5000, interval=5, prepare=None, time_field=None):
+        self.spool = spool
+        self.prepare = prepare # Executado uma vez quando o MongoDB fica disponível (ex.: criar coleção e índices)
+        # Coleções sem índice único de _id (time-series): os _id já gravados são procurados antes de cada lote,
+        # no intervalo deste campo de tempo
+        self.time_field = time_field
+        self.collection = collection
+        self.ping = ping
+        self.batch_size = batch_size
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="spool-replayer", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _healthy(self):
+        try:
+            self.ping()
+            return True
+        except Exception:
+            return False
+
+    def _insert(self, docs):
+        """Grava um lote; só uma queda do MongoDB (ConnectionFailure) interrompe a reprodução.
+
+        Documentos rejeitados de forma permanente (validação, tamanho) são contados em
+        `rejected_records` e descartados: repeti-los travaria o spool no mesmo lote para sempre.
+        """
+        pending = self._without_existing(docs) if self.time_field is not None else docs
+        try:
+            if pending:
+                self.collection.insert_many(pending, ordered=False)
+        except pymongo.errors.BulkWriteError as e:
+            # Documento já gravado antes da queda (mesmo _id): não duplica
+            duplicates, rejected = count_write_errors(e.details or {})
+            self.spool.metrics["duplicate_records"] += duplicates
+            self._reject(rejected, e)
+        except pymongo.errors.ConnectionFailure:
+            raise
+        except Exception as e:
+            # Erro no lote inteiro que não é de rede (ex.: documento maior que o limite do BSON):
+            # grava um a um para descartar só os documentos com problema
+            if len(docs) == 1:
+                self._reject(1, e)
+            else:
+                for doc in pending:
+                    self._insert_single(doc)
+        self.spool.metrics["replayed_records"] += len(docs)
+
+    def _without_existing(self, docs):
+        """Tira do lote os documentos cujo _id já está na coleção, que sem índice único seriam gravados de novo.
+
+        A busca é limitada ao intervalo de tempo do lote para o MongoDB descartar os buckets fora dele.
+        """
+        ids = [doc["_id"] for doc in docs if "_id" in doc]
+        if not ids:
+            return docs
+        query = {"_id": {"$in": ids}}
+        times = [doc[self.time_field] for doc in docs if self.time_field in doc]
+        if len(times) == len(docs):
+            query[self.time_field] = {"$gte": min(times), "$lte": max(times)}
+        try:
+            existing = {doc["_id"] for doc in self.collection.find(query, {"_id": 1})}
+        except pymongo.errors.ConnectionFailure:
+            raise
+        except pymongo.errors.PyMongoError as e:
+            log.warning("Reprodução do spool: não foi possível verificar os _id já gravados; gravando o lote todo: %s",
+                        e)
+            return docs
+        if not existing:
+            return docs
+        self.spool.metrics["duplicate_records"] += len(existing)
+        return [doc for doc in docs if doc.get("_id") not in existing]
+
+    def _insert_single(self, doc):
+        try:
+            self.collection.insert_one(doc)
+        except pymongo.errors.DuplicateKeyError:
+            self.spool.metrics["duplicate_records"] += 1
+        except pymongo.errors.ConnectionFailure:
+            raise
+        except Exception as e:
+            self._reject(1, e)
+
+    def _reject(self, count, error):
+        if count:
+            self.spool.metrics["rejected_records"] += count
+            log.warning("Reprodução do spool: %d documento(s) rejeitado(s) pelo MongoDB e descartado(s): %s",
+                        count, error)
+
+    def drain(self):
+        """Reproduz todos os segmentos selados; devolve False se o MongoDB falhar no meio."""
+        self.spool.seal()
+        for seq in self.spool.sealed_segments():
+            for offset, docs in self.spool.read_batches(seq, self.batch_size):
+                try:
+                    self._insert(docs)
+                except pymongo.errors.ConnectionFailure as e:
+                    print(f"Reprodução do spool interrompida no segmento {seq}: {e}")
+                    return False
+                self.spool.commit(seq, offset)
+            self.spool.finish_segment(seq)
+        return True
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.spool.sync_if_due()
+            if not self.spool.active and self.spool.is_empty():
+                continue
+            if not self._healthy():
+                continue
+            if self.prepare is not None:
+                try:
+                    self.prepare()
+                    self.prepare = None
+                except Exception as e:
+                    print(f"Falha ao preparar o armazenamento: {e}")
+                    continue
+            print(f"MongoDB disponível: drenando spool ({self.spool.snapshot()['size_bytes']} bytes)...")
+            if self.drain():
+                self.spool.deactivate() # Novas gravações voltam direto ao MongoDB
+                self.drain()            # Reproduz o que chegou ao spool durante a drenagem
+                print(f"Spool drenado; gravando direto no MongoDB. Métricas: {self.spool.snapshot()}")
+
+    def close(self):
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
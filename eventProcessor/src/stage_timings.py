@@ -0,0 +1,97 @@
+import bisect
+import threading
+import time
+from datetime import datetime, timezone
+
+# Limites superiores (ns) dos baldes do histograma de cada estágio: 1 µs a 10 s
+BUCKETS_NS = (1_000, 5_000, 10_000, 50_000, 100_000, 500_000, 1_000_000, 5_000_000, 10_000_000, 50_000_000,
+              100_000_000, 500_000_000, 1_000_000_000, 10_000_000_000)
+
+
+class StageTimer:
+    """Acumula o tempo gasto em cada estágio do processamento (decodificar, validar, gravar...).
+
+    Cada thread acumula em seu próprio dicionário, então o caminho quente não disputa lock;
+    `snapshot` soma os acumuladores de todas as threads. Cada chamada de `record` também
+    conta no histograma do estágio (duração da chamada, que nos estágios em lote cobre o lote).
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._all = []
+        self._lock = threading.Lock()
+
+    def _stages(self):
+        stages = getattr(self._local, "stages", None)
+        if stages is None:
+            stages = self._local.stages = {}
+            with self._lock:
+                self._all.append(stages)
+        return stages
+
+    def record(self, stage, elapsed_ns, count=1):
+        stages = self._stages()
+        totals = stages.get(stage)
+        if totals is None:
+            totals = stages[stage] = [count, elapsed_ns, elapsed_ns, 0, [0] * (len(BUCKETS_NS) + 1)]
+        else:
+            totals[0] += count
+            totals[1] += elapsed_ns
+            if elapsed_ns > totals[2]:
+                totals[2] = elapsed_ns
+        totals[3] += 1
+        totals[4][bisect.bisect_left(BUCKETS_NS, elapsed_ns)] += 1
+
+    def record_since(self, stage, started_at, count=1):
+        """Registra o tempo de relógio desde `started_at` (datetime com fuso, ex.: o `received_at` de um evento)."""
+        if isinstance(started_at, datetime):
+            elapsed = datetime.now(timezone.utc) - started_at
+            self.record(stage, max(0, int(elapsed.total_seconds() * 1e9)), count)
+
+    def snapshot(self):
+        """Devolve {estágio: (quantidade, total_ns, máximo_ns)}."""
+        merged = {}
+        with self._lock:
+            accumulators = list(self._all)
+        for stages in accumulators:
+            for stage, (count, total, maximum, _, _) in list(stages.items()):
+                current = merged.get(stage, (0, 0, 0))
+                merged[stage] = (current[0] + count, current[1] + total, max(current[2], maximum))
+        return merged
+
+    def histograms(self):
+        """Devolve {estágio: (chamadas, total_ns, contagem por balde de BUCKETS_NS + o balde acima do último)}."""
+        merged = {}
+        with self._lock:
+            accumulators = list(self._all)
+        for stages in accumulators:
+            for stage, (_, total, _, calls, buckets) in list(stages.items()):
+                current = merged.get(stage)
+                if current is None:
+                    merged[stage] = (calls, total, list(buckets))
+                else:
+                    merged[stage] = (current[0] + calls, current[1] + total,
+                                     [a + b for a, b in zip(current[2], buckets)])
+        return merged
+
+    def report(self):
+        lines = []
+        for stage, (count, total, maximum) in sorted(self.snapshot().items()):
+            average_us = total / count / 1000 if count else 0.0
+            lines.append(f"{stage}: n={count} média={average_us:.1f}µs máx={maximum / 1000:.1f}µs")
+        return " | ".join(lines)
+
+    def start_reporter(self, interval):
+        """Imprime o relatório de tempos a cada `interval` segundos (0 desativa)."""
+        if interval <= 0:
+            return
+
+        def run():
+            while True:
+                time.sleep(interval)
+                print(f"Tempos por estágio: {self.report()}")
+
+        threading.Thread(target=run, name="stage-timings", daemon=True).start()
+
+
+timer = StageTimer()
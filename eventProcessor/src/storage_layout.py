@@ -0,0 +1,97 @@
+from datetime import datetime, timezone
+
+import pymongo
+
+LAYOUT_FLAT = "flat"             # Um documento plano por leitura (formato original)
+LAYOUT_TIMESERIES = "timeseries" # Coleção time-series do MongoDB: campo de tempo `ts`, metadados em `meta`
+LAYOUTS = (LAYOUT_FLAT, LAYOUT_TIMESERIES)
+
+TIME_FIELD = "ts"
+META_FIELD = "meta"
+# Campos que identificam a origem da leitura e vão para `meta` no layout time-series
+_META_SOURCES = (("deviceId", "device"), ("city", "city"), ("topic", "topic"))
+
+FLAT_INDEXES = (
+    [("deviceId", pymongo.ASCENDING), ("timestamp", pymongo.ASCENDING)],
+    [("city", pymongo.ASCENDING), ("timestamp", pymongo.ASCENDING)],
+    [("received_at", pymongo.ASCENDING), ("_id", pymongo.ASCENDING)], # Leitura em ordem de tempo (API, replay.py)
+    [("deviceId", pymongo.ASCENDING), ("received_at", pymongo.ASCENDING)], # Último evento e páginas por dispositivo
+)
+TIMESERIES_INDEXES = (
+    [(f"{META_FIELD}.device", pymongo.ASCENDING), (TIME_FIELD, pymongo.ASCENDING)],
+    [(f"{META_FIELD}.city", pymongo.ASCENDING), (TIME_FIELD, pymongo.ASCENDING)],
+)
+
+
+def parse_timestamp(value, fallback=None):
+    """Converte o timestamp ISO 8601 dos produtores para datetime UTC; usa `fallback` se não for possível."""
+    if isinstance(value, datetime):
+        return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+    if isinstance(value, str):
+        try:
+            parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+            return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+        except ValueError:
+            pass
+    return fallback
+
+
+def to_timeseries_document(doc):
+    """Reorganiza uma leitura plana no formato da coleção time-series (`ts` + `meta`)."""
+    shaped = dict(doc)
+    received_at = shaped.get("received_at") or datetime.now(timezone.utc)
+    shaped[TIME_FIELD] = parse_timestamp(shaped.pop("timestamp", None), received_at)
+    meta = {}
+    for source, target in _META_SOURCES:
+        if source in shaped:
+            meta[target] = shaped.pop(source)
+    shaped[META_FIELD] = meta
+    return shaped
+
+
+def shape_document(doc, layout):
+    if layout == LAYOUT_TIMESERIES:
+        return to_timeseries_document(doc)
+    return doc
+
+
+def event_time(doc):
+    """Instante da leitura em qualquer um dos layouts."""
+    if TIME_FIELD in doc:
+        return doc[TIME_FIELD]
+    return parse_timestamp(doc.get("timestamp"), doc.get("received_at"))
+
+
+def event_source(doc, field):
+    """Campo de origem (`deviceId`, `city`, `topic`) em qualquer um dos layouts."""
+    if field in doc:
+        return doc[field]
+    meta = doc.get(META_FIELD) or {}
+    for source, target in _META_SOURCES:
+        if source == field:
+            return meta.get(target)
+    return None
+
+
+def ensure_collection(database, name, layout, granularity="seconds"):
+    """Cria a coleção no layout pedido (se ainda não existir) e os índices compostos de consulta."""
+    if layout not in LAYOUTS:
+        raise ValueError(f"Layout de armazenamento inválido: {layout!r} (use um de {LAYOUTS})")
+    existing = {info["name"]: info for info in database.list_collections(filter={"name": name})}
+    if layout == LAYOUT_TIMESERIES:
+        if name not in existing:
+            database.create_collection(name, timeseries={
+                "timeField": TIME_FIELD, "metaField": META_FIELD, "granularity": granularity,
+            })
+            print(f"Coleção time-series '{name}' criada (granularidade: {granularity}).")
+        elif existing[name].get("type") != "timeseries":
+            raise RuntimeError(
+                f"A coleção '{name}' já existe e não é time-series. "
+                f"Migre os dados com migrate_events.py para uma nova coleção e aponte MONGO_COLLECTION para ela."
+            )
+    indexes = TIMESERIES_INDEXES if layout == LAYOUT_TIMESERIES else FLAT_INDEXES
+    collection = database[name]
+    for keys in indexes:
+        collection.create_index(keys)
+    print(f"Índices garantidos em '{name}': {[', '.join(field for field, _ in keys) for keys in indexes]}")
+    return collection
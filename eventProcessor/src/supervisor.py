@@ -0,0 +1,116 @@
+import multiprocessing
+import os
+import threading
+import time
+
+MQTT_TOPIC = os.getenv("MQTT_TOPIC", "sensor/data")
+PIPELINE_SPILL_PATH = os.getenv("PIPELINE_SPILL_PATH", "spill/ingest.spill")
+SPOOL_DIR = os.getenv("SPOOL_DIR", "spool")
+CONSUMER_WORKERS = int(os.getenv("CONSUMER_WORKERS", os.cpu_count() or 2)) # Processos consumidores
+MQTT_SHARE_GROUP = os.getenv("MQTT_SHARE_GROUP", "farmtech") # Grupo da subscrição compartilhada
+# shared: $share/<grupo>/<tópico> (Mosquitto, EMQX, HiveMQ)
+# partition: todos os processos assinam o tópico e cada um fica com crc32(payload) % N (RabbitMQ, que não suporta $share)
+MQTT_SUBSCRIPTION_STRATEGY = os.getenv("MQTT_SUBSCRIPTION_STRATEGY", "shared")
+SUPERVISOR_REPORT_INTERVAL = int(os.getenv("SUPERVISOR_REPORT_INTERVAL", 5)) # Segundos entre relatórios de vazão
+SUPERVISOR_MAX_RESTART_DELAY = int(os.getenv("SUPERVISOR_MAX_RESTART_DELAY", 30)) # Teto do backoff de reinício
+METRICS_PORT = int(os.getenv("METRICS_PORT", 9464)) # O worker N expõe /metrics na porta METRICS_PORT + 1 + N
+PROFILER_OUTPUT = os.getenv("PROFILER_OUTPUT", "profile.folded")
+
+
+def worker_environment(index, count):
+    """Variáveis de ambiente que direcionam um processo consumidor para a sua fatia do tópico."""
+    root, ext = os.path.splitext(PIPELINE_SPILL_PATH)
+    environment = {"PIPELINE_SPILL_PATH": f"{root}-{index}{ext}"} # Cada processo com seu arquivo de transbordo
+    # e seu diretório de spool: segmentos e checkpoint têm um único escritor
+    environment["SPOOL_DIR"] = f"{SPOOL_DIR.rstrip('/')}-{index}"
+    root, ext = os.path.splitext(PROFILER_OUTPUT)
+    environment["PROFILER_OUTPUT"] = f"{root}-{index}{ext}"
+    environment["METRICS_PORT"] = str(METRICS_PORT + 1 + index if METRICS_PORT > 0 else 0)
+    if MQTT_SUBSCRIPTION_STRATEGY == "partition":
+        environment.update({
+            "MQTT_TOPIC": MQTT_TOPIC,
+            "CONSUMER_PARTITION_INDEX": str(index),
+            "CONSUMER_PARTITION_COUNT": str(count),
+        })
+    else:
+        environment["MQTT_TOPIC"] = f"$share/{MQTT_SHARE_GROUP}/{MQTT_TOPIC}"
+    return environment
+
+
+def _publish_progress(consumer, index, processed):
+    # Copia o contador local do pipeline para a memória compartilhada, fora do caminho quente
+    while True:
+        time.sleep(1)
+        if consumer.ingest_pipeline is not None:
+            processed[index] = consumer.ingest_pipeline.counters["processed"]
+
+
+def _worker_entry(index, environment, processed):
+    os.environ.update(environment)
+    os.environ["CONSUMER_MODE"] = "sync"
+    import consumer # Importado após ajustar o ambiente: o consumidor lê a configuração na importação
+
+    threading.Thread(target=_publish_progress, args=(consumer, index, processed), daemon=True).start()
+    print(f"[worker {index}] PID {os.getpid()} assinando '{consumer.MQTT_TOPIC}'")
+    consumer.main()
+
+
+def main():
+    count = max(1, CONSUMER_WORKERS)
+    context = multiprocessing.get_context("spawn") # Processos limpos: sem threads nem conexões herdadas
+    processed = context.Array("Q", count, lock=False) # Um escritor por posição
+    carried = [0] * count   # Mensagens processadas por encarnações anteriores de cada worker
+    restarts = [0] * count
+    next_start = [0.0] * count
+    workers = [None] * count
+
+    def spawn(index):
+        process = context.Process(
+            target=_worker_entry,
+            args=(index, worker_environment(index, count), processed),
+            name=f"consumer-worker-{index}",
+        )
+        process.start()
+        workers[index] = process
+
+    print(f"Iniciando {count} processo(s) consumidor(es), estratégia '{MQTT_SUBSCRIPTION_STRATEGY}'...")
+    for index in range(count):
+        spawn(index)
+
+    last_total, last_report = 0, time.monotonic()
+    try:
+        while True:
+            time.sleep(1)
+            now = time.monotonic()
+            for index, process in enumerate(workers):
+                if process.is_alive():
+                    continue
+                if next_start[index] == 0.0:
+                    # Worker caiu: guarda o que já processou e agenda o reinício com backoff exponencial
+                    carried[index] += processed[index]
+                    processed[index] = 0
+                    restarts[index] += 1
+                    delay = min(2 ** (restarts[index] - 1), SUPERVISOR_MAX_RESTART_DELAY)
+                    next_start[index] = now + delay
+                    print(f"[supervisor] worker {index} terminou (código {process.exitcode}); reiniciando em {delay}s")
+                elif now >= next_start[index]:
+                    next_start[index] = 0.0
+                    spawn(index)
+
+            if now - last_report >= SUPERVISOR_REPORT_INTERVAL:
+                per_worker = [carried[i] + processed[i] for i in range(count)]
+                total = sum(per_worker)
+                rate = (total - last_total) / (now - last_report)
+                print(f"[supervisor] vazão combinada: {rate:.0f} msg/s | total={total} | "
+                      f"por worker={per_worker} | reinícios={restarts}")
+                last_total, last_report = total, now
+    except KeyboardInterrupt:
+        print("[supervisor] Encerrando workers...")
+    finally:
+        # Os workers recebem o mesmo SIGINT do terminal e executam sua própria limpeza
+        for process in workers:
+            if process is not None:
+                process.join(timeout=30)
+                if process.is_alive():
+                    process.terminate()
+        print(f"[supervisor] Total processado: {sum(carried) + sum(processed)} mensagens.")
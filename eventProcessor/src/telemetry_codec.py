@@ -0,0 +1,114 @@
+"""Formato binário compacto e versionado para leituras de sensores.
+
+Cabeçalho comum: b"FT" + versão (u8) + tipo (u8). Os valores com casas decimais são
+gravados como inteiros escalados (exatos para a precisão que os produtores usam) e os
+documentos decodificados têm os mesmos campos do JSON equivalente.
+"""
+import struct
+import time
+from datetime import datetime
+from functools import lru_cache
+
+MAGIC = b"FT"
+VERSION = 1
+CONTENT_TYPE = "application/vnd.farmtech.telemetry.v1" # Propriedade Content-Type do MQTT v5
+BINARY_TOPIC_SUFFIX = "/bin" # Alternativa à detecção pelos bytes mágicos
+
+KIND_FIRMWARE = 1 # FarmTechIOT/src/main.cpp: timestamp, humidity, temperature_C
+KIND_WEATHER = 2  # producer.py: generate_random_weather_data
+KIND_IOT_HUB = 3  # producer_IoT.py: deviceId, messageId, temperature, humidity
+
+WIND_DIRECTIONS = ["N", "NE", "E", "SE", "S", "SW", "W", "NW"]
+_WIND_INDEX = {direction: index for index, direction in enumerate(WIND_DIRECTIONS)}
+
+_HEADER = struct.Struct("<2sBB")
+# timestamp (ms), humidity x100, temperature x100
+_FIRMWARE = struct.Struct("<2sBBqHh")
+# timestamp (ms), temperature x10, humidity, windSpeed x10, windDirection, precipitation x10, pressure, len(city)
+_WEATHER = struct.Struct("<2sBBqhBHBHHB")
+# messageId, temperature x10, humidity x10, len(deviceId)
+_IOT_HUB = struct.Struct("<2sBBIhHB")
+
+
+class TelemetryCodecError(ValueError):
+    """Payload binário com cabeçalho, versão ou tamanho inválido."""
+
+
+def _timestamp_ms(value):
+    return int(datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp() * 1000)
+
+
+@lru_cache(maxsize=4096)
+def _iso_seconds(seconds):
+    # Muitos dispositivos publicam no mesmo segundo: o texto ISO é formatado uma vez por segundo
+    return "%04d-%02d-%02dT%02d:%02d:%02d+00:00" % time.gmtime(seconds)[:6]
+
+
+def _timestamp_iso(value_ms):
+    return _iso_seconds(value_ms // 1000)
+
+
+def encode_firmware(reading):
+    return _FIRMWARE.pack(MAGIC, VERSION, KIND_FIRMWARE, _timestamp_ms(reading["timestamp"]),
+                          round(reading["humidity"] * 100), round(reading["temperature_C"] * 100))
+
+
+def encode_weather(reading):
+    city = reading["city"].encode()
+    return _WEATHER.pack(MAGIC, VERSION, KIND_WEATHER, _timestamp_ms(reading["timestamp"]),
+                         round(reading["temperature"] * 10), reading["humidity"], round(reading["windSpeed"] * 10),
+                         _WIND_INDEX[reading["windDirection"]], round(reading["precipitation"] * 10),
+                         reading["pressure"], len(city)) + city
+
+
+def encode_iot_hub(reading):
+    device_id = reading["deviceId"].encode()
+    return _IOT_HUB.pack(MAGIC, VERSION, KIND_IOT_HUB, reading["messageId"], round(reading["temperature"] * 10),
+                         round(reading["humidity"] * 10), len(device_id)) + device_id
+
+
+def encode(reading):
+    """Escolhe o tipo de registro pelo campo exclusivo de cada formato."""
+    if "temperature_C" in reading:
+        return encode_firmware(reading)
+    if "city" in reading:
+        return encode_weather(reading)
+    if "deviceId" in reading:
+        return encode_iot_hub(reading)
+    raise TelemetryCodecError("formato de leitura sem codificação binária")
+
+
+def is_binary(topic, payload):
+    return payload[:2] == MAGIC or topic.endswith(BINARY_TOPIC_SUFFIX)
+
+
+def decode(payload):
+    if len(payload) < _HEADER.size:
+        raise TelemetryCodecError("payload binário menor que o cabeçalho")
+    magic, version, kind = _HEADER.unpack_from(payload)
+    if magic != MAGIC:
+        raise TelemetryCodecError("bytes mágicos inválidos")
+    if version != VERSION:
+        raise TelemetryCodecError(f"versão {version} não suportada")
+    try:
+        if kind == KIND_FIRMWARE:
+            _, _, _, ts, humidity, temperature = _FIRMWARE.unpack_from(payload)
+            return {"timestamp": _timestamp_iso(ts), "humidity": humidity / 100, "temperature_C": temperature / 100}
+        if kind == KIND_WEATHER:
+            (_, _, _, ts, temperature, humidity, wind_speed, wind_direction,
+             precipitation, pressure, city_len) = _WEATHER.unpack_from(payload)
+            city = bytes(payload[_WEATHER.size:_WEATHER.size + city_len]).decode()
+            timestamp = _timestamp_iso(ts)
+            return {
+                "timestamp": timestamp, "city": city, "date": timestamp[:10], "temperature": temperature / 10,
+                "humidity": humidity, "windSpeed": wind_speed / 10, "windDirection": WIND_DIRECTIONS[wind_direction],
+                "precipitation": precipitation / 10, "pressure": pressure,
+            }
+        if kind == KIND_IOT_HUB:
+            _, _, _, message_id, temperature, humidity, device_len = _IOT_HUB.unpack_from(payload)
+            device_id = bytes(payload[_IOT_HUB.size:_IOT_HUB.size + device_len]).decode()
+            return {"deviceId": device_id, "messageId": message_id,
+                    "temperature": temperature / 10, "humidity": humidity / 10}
+    except (struct.error, IndexError, UnicodeDecodeError) as e:
+        raise TelemetryCodecError(f"registro binário truncado ou inválido: {e}") from None
+    raise TelemetryCodecError(f"tipo de registro {kind} desconhecido")
@@ -0,0 +1,201 @@
+import threading
+import time
+
+import pymongo
+
+from dedup import count_write_errors, inserted_documents
+from logs import get_logger
+from stage_timings import timer
+
+log = get_logger("write_buffer")
+
+
+class MongoWriteBuffer:
+    """Buffer write-behind: acumula documentos e grava em lote com insert_many não ordenado.
+
+    O lote é descarregado quando atinge `batch_size` documentos ou a cada
+    `flush_interval_ms` milissegundos, sempre fora da thread de rede do paho.
+    Com um `spool` configurado, os lotes vão para o disco enquanto o MongoDB estiver indisponível.
+    `before_write(batch)`, se informado, transforma cada lote antes da gravação (ex.: pontuação pelo modelo),
+    e `after_write(batch)` é chamado com cada lote gravado (ex.: aviso de invalidação para a API de consulta);
+    `after_spool(batch)` recebe os lotes desviados para o spool e `after_failure(batch)` os que não foram
+    gravados nem foram para o spool. Num BulkWriteError, `after_write` recebe só os documentos inseridos.
+    `acknowledge(mid, qos)` confirma as mensagens MQTT de um lote só depois que ele foi gravado, foi para o
+    spool ou teve documentos recusados de forma definitiva; um lote perdido fica sem ACK e o broker o reenvia.
+    Com `max_pending` documentos pendentes, `add` espera a gravação liberar espaço.
+    """
+
+    def __init__(self, collection, batch_size=500, flush_interval_ms=200, spool=None, record_timings=True,
+                 before_write=None, after_write=None, acknowledge=None, max_pending=0, after_failure=None,
+                 after_spool=None):
+        self.collection = collection
+        self.spool = spool
+        self.before_write = before_write
+        self.after_write = after_write
+        self.after_failure = after_failure
+        self.after_spool = after_spool
+        self.acknowledge = acknowledge
+        self.record_timings = record_timings
+        self.batch_size = max(1, int(batch_size))
+        self.max_pending = max(self.batch_size, int(max_pending)) if max_pending else 0 # 0: sem limite
+        self.flush_interval = max(1, int(flush_interval_ms)) / 1000.0
+        self._docs = []
+        self._deliveries = [] # (mid, qos) de cada documento, ou None, na mesma ordem de _docs
+        self._lock = threading.Lock()        # protege a lista de documentos pendentes
+        self._space = threading.Condition(self._lock)
+        self._flush_lock = threading.Lock()  # serializa as gravações no MongoDB
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="mongo-write-buffer", daemon=True)
+        self.inserted = 0
+        self.failed = 0
+        self.spooled = 0
+        self.duplicates = 0 # Documentos com `_id` já gravado (reentregas que passaram pelo filtro em memória)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def add(self, doc, delivery=None):
+        """Enfileira um documento; acorda a thread de gravação se o lote estiver cheio.
+
+        `delivery` é o (mid, qos) da mensagem de origem, confirmada por `acknowledge` depois da gravação.
+        """
+        with self._space:
+            while self.max_pending and len(self._docs) >= self.max_pending and not self._stop.is_set():
+                self._wakeup.set()
+                self._space.wait(self.flush_interval)
+            self._docs.append(doc)
+            self._deliveries.append(delivery)
+            full = len(self._docs) >= self.batch_size
+        if full:
+            self._wakeup.set()
+
+    def pending(self):
+        with self._lock:
+            return len(self._docs)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                # A thread de gravação não pode morrer: sem ela o buffer só cresce
+                log.error("Erro inesperado ao descarregar o buffer de gravação: %s", e)
+
+    def flush(self):
+        """Grava todos os documentos pendentes em lotes de no máximo `batch_size`."""
+        with self._flush_lock:
+            with self._lock:
+                docs, self._docs = self._docs, []
+                deliveries, self._deliveries = self._deliveries, []
+                self._space.notify_all()
+            for start in range(0, len(docs), self.batch_size):
+                end = start + self.batch_size
+                if self._write(docs[start:end]):
+                    self._acknowledge(deliveries[start:end])
+                else:
+                    self._after_failure(docs[start:end])
+
+    def _acknowledge(self, deliveries):
+        if self.acknowledge is None:
+            return
+        for delivery in deliveries:
+            if delivery is not None:
+                try:
+                    self.acknowledge(*delivery)
+                except Exception as e:
+                    log.error("Erro ao confirmar mensagem %s: %s", delivery[0], e)
+
+    def _write(self, batch):
+        """Grava um lote; devolve True se ele chegou a um destino final (MongoDB ou spool)."""
+        if self.before_write is not None:
+            try:
+                batch = self.before_write(batch)
+            except Exception as e:
+                # Uma falha da pontuação (ou do despacho de comandos) não impede a gravação do lote
+                log.error("Erro no pré-gravação de um lote de %d documento(s); gravando sem ele: %s", len(batch), e)
+        if self.spool is not None and self.spool.active:
+            return self._to_spool(batch)
+        started = time.perf_counter_ns()
+        try:
+            result = self.collection.insert_many(batch, ordered=False)
+            self.inserted += len(result.inserted_ids)
+        except pymongo.errors.BulkWriteError as e:
+            # Com ordered=False os documentos válidos já foram gravados; apenas contabiliza as falhas.
+            details = e.details or {}
+            duplicates, rejected = count_write_errors(details)
+            self.inserted += details.get("nInserted", 0)
+            self.duplicates += duplicates
+            self.failed += rejected
+            if rejected:
+                log.warning("Falha parcial no insert_many: %d documento(s) rejeitado(s).", rejected)
+            # Recusados e já gravados (reentregas) ficam fora: os rollups não os somam de novo
+            self._after_write(inserted_documents(batch, details))
+            return True # Os recusados não passariam numa nova tentativa
+        except pymongo.errors.ConnectionFailure as e:
+            if self.spool is None:
+                self.failed += len(batch)
+                log.error("Erro ao gravar lote de %d documento(s) no MongoDB: %s", len(batch), e)
+                return False
+            # insert_many já atribuiu _id aos documentos: a reprodução do spool não os duplica
+            log.warning("MongoDB indisponível (%s); desviando as gravações para o spool local.", e)
+            self.spool.activate()
+            return self._to_spool(batch)
+        except Exception as e:
+            self.failed += len(batch)
+            log.error("Erro ao gravar lote de %d documento(s) no MongoDB: %s", len(batch), e)
+            return False
+        if self.record_timings:
+            finished = time.perf_counter_ns()
+            # Registrado por documento para ser comparável aos estágios de decodificação e validação
+            timer.record("store", finished - started, len(batch))
+            # Do recebimento do documento mais antigo do lote até a confirmação do MongoDB
+            timer.record_since("receive_to_store", batch[0].get("received_at"), len(batch))
+        self._after_write(batch)
+        return True
+
+    def _after_write(self, batch):
+        if self.after_write is None or not batch:
+            return
+        try:
+            self.after_write(batch)
+        except Exception as e:
+            log.error("Erro no pós-gravação de um lote de %d documento(s): %s", len(batch), e)
+
+    def _after_spool(self, batch):
+        if self.after_spool is None:
+            return
+        try:
+            self.after_spool(batch)
+        except Exception as e:
+            log.error("Erro no pós-spool de um lote de %d documento(s): %s", len(batch), e)
+
+    def _after_failure(self, batch):
+        if self.after_failure is None:
+            return
+        try:
+            self.after_failure(batch)
+        except Exception as e:
+            log.error("Erro ao tratar a falha de um lote de %d documento(s): %s", len(batch), e)
+
+    def _to_spool(self, batch):
+        try:
+            self.spool.append(batch)
+            self.spooled += len(batch)
+        except Exception as e:
+            self.failed += len(batch)
+            log.error("Erro ao gravar lote de %d documento(s) no spool: %s", len(batch), e)
+            return False
+        self._after_spool(batch)
+        return True
+
+    def close(self):
+        """Para a thread de gravação e descarrega o que ainda estiver pendente."""
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread.is_alive():
+            self._thread.join()
+        self.flush()